@@ -1,6 +1,17 @@
+import threading
+
 from django.apps import AppConfig
 
 
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from django_core.config import Config
+
+        if Config.WITH_DB_CONFIG and Config.WARM_LOOKUP_CACHES_ON_STARTUP:
+            from common.utils import warm_lookup_caches
+
+            # the language and static text tables are loaded in the background so that startup does not wait on the DB
+            threading.Thread(target=warm_lookup_caches, name="warm-lookup-caches", daemon=True).start()
@@ -6,10 +6,21 @@ Current User: lil-choco
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from language_service.kannada_corrector import enhance_kannada_transcription
+from common.http_client import run_async
+from common.tracing import traced
+from django_core.config import Config
+from language_service.asr import recognize, streaming_recognize
+from language_service.clients import get_speech_client
+from language_service.chunked_asr import (
+    a_transcribe_audio_chunks,
+    correct_transcript,
+    load_linear16_audio,
+    stitch_transcripts,
+)
+import functools
+import io
 import json
 import logging
-import tempfile
 import os
 import base64
 
@@ -57,74 +68,60 @@ except ImportError:
     print("⚠️ Pydub not available")
 
 
+def read_audio_data(request):
+    """
+    Return the audio bytes of the request: a multipart "audio" upload as it is, or the decoded base64 "audio" field.
+    """
+    uploaded_audio = request.FILES.get('audio')
+    if uploaded_audio is not None:
+        return uploaded_audio.read(), request.POST.get('language', 'en')
+
+    data = json.loads(request.body)
+    audio_base64 = data.get('audio')
+    if not audio_base64:
+        return None, data.get('language', 'en')
+
+    if ',' in audio_base64:
+        audio_base64 = audio_base64.split(',', 1)[1]
+    return base64.b64decode(audio_base64), data.get('language', 'en')
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def transcribe_audio(request):
     """Transcribe audio using Google Cloud Speech-to-Text with fallback"""
     try:
-        data = json.loads(request.body)
-        audio_base64 = data.get('audio')
-        user_language = data.get('language', 'en')
-        
-        if not audio_base64:
+        try:
+            audio_data, user_language = read_audio_data(request)
+        except Exception as decode_error:
+            logger.error(f"Base64 decode error: {decode_error}")
             return JsonResponse({
                 "success": False,
-                "error": "No audio data provided",
+                "error": "Invalid audio data",
                 "heard_input_query": "",
                 "confidence_score": 0
             }, status=400)
-        
-        # Decode base64 audio
-        try:
-            if ',' in audio_base64:
-                audio_data = base64.b64decode(audio_base64.split(',')[1])
-            else:
-                audio_data = base64.b64decode(audio_base64)
-        except Exception as decode_error:
-            logger.error(f"Base64 decode error: {decode_error}")
+
+        if not audio_data:
             return JsonResponse({
                 "success": False,
-                "error": "Invalid audio data",
+                "error": "No audio data provided",
                 "heard_input_query": "",
                 "confidence_score": 0
             }, status=400)
-        
-        # Save to temp file
-        temp_audio_path = tempfile.mktemp(suffix='.webm')
-        with open(temp_audio_path, 'wb') as f:
-            f.write(audio_data)
-        
+
         logger.info(f"Audio received: {len(audio_data)} bytes, language: {user_language}")
         
         # Try Google Cloud STT first
         if GOOGLE_SPEECH_AVAILABLE and speech_credentials:
             try:
                 logger.info("Attempting Google Cloud Speech-to-Text...")
-                transcription, confidence = transcribe_with_google_cloud(temp_audio_path, user_language)
+                transcription, confidence = transcribe_with_google_cloud(audio_data, user_language)
                 
                 if transcription:
-                    logger.info(f"📝 Raw Google Cloud STT: '{transcription}' (confidence: {confidence:.2%})")
-    
-                    # ✅ ENHANCE: Apply Kannada corrections if needed
-                    if user_language == 'kn':
-                        enhanced = enhance_kannada_transcription(transcription, user_language)
-        
-                        if enhanced['corrected']:
-                            logger.info(f"✅ Kannada correction applied: '{enhanced['text']}' (from '{transcription}')")
-                            transcription = enhanced['text']
-                            confidence = max(confidence, enhanced['confidence'])  # Use higher confidence
-            
-                            # Add note about correction
-                            correction_note = enhanced.get('correction_note', '')
-                        else:
-                            logger.info(f"✅ No correction needed: '{transcription}'")
-                            correction_note = ''
-    
+                    # the Kannada corrections are applied to each recognised chunk, see correct_transcript
                     logger.info(f"✅ Final transcription: '{transcription}' (confidence: {confidence:.2%})")
 
-                    if os.path.exists(temp_audio_path):
-                        os.remove(temp_audio_path)
-                    
                     return JsonResponse({
                         "success": True,
                         "heard_input_query": transcription,
@@ -140,13 +137,10 @@ def transcribe_audio(request):
         if SPEECH_RECOGNITION_AVAILABLE and PYDUB_AVAILABLE:
             try:
                 logger.info("Attempting Basic Speech Recognition...")
-                transcription, confidence = transcribe_with_basic_sr(temp_audio_path, user_language)
+                transcription, confidence = transcribe_with_basic_sr(audio_data, user_language)
                 
                 if transcription:
                     logger.info(f"Basic SR: '{transcription}' (confidence: {confidence:.2%})")
-                    if os.path.exists(temp_audio_path):
-                        os.remove(temp_audio_path)
-                    
                     return JsonResponse({
                         "success": True,
                         "heard_input_query": transcription,
@@ -158,10 +152,6 @@ def transcribe_audio(request):
             except Exception as sr_error:
                 logger.error(f"Basic SR failed: {sr_error}")
         
-        # Clean up
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
-        
         return JsonResponse({
             "success": False,
             "error": "Could not transcribe audio",
@@ -171,9 +161,6 @@ def transcribe_audio(request):
         
     except Exception as error:
         logger.error(f"Audio transcription error: {error}", exc_info=True)
-        if 'temp_audio_path' in locals() and os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
-        
         return JsonResponse({
             "success": False,
             "error": str(error),
@@ -182,7 +169,8 @@ def transcribe_audio(request):
         }, status=500)
 
 
-def transcribe_with_google_cloud(audio_path, language='en'):
+@traced("asr")
+def transcribe_with_google_cloud(audio_data, language='en'):
     """Transcribe with Google Cloud Speech-to-Text"""
     language_map = {
         'en': 'en-US',
@@ -198,25 +186,16 @@ def transcribe_with_google_cloud(audio_path, language='en'):
     gcloud_language = language_map.get(language, 'en-US')
     
     # Convert audio
+    audio = None
     if PYDUB_AVAILABLE:
         try:
-            audio = AudioSegment.from_file(audio_path)
-            audio = audio.set_frame_rate(16000).set_channels(1)
-            temp_wav_path = tempfile.mktemp(suffix='.wav')
-            audio.export(temp_wav_path, format='wav')
+            audio = load_linear16_audio(audio_data)
         except Exception as e:
             logger.error(f"Audio conversion failed: {e}")
             return None, 0.0
-    else:
-        temp_wav_path = audio_path
     
     try:
-        client = speech.SpeechClient(credentials=speech_credentials)
-        
-        with open(temp_wav_path, 'rb') as audio_file:
-            audio_content = audio_file.read()
-        
-        audio = speech.RecognitionAudio(content=audio_content)
+        client = get_speech_client("v1")
         
         config = speech.RecognitionConfig(
             encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
@@ -226,34 +205,40 @@ def transcribe_with_google_cloud(audio_path, language='en'):
             model='medical_conversation' if language == 'en' else 'default',
             use_enhanced=True,
         )
+        recognize_audio = functools.partial(recognize, client, config, speech_types=speech)
         
-        response = client.recognize(config=config, audio=audio)
-        
-        if temp_wav_path != audio_path and os.path.exists(temp_wav_path):
-            os.remove(temp_wav_path)
+        if audio is not None and len(audio) > Config.ASR_CHUNK_MAX_SECONDS * 1000:
+            # long voice notes are split on silence and the chunks recognised concurrently,
+            # each chunk corrected as soon as it is recognised
+            results = run_async(a_transcribe_audio_chunks(recognize_audio, audio, language))
+        else:
+            if audio is not None:
+                results = recognize_audio(audio.raw_data)
+            elif len(audio_data) > Config.ASR_LONG_AUDIO_MIN_BYTES:
+                results = streaming_recognize(client, config, audio_data, speech_types=speech)
+            else:
+                results = recognize_audio(audio_data)
+            results = [correct_transcript(transcript.strip(), confidence, language) for transcript, confidence in results]
         
-        if response.results:
-            result = response.results[0]
-            if result.alternatives:
-                transcription = result.alternatives[0].transcript
-                confidence = result.alternatives[0].confidence
-                return transcription, confidence
+        transcription, confidence = stitch_transcripts(results)
+        if transcription:
+            logger.info(f"📝 Google Cloud STT: '{transcription}' (confidence: {confidence:.2%})")
+            return transcription, confidence
         
         return None, 0.0
         
     except Exception as e:
         logger.error(f"Google Cloud STT error: {e}", exc_info=True)
-        if temp_wav_path != audio_path and os.path.exists(temp_wav_path):
-            os.remove(temp_wav_path)
         raise
 
 
-def transcribe_with_basic_sr(audio_path, language='en'):
+@traced("asr")
+def transcribe_with_basic_sr(audio_data, language='en'):
     """Transcribe with basic speech recognition"""
     try:
-        audio = AudioSegment.from_file(audio_path)
-        temp_wav_path = tempfile.mktemp(suffix='.wav')
-        audio.export(temp_wav_path, format='wav')
+        wav_buffer = io.BytesIO()
+        AudioSegment.from_file(io.BytesIO(audio_data)).export(wav_buffer, format='wav')
+        wav_buffer.seek(0)
     except Exception as e:
         logger.error(f"Audio conversion failed: {e}")
         return None, 0.0
@@ -261,26 +246,19 @@ def transcribe_with_basic_sr(audio_path, language='en'):
     try:
         recognizer = sr.Recognizer()
         
-        with sr.AudioFile(temp_wav_path) as source:
+        with sr.AudioFile(wav_buffer) as source:
             recognizer.adjust_for_ambient_noise(source, duration=0.5)
             audio_data = recognizer.record(source)
         
         transcription = recognizer.recognize_google(audio_data, language=language)
         confidence = 0.75
         
-        if os.path.exists(temp_wav_path):
-            os.remove(temp_wav_path)
-        
         return transcription, confidence
         
     except sr.UnknownValueError:
         logger.warning("Could not understand audio")
-        if os.path.exists(temp_wav_path):
-            os.remove(temp_wav_path)
         return None, 0.0
         
     except Exception as e:
         logger.error(f"Basic SR error: {e}")
-        if os.path.exists(temp_wav_path):
-            os.remove(temp_wav_path)
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,183 @@
+"""
+Async chat endpoints served natively on the ASGI event loop
+"""
+import json
+import logging
+
+from api.utils import a_process_query, a_stream_query, authenticate_user_based_on_email
+from asgiref.sync import sync_to_async
+from common.tracing import render_prometheus_metrics
+from database.database_config import get_pool_stats
+from database.write_behind import write_behind_queue
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django_core.config import handle_boolean
+from generation.stream_response import format_sse_event
+from language_service.tts_stream import add_speech_events
+from rag_service.answer_cache import answer_cache
+from rest_framework import status
+
+logger = logging.getLogger(__name__)
+
+
+def parse_request_data(request):
+    """
+    Parse the JSON or form-data body of a request into a dict.
+    """
+    if request.content_type == "application/json":
+        return json.loads(request.body) if request.body else {}
+    return request.POST.dict()
+
+
+async def get_answer_for_text_query(request):
+    """
+    Generate answer for a given user query without blocking a worker thread for the whole request.
+    """
+    if request.method != "POST":
+        return JsonResponse(
+            {"error": "Method not allowed", "allowed_methods": ["POST"]},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+
+    response_data = {"message": None, "query": None, "error": False}
+    response_status = status.HTTP_200_OK
+
+    try:
+        data = parse_request_data(request)
+        email_id = data.get("email_id")
+        original_query = data.get("query")
+        response_data["query"] = original_query
+
+        # check for authenticated user using email
+        authenticated_user = await sync_to_async(authenticate_user_based_on_email, thread_sensitive=False)(email_id)
+
+        if not authenticated_user:
+            response_data["message"] = "Invalid Email ID"
+            return JsonResponse(response_data, status=status.HTTP_401_UNAUTHORIZED)
+
+        if not original_query:
+            response_data["message"] = "Please submit a query."
+            return JsonResponse(response_data, status=status.HTTP_400_BAD_REQUEST)
+
+        response_map = await a_process_query(original_query, email_id, authenticated_user)
+
+        # update actual response body
+        response_data.update(
+            {
+                "message": "Successful retrieval of response for above query",
+                "message_id": response_map.get("message_id"),
+                "response": response_map.get("translated_response"),
+                "source": response_map.get("source", None),
+                "follow_up_questions": response_map.get("follow_up_questions"),
+            }
+        )
+
+    except Exception as error:
+        logger.error(error, exc_info=True)
+        response_data.update({"message": "Something went wrong", "error": True})
+        response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    return JsonResponse(response_data, status=response_status)
+
+
+async def stream_answer_for_text_query(request):
+    """
+    Stream the answer for a given user query as server-sent events while it is being generated.
+    Events: start, answer (response text in the user's language), follow_up_questions, done or error.
+    With "with_audio", each answer sentence is also synthesised and sent as an ordered audio event.
+    """
+    if request.method != "POST":
+        return JsonResponse(
+            {"error": "Method not allowed", "allowed_methods": ["POST"]},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+
+    response_data = {"message": None, "query": None, "error": False}
+
+    try:
+        data = parse_request_data(request)
+        email_id = data.get("email_id")
+        original_query = data.get("query")
+        with_audio = handle_boolean(data.get("with_audio", False))
+        response_data["query"] = original_query
+
+        # check for authenticated user using email
+        authenticated_user = await sync_to_async(authenticate_user_based_on_email, thread_sensitive=False)(email_id)
+
+        if not authenticated_user:
+            response_data["message"] = "Invalid Email ID"
+            return JsonResponse(response_data, status=status.HTTP_401_UNAUTHORIZED)
+
+        if not original_query:
+            response_data["message"] = "Please submit a query."
+            return JsonResponse(response_data, status=status.HTTP_400_BAD_REQUEST)
+
+    except Exception as error:
+        logger.error(error, exc_info=True)
+        response_data.update({"message": "Something went wrong", "error": True})
+        return JsonResponse(response_data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def event_stream():
+        events = a_stream_query(original_query, email_id, authenticated_user)
+        if with_audio:
+            events = add_speech_events(events)
+        async for event, event_data in events:
+            yield format_sse_event(event, event_data)
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def semantic_cache_stats(request):
+    """
+    Report the size and hit rate of the semantic answer cache.
+    """
+    if request.method != "GET":
+        return JsonResponse(
+            {"error": "Method not allowed", "allowed_methods": ["GET"]},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+
+    return JsonResponse(answer_cache.stats(), status=status.HTTP_200_OK)
+
+
+# Django 4.2's csrf_exempt wraps views in a sync function, so the flag is set directly to keep the views as coroutines.
+get_answer_for_text_query.csrf_exempt = True
+stream_answer_for_text_query.csrf_exempt = True
+
+
+async def pipeline_metrics(request):
+    """
+    Export the per-stage latency, retry and token metrics in the Prometheus text format.
+    """
+    if request.method != "GET":
+        return JsonResponse(
+            {"error": "Method not allowed", "allowed_methods": ["GET"]},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+
+    payload, content_type = render_prometheus_metrics()
+    if payload is None:
+        return JsonResponse(
+            {"error": "Prometheus metrics are not enabled"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return HttpResponse(payload, content_type=content_type)
+
+
+async def db_pool_stats(request):
+    """
+    Report the usage of the pooled DB connections and the write-behind queue.
+    """
+    if request.method != "GET":
+        return JsonResponse(
+            {"error": "Method not allowed", "allowed_methods": ["GET"]},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+
+    return JsonResponse(
+        {"pool": get_pool_stats(), "write_behind": write_behind_queue.stats()},
+        status=status.HTTP_200_OK,
+    )
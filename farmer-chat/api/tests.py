@@ -1,3 +1,323 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from contextlib import nullcontext
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, SimpleTestCase, override_settings
+from django.urls import path
+from django_core.config import Config
+
+from api import utils as api_utils
+from api.chat_endpoint import get_answer_for_text_query
+from common.chat_history import SUMMARY_MODE_LLM, ChatHistoryStore
+from database.write_behind import WriteBatch, WriteBehindQueue
+
+
+class FakeWriteBatch(WriteBatch):
+    """A batch whose writes fail the first fail_times executions"""
+
+    def __init__(self, user_id=None, fail_times=0):
+        super().__init__(user_id=user_id)
+        self.operations = [("insert", None, {})]
+        self.fail_times = fail_times
+        self.executions = 0
+        self.written = False
+
+    def execute(self):
+        self.executions += 1
+        if self.executions <= self.fail_times:
+            raise RuntimeError("write failed")
+        self.written = True
+
+
+@patch("database.write_behind.connection_context", nullcontext)
+@patch("database.write_behind.db_conn", MagicMock(atomic=nullcontext))
+class WriteBehindFlushTests(SimpleTestCase):
+    def build_queue(self, max_retries=2):
+        return WriteBehindQueue(max_retries=max_retries, retry_backoff=0)
+
+    def test_batches_are_written_in_one_flush(self):
+        write_queue = self.build_queue()
+        batches = [FakeWriteBatch(), FakeWriteBatch()]
+        write_queue.flush_batches(batches)
+
+        self.assertTrue(all(batch.written for batch in batches))
+        self.assertEqual(write_queue.stats()["flushed_batches"], 2)
+        self.assertEqual(write_queue.stats()["failed_batches"], 0)
+
+    def test_failing_batch_does_not_drop_the_others(self):
+        write_queue = self.build_queue(max_retries=2)
+        good_batch, bad_batch = FakeWriteBatch(), FakeWriteBatch(fail_times=100)
+        write_queue.flush_batches([good_batch, bad_batch])
+
+        self.assertTrue(good_batch.written)
+        self.assertFalse(bad_batch.written)
+        # one attempt in the group flush, then max_retries + 1 on its own
+        self.assertEqual(bad_batch.executions, 1 + 3)
+        self.assertTrue(bad_batch.done.is_set())
+        stats = write_queue.stats()
+        self.assertEqual((stats["flushed_batches"], stats["failed_batches"]), (1, 1))
+        self.assertEqual(stats["retried_flushes"], 2)
+
+    def test_failing_batch_is_retried_until_written(self):
+        write_queue = self.build_queue(max_retries=2)
+        batch = FakeWriteBatch(fail_times=2)
+        callback = MagicMock()
+        batch.on_commit(callback)
+        write_queue.flush_batches([batch])
+
+        self.assertTrue(batch.written)
+        callback.assert_called_once_with()
+        self.assertEqual(write_queue.stats()["failed_batches"], 0)
+
+    def test_commit_callbacks_do_not_run_for_dropped_batches(self):
+        write_queue = self.build_queue(max_retries=0)
+        batch = FakeWriteBatch(fail_times=1)
+        callback = MagicMock()
+        batch.on_commit(callback)
+        write_queue.flush_batches([batch])
+
+        callback.assert_not_called()
+
+    def test_claimed_batch_is_written_once(self):
+        write_queue = self.build_queue()
+        batch = FakeWriteBatch()
+        write_queue.flush_batches([batch])
+        write_queue.flush_batches([batch])
+
+        self.assertEqual(batch.executions, 1)
+
+    def test_flush_user_writes_only_their_pending_batches(self):
+        write_queue = self.build_queue()
+        user_batch, other_batch = FakeWriteBatch(user_id="1"), FakeWriteBatch(user_id="2")
+        write_queue._track(user_batch)
+        write_queue._track(other_batch)
+        write_queue.flush_user("1", timeout=0)
+
+        self.assertTrue(user_batch.written)
+        self.assertFalse(other_batch.written)
+        self.assertNotIn("1", write_queue._pending_by_user)
+        self.assertIn("2", write_queue._pending_by_user)
+
+
+class ProcessQueryTests(SimpleTestCase):
+    """The text query pipeline, with its DB, translation, profile and RAG helpers replaced"""
+
+    def setUp(self):
+        self.loops = []
+        self.user_data = {"user_id": 1, "user_name": "Asha", "message_id": "message-1"}
+        self.chat_history = [{"role": "user", "content": "hello"}]
+        self.rag_result = (
+            {"generated_final_response": "Drink fluids.", "stage_timings": {}},
+            {"rephrased_query": "fever"},
+        )
+        self.post_translation_result = ("Neeru kudiyiri.", "Drink fluids.", [{"question": "More?"}], [])
+
+        def on_loop(result):
+            async def record_loop(*args, **kwargs):
+                self.loops.append(asyncio.get_running_loop())
+                return result
+
+            return record_loop
+
+        patches = {
+            "preprocess_user_data": MagicMock(return_value=(self.user_data, SimpleNamespace())),
+            "get_user_chat_history": MagicMock(return_value=self.chat_history),
+            "detect_language_and_translate_to_english": AsyncMock(side_effect=on_loop(("I have fever", "kn"))),
+            "get_user_profile_from_db": AsyncMock(side_effect=on_loop({"first_name": "Asha K"})),
+            "a_execute_rag_pipeline": AsyncMock(side_effect=on_loop(self.rag_result)),
+            "postprocess_and_translate_query_response": AsyncMock(side_effect=on_loop(self.post_translation_result)),
+            "a_append_chat_history_turn": AsyncMock(),
+            "save_message_obj": MagicMock(),
+            "save_trace_metrics": MagicMock(),
+            "start_write_batch": MagicMock(return_value=None),
+            "submit_write_batch": MagicMock(),
+        }
+        self.mocks = {}
+        for name, mock in patches.items():
+            patcher = patch.object(api_utils, name, mock)
+            self.mocks[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_query_is_answered_within_one_event_loop(self):
+        response_map = await api_utils.a_process_query("nanage jwara", "asha@example.com", {"first_name": "Asha"})
+
+        self.assertEqual(set(self.loops), {asyncio.get_running_loop()})
+        self.mocks["a_execute_rag_pipeline"].assert_awaited_once_with(
+            "I have fever",
+            "kn",
+            "asha@example.com",
+            user_name="Asha K",
+            message_id="message-1",
+            chat_history=self.chat_history,
+            user_profile={"first_name": "Asha K"},
+        )
+        self.mocks["postprocess_and_translate_query_response"].assert_awaited_once_with(
+            "Drink fluids.", "kn", "message-1"
+        )
+        self.assertEqual(response_map["translated_response"], "Neeru kudiyiri.")
+        self.assertEqual(response_map["final_response"], "Drink fluids.")
+        self.assertEqual(response_map["follow_up_questions"], [{"question": "More?"}])
+        self.assertTrue(
+            {"user_data", "translation", "user_profile", "chat_history", "rag", "post_translation"}
+            <= set(response_map["stage_timings"])
+        )
+
+    async def test_message_is_saved_once_the_query_is_answered(self):
+        await api_utils.a_process_query("nanage jwara", "asha@example.com", {"first_name": "Asha"})
+
+        message_id, message_data = self.mocks["save_message_obj"].call_args.args
+        self.assertEqual(message_id, "message-1")
+        self.assertEqual(message_data["translated_message"], "I have fever")
+        self.assertEqual(message_data["input_language_detected"], "kn")
+        self.assertEqual(message_data["message_response"], "Drink fluids.")
+        self.assertEqual(message_data["rephrased_query"], "fever")
+        self.mocks["a_append_chat_history_turn"].assert_awaited_once_with(1, "I have fever", "Drink fluids.")
+        self.mocks["submit_write_batch"].assert_called_once_with(None)
+
+    async def test_failed_translation_falls_back_to_the_original_query(self):
+        self.mocks["detect_language_and_translate_to_english"].side_effect = RuntimeError("translation failed")
+
+        response_map = await api_utils.a_process_query("what is fever", "asha@example.com", {"first_name": "Asha"})
+
+        self.assertEqual(self.mocks["a_execute_rag_pipeline"].await_args.args[:2], ("what is fever", "en"))
+        self.assertEqual(response_map["final_response"], "Drink fluids.")
+
+    def test_sync_entry_point_runs_the_pipeline(self):
+        response_map = api_utils.process_query("nanage jwara", "asha@example.com", {"first_name": "Asha"})
+
+        self.assertEqual(response_map["translated_response"], "Neeru kudiyiri.")
+        self.assertEqual(len(set(self.loops)), 1)
+
+
+class ChatHistoryAppendTests(SimpleTestCase):
+    async def test_redis_calls_run_off_the_event_loop_and_the_summary_on_it(self):
+        store = ChatHistoryStore(summary_mode=SUMMARY_MODE_LLM)
+        store._client = MagicMock()
+        append_threads = []
+
+        def append_turn(user_id, user_message, assistant_message):
+            append_threads.append(threading.get_ident())
+            return ["old turn"], 2, "old summary"
+
+        with patch.object(store, "append_turn", side_effect=append_turn), patch.object(
+            store, "a_llm_summary", new_callable=AsyncMock
+        ) as a_llm_summary:
+            await store.a_append_turn(1, "I have fever", "Drink fluids.")
+            await asyncio.gather(*list(store._summary_tasks))
+
+        self.assertEqual(len(append_threads), 1)
+        self.assertNotEqual(append_threads[0], threading.get_ident())
+        a_llm_summary.assert_awaited_once_with(1, 2, "old summary", ["old turn"])
+
+
+class GetAnswerForTextQueryTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    def post(self, data):
+        return self.factory.post(
+            "/api/chat/get_answer_for_text_query/", data=json.dumps(data), content_type="application/json"
+        )
+
+    def test_view_is_a_coroutine(self):
+        self.assertTrue(iscoroutinefunction(get_answer_for_text_query))
+
+    @patch("api.chat_endpoint.authenticate_user_based_on_email", return_value={"first_name": "Asha"})
+    @patch("api.chat_endpoint.a_process_query", new_callable=AsyncMock)
+    async def test_answer_is_returned(self, a_process_query, authenticate_user_based_on_email):
+        a_process_query.return_value = {"translated_response": "Neeru kudiyiri.", "follow_up_questions": []}
+
+        response = await get_answer_for_text_query(self.post({"email_id": "asha@example.com", "query": "jwara"}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["response"], "Neeru kudiyiri.")
+        a_process_query.assert_awaited_once_with("jwara", "asha@example.com", {"first_name": "Asha"})
+
+    @patch("api.chat_endpoint.authenticate_user_based_on_email", return_value=None)
+    async def test_unknown_user_is_rejected(self, authenticate_user_based_on_email):
+        response = await get_answer_for_text_query(self.post({"email_id": "nobody", "query": "jwara"}))
+        self.assertEqual(response.status_code, 401)
+
+    @patch("api.chat_endpoint.authenticate_user_based_on_email", return_value={"first_name": "Asha"})
+    async def test_empty_query_is_rejected(self, authenticate_user_based_on_email):
+        response = await get_answer_for_text_query(self.post({"email_id": "asha@example.com", "query": ""}))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_only_post_is_allowed(self):
+        response = await get_answer_for_text_query(self.factory.get("/api/chat/get_answer_for_text_query/"))
+        self.assertEqual(response.status_code, 405)
+
+
+class FakeDatabase:
+    """Thread-local connection state, as peewee keeps it"""
+
+    def __init__(self):
+        self.state = threading.local()
+        self.events = []
+
+    def is_closed(self):
+        return not getattr(self.state, "connected", False)
+
+    def connect(self):
+        self.state.connected = True
+        self.events.append(("connect", threading.get_ident()))
+
+    def close(self):
+        self.state.connected = False
+        self.events.append(("close", threading.get_ident()))
+
+
+fake_database = FakeDatabase()
+
+
+def sync_view(request):
+    fake_database.events.append(("view", threading.get_ident(), fake_database.is_closed()))
+    return HttpResponse()
+
+
+async def async_view(request):
+    fake_database.events.append(("async view",))
+    return HttpResponse()
+
+
+urlpatterns = [path("sync/", sync_view), path("async/", async_view)]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+@patch.object(Config, "WITH_DB_CONFIG", True)
+@patch("database.middleware.db_conn", fake_database)
+class DatabaseConnectionMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        fake_database.events.clear()
+
+    def assert_connection_held_by_the_view(self):
+        (connect, thread_id), (view, view_thread_id, is_closed), (close, close_thread_id) = fake_database.events
+        self.assertEqual((connect, view, close), ("connect", "view", "close"))
+        self.assertEqual({thread_id, view_thread_id, close_thread_id}, {thread_id})
+        self.assertFalse(is_closed)
+
+    async def test_async_view_is_awaited_directly_without_a_connection(self):
+        with patch("django.core.handlers.base.async_to_sync", wraps=async_to_sync) as django_async_to_sync:
+            response = await self.async_client.get("/async/")
+
+        self.assertEqual(response.status_code, 200)
+        # a sync only middleware makes Django wrap the async view in async_to_sync
+        django_async_to_sync.assert_not_called()
+        self.assertEqual(fake_database.events, [("async view",)])
+
+    async def test_sync_view_holds_a_connection_in_its_thread_under_asgi(self):
+        response = await self.async_client.get("/sync/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assert_connection_held_by_the_view()
+
+    def test_sync_view_holds_a_connection_under_wsgi(self):
+        response = self.client.get("/sync/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assert_connection_held_by_the_view()
@@ -6,7 +6,8 @@ import logging
 logger = logging.getLogger(__name__)
 
 # Import the TTS processing function
-from api.utils import process_output_audio
+from api.utils import process_output_audio, process_output_audio_segments
+from django_core.config import handle_boolean
 
 @csrf_exempt
 def synthesise_audio(request):
@@ -35,6 +36,7 @@ def synthesise_audio(request):
             original_text = data.get('text', '')
             message_id = data.get('message_id', None)
             email_id = data.get('email_id', 'user@servvia.com')
+            segmented = data.get('segmented', False)
             
             # Handle list values (from form data)
             if isinstance(original_text, list):
@@ -43,6 +45,8 @@ def synthesise_audio(request):
                 message_id = message_id[0] if message_id else None
             if isinstance(email_id, list):
                 email_id = email_id[0] if email_id else 'user@servvia.com'
+            if isinstance(segmented, list):
+                segmented = segmented[0] if segmented else False
             
             logger.info(f"TTS:  Processing '{original_text[: 50]}...'")
             
@@ -54,6 +58,27 @@ def synthesise_audio(request):
                     "audio":  None
                 }, status=400)
 
+            # Ordered per-sentence audio segments, so that playback can start with the first sentence
+            if handle_boolean(segmented):
+                audio_segments = process_output_audio_segments(original_text, message_id)
+
+                if not any(segment.get("audio") for segment in audio_segments):
+                    logger.error("Failed to generate audio segments")
+                    return JsonResponse({
+                        "success": False,
+                        "error": True,
+                        "message": "Unable to generate audio currently.",
+                        "audio_segments": []
+                    }, status=500)
+
+                return JsonResponse({
+                    "success": True,
+                    "error": False,
+                    "text": original_text,
+                    "audio_segments": audio_segments,
+                    "message": "Audio synthesis successful"
+                })
+
             # Process the text to audio
             response_audio = process_output_audio(original_text, message_id)
 
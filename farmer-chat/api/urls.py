@@ -6,6 +6,13 @@ from django.http import JsonResponse
 # Import your views
 from api.views import ChatAPIViewSet, LanguageViewSet
 from api.audio_endpoint import transcribe_audio
+from api.chat_endpoint import (
+    db_pool_stats,
+    get_answer_for_text_query,
+    pipeline_metrics,
+    semantic_cache_stats,
+    stream_answer_for_text_query,
+)
 from api.tts_endpoint import synthesise_audio
 from language_service.tts import get_supported_languages
 
@@ -29,6 +36,15 @@ urlpatterns = [
     path("/synthesise_audio/", synthesise_audio, name="synthesise-audio"),
     path("speech/synthesize/", synthesise_audio, name="speech-synthesize"),
 
+    # ============================================================
+    # ASYNC CHAT ENDPOINTS (served on the ASGI event loop)
+    # ============================================================
+    path("chat/get_answer_for_text_query/", get_answer_for_text_query, name="get-answer-for-text-query"),
+    path("chat/stream_answer_for_text_query/", stream_answer_for_text_query, name="stream-answer-for-text-query"),
+    path("chat/semantic_cache_stats/", semantic_cache_stats, name="semantic-cache-stats"),
+    path("metrics/", pipeline_metrics, name="pipeline-metrics"),
+    path("chat/db_pool_stats/", db_pool_stats, name="db-pool-stats"),
+
     # ============================================================
     # LANGUAGE SUPPORT ENDPOINT
     # ============================================================
@@ -1,15 +1,17 @@
-import asyncio
 import datetime
 import json
 import logging
-import os
-import uuid
 
+from asgiref.sync import sync_to_async
 from common.constants import Constants
+from common.http_client import run_async
+from common.tracing import start_trace
 from common.utils import (
+    a_append_chat_history_turn,
+    build_follow_up_questions,
     create_or_update_user_by_email,
     decode_base64_to_binary,
-    encode_binary_to_base64,
+    encode_bytes_to_base64,
     fetch_corresponding_multilingual_text,
     fetch_multilingual_texts_for_static_text_messages,
     get_message_object_by_id,
@@ -25,16 +27,23 @@ from common.utils import (
 from database.database_config import db_conn
 from database.db_operations import update_record
 from database.models import User
+from database.write_behind import get_current_write_batch, start_write_batch, submit_write_batch
 from django_core.config import Config
+from generation.generate_response import get_user_profile_from_db
+from generation.stream_response import FollowUpQuestionSplitter, stream_translated_answer
 from intent_classification.intent import process_user_intent
 from language_service.asr import transcribe_and_translate
 from language_service.translation import (
+    a_translate_batch_to,
     a_translate_to,
     detect_language_and_translate_to_english,
 )
-from language_service.tts import synthesize_speech
+from language_service.tts import synthesize_speech_bytes
+from language_service.tts_stream import synthesize_text_segments
 from language_service.utils import get_language_by_id
-from rag_service.execute_rag import execute_rag_pipeline
+from rag_service.execute_rag import a_execute_rag_pipeline, a_stream_rag_pipeline
+from rag_service.stage_scheduler import StageScheduler
+from rag_service.utils import save_trace_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -62,7 +71,7 @@ def authenticate_user_based_on_email(email_id):
             data={"email": email_id},
             content_type="JSON",
             request_type="POST",
-            total_retry=3,
+            endpoint="authentication",
         )
         authenticated_user = (
             json.loads(response.text)
@@ -98,6 +107,9 @@ def preprocess_user_data(
             )
             user_id = user_obj.id
             user_name = user_obj.first_name
+            write_batch = get_current_write_batch()
+            if write_batch is not None:
+                write_batch.user_id = str(user_id)
 
             conversation_obj = get_or_create_latest_conversation(
                 {"user_id": user_id, "title": original_query}
@@ -119,87 +131,131 @@ def preprocess_user_data(
     return user_data, message_obj
 
 
-def process_query(original_query, email_id, authenticated_user={}):
+def add_query_preprocessing_stages(
+    scheduler, original_query, email_id, authenticated_user, message_data_to_insert_or_update
+):
     """
-    Process query with user profile integration and RAG pipeline (no intent gating).
+    Register the stages that prepare a query for the RAG pipeline: the message row, input translation,
+    the health profile and the chat history. Input translation timings are written to message_data_to_insert_or_update.
+    """
+
+    async def user_data_stage():
+        return await sync_to_async(preprocess_user_data, thread_sensitive=False)(
+            original_query, email_id, authenticated_user
+        )
+
+    async def translation_stage():
+        message_data_to_insert_or_update["input_translation_start_time"] = datetime.datetime.now()
+        translation = await detect_language_and_translate_to_english(original_query)
+        message_data_to_insert_or_update["input_translation_end_time"] = datetime.datetime.now()
+        return translation
+
+    async def user_profile_stage():
+        return await get_user_profile_from_db(email_id) if email_id else None
+
+    async def chat_history_stage(user_data):
+        user_id = user_data[0].get("user_id", None)
+        if not user_id:
+            return None
+        return await sync_to_async(get_user_chat_history, thread_sensitive=False)(user_id)
+
+    # translation, the health profile and the message row are independent, so they are started together
+    scheduler.add_stage("user_data", user_data_stage, default=({}, None))
+    scheduler.add_stage("translation", translation_stage, default=(original_query, "en"))
+    scheduler.add_stage("user_profile", user_profile_stage)
+    scheduler.add_stage("chat_history", chat_history_stage, depends_on=("user_data",))
+
+
+def get_profile_user_name(user_name, user_profile, email_id):
+    """
+    Prefer the first name of the health profile for personalized responses.
+    """
+    if user_profile:
+        if user_profile.get("first_name"):
+            user_name = user_profile.get("first_name")
+
+        logger.info(f"Loaded profile for {email_id}: {user_profile.get('first_name')}")
+        if user_profile.get("allergies"):
+            logger.info(f"User allergies: {user_profile['allergies']}")
+    else:
+        logger.info(f"No profile found for {email_id}")
+    return user_name
+
+
+async def a_process_query(original_query, email_id, authenticated_user={}):
     """
-    message_obj, chat_history = None, None
+    Process query with user profile integration and RAG pipeline (no intent gating) within a single event loop.
+    """
+    message_obj, message_id, chat_history = None, None, None
     (response_map, message_data_to_insert_or_update, message_data_update_post_rag_pipeline) = ({}, {}, {})
-    
+    trace = start_trace()
+    write_batch = start_write_batch()
+
     try:
         logger.info(f"Processing query for {email_id}: {original_query}")
-        
-        user_data, message_obj = preprocess_user_data(original_query, email_id, authenticated_user)
 
-        user_id = user_data.get("user_id", None)
-        user_name = user_data.get("user_name", None)
-        message_id = user_data.get("message_id", None)
-        chat_history = get_user_chat_history(user_id) if user_id else None
+        async def rag_stage(user_data, translation, user_profile, chat_history):
+            query_in_english, input_language_detected = translation
+            logger.info(f"Detected language: {input_language_detected}")
 
-        # Translate to English
-        message_data_to_insert_or_update["input_translation_start_time"] = datetime.datetime.now()
-        query_in_english, input_language_detected = asyncio.run(
-            detect_language_and_translate_to_english(original_query)
-        )
-        logger.info(f"Detected language: {input_language_detected}")
-        
-        message_data_to_insert_or_update["translated_message"] = query_in_english
-        message_data_to_insert_or_update["input_translation_end_time"] = datetime.datetime.now()
-        message_data_to_insert_or_update["input_language_detected"] = input_language_detected
+            message_id = user_data[0].get("message_id", None)
 
-        # BYPASS INTENT GATING - Always use RAG
-        proceed_to_rag = True
-        logger.info("Intent gating bypassed; executing RAG pipeline.")
+            # BYPASS INTENT GATING - Always use RAG
+            logger.info("Intent gating bypassed; executing RAG pipeline.")
 
-        if proceed_to_rag:
             # Load user profile for personalized responses
-            user_profile_data = None
-            if email_id:
-                try:
-                    from user_profile.models import UserProfile
-                    profile = UserProfile.objects.get(email=email_id)
-                    user_profile_data = {
-                        'allergies': profile.get_allergies_list(),
-                        'medical_conditions': profile.get_conditions_list(),
-                        'current_medications': profile.get_medications_list(),
-                        'first_name': profile.first_name,
-                    }
-                    if profile.first_name:
-                        user_name = profile.first_name
-                        
-                    logger.info(f"Loaded profile for {email_id}: {profile.first_name}")
-                    if user_profile_data.get('allergies'):
-                        logger.info(f"User allergies: {user_profile_data['allergies']}")
-                except Exception as e:
-                    logger.info(f"No profile found for {email_id}: {e}")
-                    user_profile_data = None
-            
+            user_name = get_profile_user_name(user_data[0].get("user_name", None), user_profile, email_id)
+
             # Execute RAG pipeline with user profile
-            response_map, message_data_update_post_rag_pipeline = execute_rag_pipeline(
+            return await a_execute_rag_pipeline(
                 query_in_english,
                 input_language_detected,
                 email_id,
                 user_name=user_name,
                 message_id=message_id,
                 chat_history=chat_history,
-                user_profile=user_profile_data,
+                user_profile=user_profile,
             )
-        else:
-            response_map.update({"generated_final_response": None})
 
-        # Translate response back to input language
+        async def post_translation_stage(user_data, translation, rag):
+            # Translate response back to input language
+            return await postprocess_and_translate_query_response(
+                rag[0].get("generated_final_response"),
+                translation[1],
+                str(user_data[0].get("message_id", None)),
+            )
+
+        scheduler = StageScheduler()
+        add_query_preprocessing_stages(
+            scheduler, original_query, email_id, authenticated_user, message_data_to_insert_or_update
+        )
+        scheduler.add_stage(
+            "rag",
+            rag_stage,
+            depends_on=("user_data", "translation", "user_profile", "chat_history"),
+            default=({"generated_final_response": None}, {}),
+        )
+        scheduler.add_stage(
+            "post_translation",
+            post_translation_stage,
+            depends_on=("user_data", "translation", "rag"),
+            default=(None, None, None, None),
+        )
+        stage_results = await scheduler.run()
+
+        user_data, message_obj = stage_results["user_data"]
+        message_id = user_data.get("message_id", None)
+        query_in_english, input_language_detected = stage_results["translation"]
+        response_map, message_data_update_post_rag_pipeline = stage_results["rag"]
         (
             translated_response,
             final_response,
             follow_up_question_options,
             follow_up_question_data_to_insert,
-        ) = asyncio.run(
-            postprocess_and_translate_query_response(
-                response_map.get("generated_final_response"),
-                input_language_detected,
-                str(message_id),
-            )
-        )
+        ) = stage_results["post_translation"]
+
+        message_data_to_insert_or_update["translated_message"] = query_in_english
+        message_data_to_insert_or_update["input_language_detected"] = input_language_detected
 
         response_map.update(
             {
@@ -207,39 +263,156 @@ def process_query(original_query, email_id, authenticated_user={}):
                 "final_response": final_response,
                 "source": response_map.get("source", None),
                 "follow_up_questions": follow_up_question_options,
+                "stage_timings": {**response_map.get("stage_timings", {}), **scheduler.stage_timings},
             }
         )
 
         message_data_to_insert_or_update["message_response"] = final_response
         message_data_to_insert_or_update["message_translated_response"] = translated_response
         message_data_to_insert_or_update.update(message_data_update_post_rag_pipeline)
-        
+        await a_append_chat_history_turn(user_data.get("user_id", None), query_in_english, final_response)
+
         logger.info(f"Query processed successfully for {email_id}")
 
     except Exception as error:
         logger.error(error, exc_info=True)
     finally:
         if message_obj and message_id:
-            save_message_obj(message_id, message_data_to_insert_or_update)
+            await sync_to_async(save_message_obj, thread_sensitive=False)(message_id, message_data_to_insert_or_update)
+            await sync_to_async(save_trace_metrics, thread_sensitive=False)(trace, message_id)
+        # the collected writes are flushed by the write-behind worker, off the response path
+        submit_write_batch(write_batch)
+        logger.info(f"Query trace {trace.trace_id}: {trace.summary()}")
     return response_map
 
 
+def process_query(original_query, email_id, authenticated_user={}):
+    """
+    Process query with user profile integration and RAG pipeline (no intent gating).
+    Sync entrypoint for callers outside an event loop; the whole query runs in one event loop.
+    """
+    return run_async(a_process_query(original_query, email_id, authenticated_user))
+
+
+async def a_stream_query(original_query, email_id, authenticated_user={}, with_db_config=Config.WITH_DB_CONFIG):
+    """
+    Process query like a_process_query, yielding (event, data) pairs while the response is generated:
+    "start", then "answer" events with response text in the user's language as it is produced,
+    then "follow_up_questions" and "done" (or "error").
+    """
+    message_obj, message_id = None, None
+    message_data_to_insert_or_update = {}
+    trace = start_trace()
+    write_batch = start_write_batch()
+
+    try:
+        logger.info(f"Streaming query for {email_id}: {original_query}")
+
+        scheduler = StageScheduler()
+        add_query_preprocessing_stages(
+            scheduler, original_query, email_id, authenticated_user, message_data_to_insert_or_update
+        )
+        stage_results = await scheduler.run()
+
+        user_data, message_obj = stage_results["user_data"]
+        message_id = user_data.get("message_id", None)
+        query_in_english, input_language_detected = stage_results["translation"]
+        output_language = input_language_detected.split("-")[0] if "-" in input_language_detected else input_language_detected
+        logger.info(f"Detected language: {input_language_detected}")
+
+        message_data_to_insert_or_update["translated_message"] = query_in_english
+        message_data_to_insert_or_update["input_language_detected"] = input_language_detected
+
+        yield "start", {"message_id": message_id, "query": original_query, "input_language_detected": input_language_detected}
+
+        user_name = get_profile_user_name(user_data.get("user_name", None), stage_results["user_profile"], email_id)
+        rag_result = {}
+        splitter = FollowUpQuestionSplitter()
+        answer_parts = []
+
+        async def answer_deltas():
+            # strip the follow-up questions out of the generated text before it is translated and sent
+            async for delta in a_stream_rag_pipeline(
+                query_in_english,
+                email_id,
+                user_name=user_name,
+                chat_history=stage_results["chat_history"],
+                user_profile=stage_results["user_profile"],
+                rag_result=rag_result,
+            ):
+                answer_text = splitter.feed(delta)
+                if answer_text:
+                    answer_parts.append(answer_text)
+                    yield answer_text
+
+            answer_text = splitter.finish()
+            if answer_text:
+                answer_parts.append(answer_text)
+                yield answer_text
+
+        translated_parts = []
+        message_data_to_insert_or_update["response_translation_start_time"] = datetime.datetime.now()
+        async for text in stream_translated_answer(answer_deltas(), input_language_detected):
+            translated_parts.append(text)
+            yield "answer", {"text": text}
+
+        follow_up_questions = splitter.get_follow_up_questions()
+        if follow_up_questions and output_language != Constants.LANGUAGE_SHORT_CODE_ENG:
+            follow_up_questions = await a_translate_batch_to(follow_up_questions, output_language)
+        message_data_to_insert_or_update["response_translation_end_time"] = datetime.datetime.now()
+
+        follow_up_question_options, _ = await sync_to_async(build_follow_up_questions, thread_sensitive=False)(
+            follow_up_questions, str(message_id), with_db_config
+        )
+        yield "follow_up_questions", {"follow_up_questions": follow_up_question_options}
+
+        final_response = "".join(answer_parts).strip()
+        translated_response = "".join(translated_parts).strip()
+        retrieval_start, retrieval_end = rag_result.get("retrieval_start"), rag_result.get("retrieval_end")
+        message_data_to_insert_or_update.update(
+            {
+                "message_response": final_response,
+                "message_translated_response": translated_response,
+                "rephrased_query": rag_result.get("rephrased_query"),
+                "retrieval_time": (retrieval_end - retrieval_start).total_seconds() if retrieval_start and retrieval_end else 0,
+                "chunks_retrieved": len(rag_result.get("retrieved_chunks", {}).get("chunks", [])),
+            }
+        )
+        await a_append_chat_history_turn(user_data.get("user_id", None), query_in_english, final_response)
+
+        yield "done", {
+            "message_id": message_id,
+            "response": translated_response,
+            "source": None,
+            "is_cached": rag_result.get("is_cached", False),
+        }
+        logger.info(f"Query streamed successfully for {email_id}")
+
+    except Exception as error:
+        logger.error(error, exc_info=True)
+        yield "error", {"message": "Something went wrong", "error": True}
+    finally:
+        if message_obj and message_id:
+            await sync_to_async(save_message_obj, thread_sensitive=False)(message_id, message_data_to_insert_or_update)
+            await sync_to_async(save_trace_metrics, thread_sensitive=False)(trace, message_id)
+        # the collected writes are flushed by the write-behind worker, off the response path
+        submit_write_batch(write_batch)
+        logger.info(f"Query trace {trace.trace_id}: {trace.summary()}")
+
+
 def process_input_audio_to_base64(
     original_text,
     message_id=None,
     language_code=Constants.LANGUAGE_SHORT_CODE_NATIVE,
     with_db_config=Config.WITH_DB_CONFIG,
 ):
-    input_audio, input_audio_file = None, None
+    input_audio = None
     try:
-        translated_text = asyncio.run(a_translate_to(original_text, language_code))
-        input_audio_file = asyncio.run(synthesize_speech(str(translated_text), language_code, message_id))
-        input_audio = encode_binary_to_base64(input_audio_file)
+        translated_text = run_async(a_translate_to(original_text, language_code))
+        input_audio_content = run_async(synthesize_speech_bytes(str(translated_text), language_code))
+        input_audio = encode_bytes_to_base64(input_audio_content)
     except Exception as error:
         logger.error(error, exc_info=True)
-    finally:
-        if input_audio_file:
-            os.remove(input_audio_file)
     return input_audio
 
 
@@ -247,14 +420,14 @@ def process_output_audio(original_text, message_id=None, with_db_config=Config.
     """
     Synthesise output text to audio in detected language, and encode to base64 string.
     """
-    response_audio, response_audio_file = None, None
+    response_audio = None
     input_language_detected = "en"
 
     try:
         # Detect language
         if not message_id:
             try: 
-                query_in_english, input_language_detected = asyncio.run(
+                query_in_english, input_language_detected = run_async(
                     detect_language_and_translate_to_english(original_text)
                 )
                 logger.info(f"Detected language for TTS: {input_language_detected}")
@@ -265,42 +438,62 @@ def process_output_audio(original_text, message_id=None, with_db_config=Config.
         logger.info(f"Synthesizing speech in language: {input_language_detected}")
         
         # Synthesize speech
-        response_audio_file = asyncio.run(
-            synthesize_speech(str(original_text), input_language_detected, message_id)
+        response_audio_content = run_async(
+            synthesize_speech_bytes(str(original_text), input_language_detected)
         )
 
-        if response_audio_file and os. path.exists(response_audio_file):
-            response_audio = encode_binary_to_base64(response_audio_file)
-            logger.info(f"Audio synthesis successful, size: {os.path.getsize(response_audio_file)} bytes")
+        if response_audio_content:
+            response_audio = encode_bytes_to_base64(response_audio_content)
+            logger.info(f"Audio synthesis successful, size: {len(response_audio_content)} bytes")
         else:
-            logger.error(f"Audio file not created: {response_audio_file}")
+            logger.error("Audio synthesis returned no audio")
             response_audio = None
 
     except Exception as error: 
         logger.error(f"process_output_audio error: {error}", exc_info=True)
 
-    finally:
-        if response_audio_file and os.path. exists(response_audio_file):
+    return response_audio
+
+
+def process_output_audio_segments(original_text, message_id=None, with_db_config=Config.WITH_DB_CONFIG):
+    """
+    Synthesise output text to an ordered list of per-sentence audio segments (base64) in the detected language.
+    Unlike process_output_audio, the text is not truncated and the sentences are synthesised concurrently.
+    """
+
+    async def a_process_output_audio_segments():
+        input_language_detected = "en"
+        if not message_id:
             try:
-                os. remove(response_audio_file)
-            except Exception as e: 
-                logger.warning(f"Could not delete temp file: {e}")
+                _, input_language_detected = await detect_language_and_translate_to_english(original_text)
+                logger.info(f"Detected language for TTS: {input_language_detected}")
+            except Exception as lang_error:
+                logger.warning(f"Language detection failed: {lang_error}, using English")
 
-    return response_audio
+        return await synthesize_text_segments(str(original_text), input_language_detected)
+
+    audio_segments = []
+    try:
+        audio_segments = run_async(a_process_output_audio_segments())
+    except Exception as error:
+        logger.error(f"process_output_audio_segments error: {error}", exc_info=True)
+    return audio_segments
 
 
 def handle_input_query(input_query):
-    file_name, input_query_file = None, None
-    input_query_file = decode_base64_to_binary(input_query)
-    if input_query_file:
-        file_name = f"{uuid.uuid4()}_audio_input.{Constants.MP3}"
-        with open(file_name, "wb") as output_file_buffer:
-            output_file_buffer.write(input_query_file)
-    return file_name
+    """
+    Return the audio bytes of a voice query: raw bytes (or a memoryview) of an upload are used as they are,
+    only a base64 string (optionally a data URL) is decoded.
+    """
+    if isinstance(input_query, (bytes, bytearray, memoryview)):
+        return input_query if len(input_query) else None
+    if isinstance(input_query, str) and input_query.startswith("data:") and "," in input_query:
+        input_query = input_query.split(",", 1)[1]
+    return decode_base64_to_binary(input_query)
 
 
 def process_transcriptions(
-    voice_file,
+    audio_content,
     email_id,
     authenticated_user={},
     language_code=Constants.LANGUAGE_SHORT_CODE_NATIVE,
@@ -326,8 +519,8 @@ def process_transcriptions(
 
         message_data_to_insert_or_update["message_input_time"] = datetime.datetime.now()
         message_data_to_insert_or_update["input_speech_to_text_start_time"] = datetime.datetime.now()
-        transcriptions, detected_language, confidence_score = asyncio.run(
-            transcribe_and_translate(voice_file, language_bcp_code)
+        transcriptions, detected_language, confidence_score = run_async(
+            transcribe_and_translate(audio_content, language_bcp_code)
         )
         message_data_to_insert_or_update["input_speech_to_text_end_time"] = datetime.datetime.now()
 
@@ -350,6 +543,4 @@ def process_transcriptions(
     finally:
         if message_obj and message_id:
             save_message_obj(message_id, message_data_to_insert_or_update)
-        if voice_file:
-            os.remove(voice_file)
     return response_map
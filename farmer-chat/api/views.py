@@ -1,5 +1,4 @@
 import asyncio
-import base64
 import logging
 
 from api.utils import (
@@ -12,7 +11,7 @@ from api.utils import (
 )
 from common.constants import Constants
 from common.utils import get_user_by_email, set_user_preferred_language
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadedfile import UploadedFile
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from language_service.utils import get_all_languages, get_language_by_id
@@ -175,7 +174,7 @@ class ChatAPIViewSet(GenericViewSet):
             }
         )
         response_map = {}
-        authenticated_user, input_query_file = None, None
+        authenticated_user, input_query_audio = None, None
 
         try:
             # check for authenticated user using email
@@ -200,21 +199,21 @@ class ChatAPIViewSet(GenericViewSet):
                 if len(request.FILES) >= 1
                 else original_query
             )
-            if isinstance(input_query, InMemoryUploadedFile):
+            if isinstance(input_query, UploadedFile):
+                # the uploaded bytes are passed to the speech client as they are, without a base64 round trip
                 input_query.seek(0)
-                file_content = input_query.read()
-                input_query = base64.b64encode(bytes(file_content))
+                input_query = input_query.read()
 
-            input_query_file = handle_input_query(input_query)
+            input_query_audio = handle_input_query(input_query)
 
-            if not input_query_file:
+            if not input_query_audio:
                 response_data.data["message"] = "Invalid file or base64 string."
                 response_data.status_code = status.HTTP_400_BAD_REQUEST
                 return response_data
                 # return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
 
             response_map = process_transcriptions(
-                input_query_file,
+                input_query_audio,
                 email_id,
                 authenticated_user,
                 language_bcp_code=query_language_bcp_code,
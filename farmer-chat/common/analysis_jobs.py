@@ -0,0 +1,267 @@
+"""
+Background skin and lab report analysis jobs
+
+A job is the SkinAnalysis or LabReport row itself: it is created as pending when the upload is submitted,
+analysed by a Celery task on the ANALYSIS_JOB_QUEUE, and its status, error and result are stored on the row.
+Jobs need a Celery broker: without one, the job endpoints answer 503 and the synchronous endpoints are used.
+Clients poll the job, follow it as server-sent events, or give a webhook URL the result is posted to.
+Webhook URLs must resolve to public addresses (or match ANALYSIS_JOB_WEBHOOK_ALLOWED_HOSTS when it is set), so
+that the workers cannot be made to post to internal services. Results are posted over a verified TLS connection
+to the address checked, so that the host cannot be rebound to an internal address in between.
+Model calls failing on quota or availability errors are retried with exponential backoff.
+"""
+import asyncio
+import ipaddress
+import logging
+import random
+import socket
+from urllib.parse import urlsplit
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django_core.config import Config
+
+from common.http_client import get_webhook_client, http_request
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = "pending"
+JOB_PROCESSING = "processing"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+JOB_STATUS_CHOICES = [
+    (JOB_PENDING, "Pending"),
+    (JOB_PROCESSING, "Processing"),
+    (JOB_COMPLETED, "Completed"),
+    (JOB_FAILED, "Failed"),
+]
+ACTIVE_JOB_STATUSES = (JOB_PENDING, JOB_PROCESSING)
+TERMINAL_JOB_STATUSES = (JOB_COMPLETED, JOB_FAILED)
+
+# substrings of the model errors worth retrying: rate limits, quota and unavailability
+TRANSIENT_ERROR_MARKERS = (
+    "429",
+    "500",
+    "503",
+    "504",
+    "quota",
+    "resource exhausted",
+    "resourceexhausted",
+    "rate limit",
+    "unavailable",
+    "overloaded",
+    "deadline",
+    "timeout",
+    "timed out",
+)
+
+_validate_webhook_url = URLValidator(schemes=["http", "https"])
+
+
+def is_job_queue_configured():
+    """
+    Whether a Celery broker is configured for the analysis jobs.
+    """
+    return bool(Config.CELERY_BROKER_URL)
+
+
+def is_transient_error(error_message):
+    """
+    Whether an analysis error is a rate limit or availability error the job should be retried on.
+    """
+    error_message = str(error_message or "").lower()
+    return any(marker in error_message for marker in TRANSIENT_ERROR_MARKERS)
+
+
+def get_retry_countdown(retries):
+    """
+    Exponential backoff, in seconds, before the next attempt, with full jitter so that jobs throttled
+    together do not retry together.
+    """
+    backoff = min(Config.ANALYSIS_JOB_RETRY_BACKOFF * (2**retries), Config.ANALYSIS_JOB_RETRY_BACKOFF_MAX)
+    return random.uniform(backoff / 2, backoff)
+
+
+def is_allowed_webhook_host(host, allowed_hosts):
+    """
+    Whether the host is one of the allowed hosts or a subdomain of one.
+    """
+    return any(host == allowed or host.endswith(f".{allowed}") for allowed in allowed_hosts)
+
+
+def is_public_address(address):
+    address = ipaddress.ip_address(address)
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return not (
+        address.is_private
+        or address.is_loopback
+        or address.is_link_local
+        or address.is_multicast
+        or address.is_reserved
+        or address.is_unspecified
+    )
+
+
+def validate_webhook_host(webhook_url):
+    """
+    Raise ValidationError unless the host of the webhook URL is allowed: listed in
+    ANALYSIS_JOB_WEBHOOK_ALLOWED_HOSTS when it is set, and resolving only to public addresses.
+    Returns the addresses the host resolves to, in resolution order.
+    """
+    parts = urlsplit(webhook_url)
+    host = (parts.hostname or "").lower()
+    allowed_hosts = [
+        allowed.strip().lower() for allowed in Config.ANALYSIS_JOB_WEBHOOK_ALLOWED_HOSTS.split(",") if allowed.strip()
+    ]
+    if allowed_hosts and not is_allowed_webhook_host(host, allowed_hosts):
+        raise ValidationError(f"Webhook host {host} is not allowed")
+
+    try:
+        address_infos = socket.getaddrinfo(host, parts.port or None, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as error:
+        raise ValidationError(f"Webhook host {host} does not resolve: {error}")
+    addresses = list(dict.fromkeys(info[4][0] for info in address_infos))
+    if not addresses or not all(is_public_address(address.split("%")[0]) for address in addresses):
+        raise ValidationError(f"Webhook host {host} resolves to a non-public address")
+    return addresses
+
+
+def clean_webhook_url(webhook_url):
+    """
+    Return the stripped webhook URL, or raise ValidationError when it is not an http(s) URL of an allowed host.
+    """
+    webhook_url = (webhook_url or "").strip()
+    if webhook_url:
+        _validate_webhook_url(webhook_url)
+        validate_webhook_host(webhook_url)
+    return webhook_url
+
+
+def find_active_job(model_class, email_id, content_hash):
+    """
+    Return the user's pending or processing job for the same upload, so that a resubmission follows it.
+    """
+    return (
+        model_class.objects.filter(email_id=email_id, content_hash=content_hash, status__in=ACTIVE_JOB_STATUSES)
+        .order_by("-created_at")
+        .first()
+    )
+
+
+def build_job_response(job, build_result):
+    """
+    Build the status response of a job; build_result(job) builds the result of a completed job.
+    """
+    response = {"success": job.status != JOB_FAILED, "job_id": job.id, "status": job.status}
+    if job.status == JOB_COMPLETED:
+        response["result"] = build_result(job)
+    elif job.status == JOB_FAILED:
+        response["error"] = job.error
+    return response
+
+
+def start_job(job):
+    job.status = JOB_PROCESSING
+    job.save(update_fields=["status", "updated_at"])
+
+
+def retry_or_fail_job(task, job, error_message, retry_after=None):
+    """
+    Retry the task with backoff, and not before retry_after seconds, when the error is transient and retries
+    are left (raises celery's Retry), otherwise mark the job as failed. Jobs run eagerly are not retried.
+    """
+    if is_transient_error(error_message) and not task.request.is_eager and task.request.retries < task.max_retries:
+        countdown = max(get_retry_countdown(task.request.retries), retry_after or 0)
+        logger.warning(
+            f"⏳ {job.__class__.__name__} job {job.id} failed ({error_message}), "
+            f"retry {task.request.retries + 1}/{task.max_retries} in {countdown:.0f}s"
+        )
+        job.status = JOB_PENDING
+        job.save(update_fields=["status", "updated_at"])
+        raise task.retry(countdown=countdown)
+
+    logger.error(f"❌ {job.__class__.__name__} job {job.id} failed: {error_message}")
+    job.status = JOB_FAILED
+    job.error = str(error_message)
+    job.save(update_fields=["status", "error", "updated_at"])
+
+
+def post_webhook(webhook_url, address, payload):
+    """
+    POST the payload to the webhook URL, connecting to the given (validated) address instead of resolving
+    the host again. The Host header and the TLS server name stay those of the URL, so that the certificate
+    is verified against the webhook host. Returns the response, or None when none was received.
+    """
+    url = httpx.URL(webhook_url)
+    return http_request(
+        "POST",
+        url.copy_with(host=address),
+        timeout=Config.ANALYSIS_JOB_WEBHOOK_TIMEOUT,
+        max_retries=Config.ANALYSIS_JOB_WEBHOOK_MAX_RETRIES,
+        client=get_webhook_client(),
+        headers={"Host": url.netloc.decode("ascii")},
+        extensions={"sni_hostname": url.raw_host.decode("ascii")},
+        json=payload,
+    )
+
+
+def notify_webhook(job, build_result):
+    """
+    Post the final status response of a job to its webhook URL, if it has one.
+    """
+    if not job.webhook_url:
+        return
+    # checked again when posting, as the host may resolve differently than when the job was submitted
+    try:
+        addresses = validate_webhook_host(job.webhook_url)
+    except ValidationError as error:
+        logger.warning(f"Webhook of {job.__class__.__name__} job {job.id} not posted: {error.message}")
+        return
+    response = post_webhook(job.webhook_url, addresses[0], build_job_response(job, build_result))
+    if response is None or response.status_code >= 400:
+        logger.warning(
+            f"Webhook {job.webhook_url} of {job.__class__.__name__} job {job.id} failed: "
+            f"{response.status_code if response is not None else 'no response'}"
+        )
+
+
+async def stream_job_events(load_job_response, poll_interval=None, timeout=None):
+    """
+    Follow a job as server-sent events: a status event whenever its status changes, then a result or error
+    event and done once it finishes, or timeout if it is still running after timeout seconds.
+    load_job_response() returns the job's current status response (see build_job_response).
+    """
+    # imported here, as the models import this module for the job statuses
+    from generation.stream_response import format_sse_event
+
+    poll_interval = poll_interval or Config.ANALYSIS_JOB_STREAM_POLL_INTERVAL
+    timeout = timeout or Config.ANALYSIS_JOB_STREAM_TIMEOUT
+    load_job_response = sync_to_async(load_job_response, thread_sensitive=False)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    last_status = None
+
+    while True:
+        job_response = await load_job_response()
+        if job_response["status"] != last_status:
+            last_status = job_response["status"]
+            yield format_sse_event("status", {"job_id": job_response["job_id"], "status": last_status})
+
+        if last_status == JOB_COMPLETED:
+            yield format_sse_event("result", job_response["result"])
+            break
+        if last_status == JOB_FAILED:
+            yield format_sse_event("error", {"job_id": job_response["job_id"], "error": job_response["error"]})
+            break
+        if loop.time() >= deadline:
+            yield format_sse_event("timeout", {"job_id": job_response["job_id"], "status": last_status})
+            return
+
+        await asyncio.sleep(poll_interval)
+
+    yield format_sse_event("done", {"job_id": job_response["job_id"]})
+
@@ -0,0 +1,320 @@
+"""
+In-process, disk and Redis-backed caches shared across the request handlers
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django_core.config import Config
+
+logger = logging.getLogger(__name__)
+
+# sentinel for values that are not cached, so that falsy values can be cached
+MISSING = object()
+
+
+class MemoryCache:
+    """
+    Thread-safe in-memory LRU cache with an optional per-entry TTL and hit/miss statistics.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _is_expired(self, expires_at, now=None):
+        return expires_at is not None and expires_at <= (now or time.monotonic())
+
+    def get(self, key, default=None):
+        """
+        Return the value cached for the key, marking it as recently used.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if self._is_expired(expires_at):
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Cache the value for the key, evicting the least recently used entries when full.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Read-through lookup: return the cached value, or load it with loader() and cache it.
+        None results are not cached, so that missing rows are looked up again.
+        """
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def items(self):
+        """
+        Return a snapshot of the live (key, value) pairs without affecting recency or statistics.
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired_keys = [key for key, (expires_at, _) in self._entries.items() if self._is_expired(expires_at, now)]
+            for key in expired_keys:
+                del self._entries[key]
+            self.evictions += len(expired_keys)
+            return [(key, value) for key, (_, value) in self._entries.items()]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class RedisCache:
+    """
+    Redis-backed cache of JSON-serialisable values shared between processes.
+    Connection errors are logged and treated as cache misses.
+    """
+
+    def __init__(self, redis_url, prefix="cache", ttl=None):
+        import redis
+
+        self.prefix = prefix
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def get_many(self, keys):
+        """
+        Return a dict of the cached values for the keys that were found.
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            values = self._client.mget([self._key(key) for key in keys])
+        except Exception as error:
+            logger.warning(f"Redis cache read failed: {error}")
+            return {}
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, items, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            pipeline = self._client.pipeline(transaction=False)
+            for key, value in items.items():
+                pipeline.set(self._key(key), json.dumps(value), ex=int(ttl) if ttl else None)
+            pipeline.execute()
+        except Exception as error:
+            logger.warning(f"Redis cache write failed: {error}")
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return
+        try:
+            self._client.delete(*[self._key(key) for key in keys])
+        except Exception as error:
+            logger.warning(f"Redis cache delete failed: {error}")
+
+
+class TieredCache:
+    """
+    In-process MemoryCache in front of an optional shared RedisCache.
+    Values found only in Redis are promoted to the memory tier.
+    """
+
+    def __init__(self, memory_cache, remote_cache=None):
+        self.memory_cache = memory_cache
+        self.remote_cache = remote_cache
+
+    @property
+    def is_remote(self):
+        return self.remote_cache is not None
+
+    def get_many(self, keys):
+        found, missing = {}, []
+        for key in keys:
+            value = self.memory_cache.get(key, MISSING)
+            if value is MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+
+        if missing and self.remote_cache:
+            remote_found = self.remote_cache.get_many(missing)
+            for key, value in remote_found.items():
+                self.memory_cache.set(key, value)
+            found.update(remote_found)
+        return found
+
+    def set_many(self, items):
+        for key, value in items.items():
+            self.memory_cache.set(key, value)
+        if items and self.remote_cache:
+            self.remote_cache.set_many(items)
+
+    def stats(self):
+        return {**self.memory_cache.stats(), "remote": self.is_remote}
+
+
+def build_redis_cache(prefix, ttl):
+    """
+    Build a RedisCache when REDIS_URL is configured and redis is installed, otherwise return None.
+    """
+    if Config.REDIS_URL:
+        try:
+            return RedisCache(Config.REDIS_URL, prefix=prefix, ttl=ttl)
+        except ImportError:
+            logger.warning(f"redis is not installed, the {prefix} cache is not shared")
+    return None
+
+
+def build_tiered_cache(prefix, max_entries, ttl):
+    """
+    Build a TieredCache, adding the Redis tier when REDIS_URL is configured and redis is installed.
+    """
+    return TieredCache(MemoryCache(max_entries=max_entries, ttl=ttl), build_redis_cache(prefix, ttl))
+
+
+class DiskCache:
+    """
+    Directory-backed cache of binary values bounded by total size, evicting the least recently used files.
+    Keys must be safe to use as file names (e.g. hex digests).
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, suffix=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._list_files())
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _list_files(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.suffix):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        return files
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as cached_file:
+                value = cached_file.read()
+            # mtime doubles as the recency marker for eviction
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(temp_path, "wb") as cached_file:
+                cached_file.write(value)
+            # atomic rename so that concurrent readers never see a partial file
+            os.replace(temp_path, path)
+        except OSError as error:
+            logger.warning(f"Disk cache write failed: {error}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self._lock:
+            self._total_bytes += len(value) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._list_files())
+        self._total_bytes = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
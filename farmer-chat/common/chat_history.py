@@ -0,0 +1,305 @@
+"""
+Rolling, summarised chat history of the users' conversations
+
+With Redis, the history of a user is loaded from the DB once, then kept in Redis and appended to after
+every turn; without it, the history is loaded from the DB on every request. Only the latest turns are kept
+verbatim, with their answers cut down to their leading sentences, and older turns are folded into a running
+summary, so that the history stays within a token budget.
+"""
+import asyncio
+import json
+import logging
+import re
+
+from django_core.config import Config
+from rag_service.openai_scheduler import PRIORITY_RERANK, estimate_tokens
+from rag_service.openai_service import make_openai_request
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODE_EXTRACTIVE = "extractive"
+SUMMARY_MODE_LLM = "llm"
+
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?।॥])\s+|\n+")
+
+SUMMARY_PROMPT = """Summarise this conversation between a user and a health assistant in at most {max_words} words.
+Keep the user's symptoms, conditions, allergies and the remedies that were suggested.
+
+Earlier summary: {summary}
+
+Conversation:{turns}
+
+Summary:"""
+
+
+def count_tokens(text):
+    return estimate_tokens(text or "", max_completion_tokens=0)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Keep the leading sentences of the text that fit in max_tokens (at least part of the first one).
+    """
+    text = (text or "").strip()
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    kept = []
+    for sentence in SENTENCE_BOUNDARY_PATTERN.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if count_tokens(" ".join(kept + [sentence])) > max_tokens:
+            break
+        kept.append(sentence)
+    return " ".join(kept) if kept else text[: max_tokens * 4].rstrip() + "..."
+
+
+def format_turns(turns):
+    return "".join(f"\n\nUser : {user_message}\nAI Assistant : {assistant_message}" for user_message, assistant_message in turns)
+
+
+class ChatHistoryStore:
+    """
+    Compact history of the users' latest conversation, kept in Redis when REDIS_URL is configured.
+    The verbatim turns of a user are a Redis list appended to atomically, and the running summary a separate
+    key, so that every worker reads and appends to the same history. Without Redis the history is not cached
+    in-process (it would go stale across workers): it is rebuilt from the DB on every get().
+    """
+
+    def __init__(
+        self,
+        token_budget=1000,
+        recent_turns=4,
+        answer_tokens=150,
+        summary_tokens=250,
+        summary_mode=SUMMARY_MODE_EXTRACTIVE,
+        ttl=3600,
+        redis_url=None,
+        prefix="chat_history",
+    ):
+        self.token_budget = token_budget
+        self.recent_turns = max(recent_turns, 1)
+        self.answer_tokens = answer_tokens
+        self.summary_tokens = summary_tokens
+        self.summary_mode = summary_mode
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = None
+        if redis_url:
+            try:
+                import redis
+
+                self._client = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            except ImportError:
+                logger.warning("redis is not installed, chat history is loaded from the DB on every request")
+        self._summary_tasks = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _turns_key(self, user_id):
+        return f"{self.prefix}:{user_id}:turns"
+
+    def _summary_key(self, user_id):
+        return f"{self.prefix}:{user_id}:summary"
+
+    @staticmethod
+    def _load_summary(value):
+        return json.loads(value) if value else {"summary": "", "version": 0}
+
+    def build_entry(self, turns):
+        """
+        Build the compact history of the (user message, assistant message) pairs, oldest first.
+        """
+        entry = {"summary": "", "turns": [], "version": 0}
+        for user_message, assistant_message in turns:
+            entry["turns"].append(self._compact_turn(user_message, assistant_message))
+            self._fold_turns(entry)
+        return entry
+
+    def get(self, user_id, loader):
+        """
+        Return the compact history text of the user, loading the latest turns with loader() on a cache miss.
+        loader() returns the (user message, assistant message) pairs, oldest first.
+        """
+        if self._client is None:
+            return self.render(self.build_entry(loader()))
+
+        turns_key, summary_key = self._turns_key(user_id), self._summary_key(user_id)
+        try:
+            pipeline = self._client.pipeline(transaction=True)
+            pipeline.lrange(turns_key, 0, -1)
+            pipeline.get(summary_key)
+            turns, summary = pipeline.execute()
+        except Exception as error:
+            logger.warning(f"Chat history read failed: {error}")
+            return self.render(self.build_entry(loader()))
+
+        if turns:
+            self.hits += 1
+            return self.render({**self._load_summary(summary), "turns": [json.loads(turn) for turn in turns]})
+
+        self.misses += 1
+        entry = self.build_entry(loader())
+        if entry["turns"]:
+            try:
+                pipeline = self._client.pipeline(transaction=True)
+                pipeline.delete(turns_key)
+                pipeline.rpush(turns_key, *[json.dumps(turn) for turn in entry["turns"]])
+                pipeline.set(summary_key, json.dumps({"summary": entry["summary"], "version": 0}), ex=self.ttl or None)
+                if self.ttl:
+                    pipeline.expire(turns_key, self.ttl)
+                pipeline.execute()
+            except Exception as error:
+                logger.warning(f"Chat history write failed: {error}")
+        return self.render(entry)
+
+    def append_turn(self, user_id, user_message, assistant_message):
+        """
+        Atomically append a completed turn to the user's history in Redis, then fold the oldest turns into
+        the summary. Nothing is stored when the history was not loaded yet: the next get() loads it with
+        the turn from the DB. Returns the folded turns, and the new summary version and text, when turns were
+        folded, else None. The Redis calls block: from the event loop, use a_append_turn.
+        """
+        if not user_id or not user_message or not assistant_message or self._client is None:
+            return None
+
+        turns_key, summary_key = self._turns_key(user_id), self._summary_key(user_id)
+        try:
+            pipeline = self._client.pipeline(transaction=True)
+            # RPUSHX only appends to an existing list
+            pipeline.rpushx(turns_key, json.dumps(self._compact_turn(user_message, assistant_message)))
+            if self.ttl:
+                pipeline.expire(turns_key, self.ttl)
+                pipeline.expire(summary_key, self.ttl)
+            if not pipeline.execute()[0]:
+                return None
+            folded_turns, version, summary = self._fold_stored_turns(turns_key, summary_key)
+        except Exception as error:
+            logger.warning(f"Chat history append failed: {error}")
+            return None
+        return (folded_turns, version, summary) if folded_turns else None
+
+    async def a_append_turn(self, user_id, user_message, assistant_message):
+        """
+        append_turn for the event loop: the Redis calls run in a worker thread, so that Redis latency does not
+        stall the other requests of the loop, then the LLM summary of the folded turns is scheduled on the loop.
+        """
+        if self._client is None:
+            return
+        folded = await asyncio.to_thread(self.append_turn, user_id, user_message, assistant_message)
+        if folded and self.summary_mode == SUMMARY_MODE_LLM:
+            folded_turns, version, summary = folded
+            self._schedule_llm_summary(user_id, version, summary, folded_turns)
+
+    def _fold_stored_turns(self, turns_key, summary_key):
+        """
+        Fold the oldest stored turns into the stored summary until the history fits the budget, trimming them
+        off the list (LTRIM). Runs as a transaction on both keys, retried when another worker changed them.
+        Returns the folded turns and the new summary version and text.
+        """
+        result = {}
+
+        def fold(pipeline):
+            turns = [json.loads(turn) for turn in pipeline.lrange(turns_key, 0, -1)]
+            entry = {**self._load_summary(pipeline.get(summary_key)), "turns": turns}
+            folded_turns = self._fold_turns(entry)
+            result.update(folded_turns=folded_turns, version=entry["version"], summary=entry["summary"])
+            if folded_turns:
+                pipeline.multi()
+                pipeline.ltrim(turns_key, len(folded_turns), -1)
+                pipeline.set(
+                    summary_key,
+                    json.dumps({"summary": entry["summary"], "version": entry["version"]}),
+                    ex=self.ttl or None,
+                )
+
+        self._client.transaction(fold, turns_key, summary_key)
+        return result["folded_turns"], result["version"], result["summary"]
+
+    def _compact_turn(self, user_message, assistant_message):
+        return [user_message.strip(), truncate_to_tokens(assistant_message, self.answer_tokens)]
+
+    def _fold_turns(self, entry):
+        """
+        Fold the oldest turns of the entry into its summary until the history fits the budget.
+        Returns the folded turns.
+        """
+        folded_turns = []
+        while len(entry["turns"]) > self.recent_turns or (
+            len(entry["turns"]) > 1 and count_tokens(self.render(entry)) > self.token_budget
+        ):
+            folded_turns.append(entry["turns"].pop(0))
+
+        if folded_turns:
+            entry["summary"] = self.extractive_summary(entry["summary"], folded_turns)
+            entry["version"] += 1
+        return folded_turns
+
+    def extractive_summary(self, summary, turns):
+        """
+        Extend the summary with each question and the first sentence of its answer, dropping the oldest
+        sentences beyond the summary budget.
+        """
+        sentences = [sentence for sentence in SENTENCE_BOUNDARY_PATTERN.split(summary) if sentence.strip()]
+        for user_message, assistant_message in turns:
+            sentences.append(f"User asked: {truncate_to_tokens(user_message, self.summary_tokens // 4)}")
+            sentences.append(f"Assistant: {truncate_to_tokens(assistant_message, self.summary_tokens // 4)}")
+
+        while len(sentences) > 1 and count_tokens(" ".join(sentences)) > self.summary_tokens:
+            sentences.pop(0)
+        return "\n".join(sentence.strip() for sentence in sentences)
+
+    def _schedule_llm_summary(self, user_id, version, summary, folded_turns):
+        task = asyncio.get_running_loop().create_task(self.a_llm_summary(user_id, version, summary, folded_turns))
+        self._summary_tasks.add(task)
+        task.add_done_callback(self._summary_tasks.discard)
+
+    async def a_llm_summary(self, user_id, version, summary, folded_turns):
+        """
+        Replace the extractive summary with an LLM summary, unless the history changed in the meantime.
+        Runs off the response path at the lowest OpenAI priority.
+        """
+        try:
+            prompt = SUMMARY_PROMPT.format(
+                max_words=int(self.summary_tokens * 0.75), summary=summary or "None", turns=format_turns(folded_turns)
+            )
+            response, error, _ = await make_openai_request(prompt, priority=PRIORITY_RERANK)
+            if not response or not response.choices:
+                return
+
+            llm_summary = truncate_to_tokens(response.choices[0].message.content, self.summary_tokens)
+            summary_key = self._summary_key(user_id)
+
+            def replace(pipeline):
+                if self._load_summary(pipeline.get(summary_key))["version"] == version:
+                    pipeline.multi()
+                    pipeline.set(summary_key, json.dumps({"summary": llm_summary, "version": version}), ex=self.ttl or None)
+
+            await asyncio.to_thread(self._client.transaction, replace, summary_key)
+        except Exception as error:
+            logger.error(error, exc_info=True)
+
+    @staticmethod
+    def render(entry):
+        """
+        Format the history for the rephrase prompt: the summary, then the verbatim turns.
+        """
+        history = format_turns(entry["turns"])
+        if entry["summary"]:
+            history = f"\n\nSummary of the earlier conversation:\n{entry['summary']}" + history
+        return history
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "remote": self._client is not None}
+
+
+chat_history_store = ChatHistoryStore(
+    token_budget=Config.CHAT_HISTORY_TOKEN_BUDGET,
+    recent_turns=int(Config.CHAT_HISTORY_WINDOW),
+    answer_tokens=Config.CHAT_HISTORY_ANSWER_TOKENS,
+    summary_tokens=Config.CHAT_HISTORY_SUMMARY_TOKENS,
+    summary_mode=Config.CHAT_HISTORY_SUMMARY_MODE,
+    ttl=Config.CHAT_HISTORY_CACHE_TTL,
+    redis_url=Config.REDIS_URL,
+)
@@ -0,0 +1,257 @@
+"""
+Process-wide Gemini gateway
+
+The API key is configured once and the GenerativeModel of each model name is built once. Every request
+acquires capacity from the GEMINI_RPM (requests per minute) and GEMINI_RPD (requests per day) token
+buckets before it is sent, waiting in line for at most GEMINI_MAX_QUEUE_WAIT seconds; requests that cannot
+be served in time, or arrive while GEMINI_MAX_WAITING requests are already waiting, are shed with a
+GeminiGatewayError carrying the HTTP status to answer with (429 or 503), instead of being sent to fail with
+a 429 from the API. Identical requests in flight at the same time are sent once and share the response.
+The GEMINI_RPM and GEMINI_RPD quotas are those of the API key, shared by every process calling Gemini (the
+web workers and the analysis job workers): with REDIS_URL the buckets live in Redis, otherwise each process
+gets 1/GEMINI_PROCESS_COUNT of them.
+"""
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+
+from common.rate_limit import build_token_bucket
+from django_core.config import Config
+
+try:
+    import google.generativeai as genai
+    from google.api_core import exceptions as google_exceptions
+
+    GEMINI_AVAILABLE = True
+except ImportError:
+    GEMINI_AVAILABLE = False
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class GeminiGatewayError(Exception):
+    """
+    A Gemini request that was not served, with the HTTP status and Retry-After delay to answer with.
+    """
+
+    status_code = 503
+    error_type = "gemini_unavailable"
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GeminiNotConfiguredError(GeminiGatewayError):
+    error_type = "gemini_not_configured"
+
+
+class GeminiUnavailableError(GeminiGatewayError):
+    error_type = "gemini_unavailable"
+
+
+class GeminiOverloadedError(GeminiGatewayError):
+    error_type = "gemini_overloaded"
+
+
+class GeminiRateLimitError(GeminiGatewayError):
+    status_code = 429
+    error_type = "gemini_rate_limited"
+
+
+def gateway_error_result(error):
+    """
+    The failed analysis result of a request the gateway did not serve.
+    """
+    return {
+        "success": False,
+        "error": str(error),
+        "error_type": error.error_type,
+        "status_code": error.status_code,
+        "retry_after": error.retry_after,
+    }
+
+
+def get_retry_after_headers(result):
+    """
+    Retry-After header of a failed result with a retry_after delay.
+    """
+    retry_after = result.get("retry_after")
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after else None
+
+
+def hash_content_part(digest, part):
+    if isinstance(part, str):
+        digest.update(part.encode("utf-8"))
+    elif isinstance(part, (bytes, bytearray, memoryview)):
+        digest.update(part)
+    elif Image is not None and isinstance(part, Image.Image):
+        digest.update(f"{part.mode}:{part.size}".encode("utf-8"))
+        digest.update(part.tobytes())
+    elif isinstance(part, dict):
+        for key in sorted(part):
+            digest.update(str(key).encode("utf-8"))
+            hash_content_part(digest, part[key])
+    elif isinstance(part, (list, tuple)):
+        for item in part:
+            hash_content_part(digest, item)
+    else:
+        digest.update(json.dumps(part, default=str, sort_keys=True).encode("utf-8"))
+    digest.update(b"\x00")
+
+
+def get_request_key(model_name, contents):
+    """
+    Key identifying identical requests: the model and a hash of the prompt text, images and data parts.
+    """
+    digest = hashlib.sha256(model_name.encode("utf-8"))
+    hash_content_part(digest, contents)
+    return digest.hexdigest()
+
+
+class GeminiGateway:
+    """
+    Configured Gemini models with client-side RPM/RPD admission control and request coalescing.
+    """
+
+    def __init__(self, api_key=None, rpm=None, rpd=None, max_queue_wait=None, max_waiting=None, process_count=None):
+        self.api_key = api_key or Config.GEMINI_API_KEY
+        rpd = rpd or Config.GEMINI_RPD
+        process_count = process_count or Config.GEMINI_PROCESS_COUNT
+        self.request_bucket = build_token_bucket("gemini:rpm", rpm or Config.GEMINI_RPM, process_count=process_count)
+        # the daily quota as a bucket holding a day of requests, refilled evenly over the day
+        self.daily_bucket = build_token_bucket(
+            "gemini:rpd", rpd / MINUTES_PER_DAY, capacity=rpd, process_count=process_count
+        )
+        self.max_queue_wait = Config.GEMINI_MAX_QUEUE_WAIT if max_queue_wait is None else max_queue_wait
+        self.max_waiting = max_waiting or Config.GEMINI_MAX_WAITING
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self.models = {}
+        self.in_flight = {}
+        self._configured = False
+        self._lock = threading.Lock()
+
+    def get_model(self, model_name):
+        """
+        Return the GenerativeModel of the model name, configuring the API key on first use.
+        """
+        if not GEMINI_AVAILABLE:
+            raise GeminiNotConfiguredError("Gemini not available. Install: pip install google-generativeai")
+        if not self.api_key:
+            raise GeminiNotConfiguredError(
+                "GEMINI_API_KEY not found in environment variables.  Please check your .env file or settings. py"
+            )
+
+        with self._lock:
+            if not self._configured:
+                genai.configure(api_key=self.api_key)
+                self._configured = True
+            if model_name not in self.models:
+                self.models[model_name] = genai.GenerativeModel(model_name)
+                logger.info(f"✅ Gemini model {model_name} configured")
+            return self.models[model_name]
+
+    def acquire(self):
+        """
+        Wait in line until the request fits the RPM and RPD budgets, or shed it.
+        """
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                raise GeminiOverloadedError(
+                    f"Gemini is overloaded: {self.waiting} requests are already waiting, please try again shortly",
+                    retry_after=self.max_queue_wait,
+                )
+            self.waiting += 1
+
+        deadline = time.monotonic() + self.max_queue_wait
+        try:
+            while True:
+                wait_time = self.blocked_until - time.monotonic()
+                if wait_time <= 0:
+                    wait_time = self.request_bucket.try_acquire(1)
+                    if not wait_time:
+                        daily_wait_time = self.daily_bucket.try_acquire(1)
+                        if not daily_wait_time:
+                            return
+                        self.request_bucket.refund(1)
+                        raise GeminiRateLimitError(
+                            "Gemini daily quota exhausted, please try again later", retry_after=daily_wait_time
+                        )
+
+                if time.monotonic() + wait_time > deadline:
+                    raise GeminiRateLimitError(
+                        f"Gemini rate limit reached, please try again in {wait_time:.0f} seconds",
+                        retry_after=wait_time,
+                    )
+                time.sleep(min(wait_time, 1.0))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def backoff(self, delay):
+        """
+        Pause every request for delay seconds, after a rate limit error from the API.
+        """
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        logger.warning(f"Gemini rate limited, pausing requests for {delay:.2f} seconds")
+
+    def send(self, model_name, contents, **kwargs):
+        model = self.get_model(model_name)
+        self.acquire()
+        try:
+            response = model.generate_content(
+                contents, request_options={"timeout": Config.GEMINI_REQUEST_TIMEOUT}, **kwargs
+            )
+        except google_exceptions.ResourceExhausted as error:
+            self.backoff(Config.GEMINI_RATE_LIMIT_BACKOFF)
+            raise GeminiRateLimitError(
+                f"Gemini rate limit reached, please try again in {Config.GEMINI_RATE_LIMIT_BACKOFF:.0f} seconds ({error})",
+                retry_after=Config.GEMINI_RATE_LIMIT_BACKOFF,
+            ) from error
+        except (google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded) as error:
+            raise GeminiUnavailableError(f"Gemini service unavailable: {error}") from error
+        return response.text.strip()
+
+    def generate_text(self, model_name, contents, **kwargs):
+        """
+        Generate a response to the contents (prompt text, PIL images and {"mime_type", "data"} parts) and
+        return its text. Raises GeminiGatewayError when the request cannot be served.
+        """
+        key = get_request_key(model_name, contents)
+        with self._lock:
+            future = self.in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self.in_flight[key] = future
+
+        if not is_leader:
+            logger.info(f"♻️ Coalescing identical in-flight Gemini request to {model_name}")
+            return future.result()
+
+        try:
+            text = self.send(model_name, contents, **kwargs)
+            future.set_result(text)
+            return text
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                self.in_flight.pop(key, None)
+
+
+gemini_gateway = GeminiGateway()
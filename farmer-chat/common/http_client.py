@@ -0,0 +1,188 @@
+"""
+Shared connection-pooled HTTP clients for the Farmstack APIs, and the client of the third-party webhooks
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+import httpx
+from django_core.config import Config
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {403, 502, 503, 504}
+RETRY_BACKOFF_FACTOR = 0.1
+
+# timeouts (seconds) and retry budgets for each Farmstack endpoint
+ENDPOINT_PROFILES = {
+    "default": {"timeout": Config.HTTP_TIMEOUT, "max_retries": Config.HTTP_MAX_RETRIES},
+    "retrieval": {"timeout": Config.RETRIEVAL_TIMEOUT, "max_retries": Config.RETRIEVAL_MAX_RETRIES},
+    "authentication": {"timeout": Config.AUTHENTICATION_TIMEOUT, "max_retries": Config.AUTHENTICATION_MAX_RETRIES},
+}
+
+_client = None
+_webhook_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+# per-event-loop client registries closed by run_async
+_loop_client_registries = [_async_clients]
+
+
+def get_client_settings():
+    return {
+        "limits": httpx.Limits(
+            max_connections=Config.HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "http2": Config.HTTP2_ENABLED and HTTP2_AVAILABLE,
+        "timeout": Config.HTTP_TIMEOUT,
+        # Farmstack is served with a certificate that does not verify
+        "verify": False,
+    }
+
+
+def get_http_client():
+    """
+    Return the process-wide pooled HTTP client.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(**get_client_settings())
+    return _client
+
+
+def get_webhook_client():
+    """
+    Return the process-wide HTTP client of the calls to third-party webhooks. Unlike the Farmstack client,
+    it verifies certificates, never follows redirects and ignores the proxy settings of the environment.
+    """
+    global _webhook_client
+    if _webhook_client is None:
+        with _client_lock:
+            if _webhook_client is None:
+                _webhook_client = httpx.Client(
+                    timeout=Config.HTTP_TIMEOUT, verify=True, follow_redirects=False, trust_env=False
+                )
+    return _webhook_client
+
+
+def get_async_http_client():
+    """
+    Return the pooled async HTTP client for the running event loop.
+    Async connections are bound to the loop they were opened on, so each loop gets its own client.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(**get_client_settings())
+        _async_clients[loop] = client
+    return client
+
+
+def register_loop_clients(clients):
+    """
+    Register a WeakKeyDictionary of per-event-loop async clients, to be closed by run_async.
+    """
+    _loop_client_registries.append(clients)
+
+
+async def aclose_loop_clients():
+    """
+    Close the async clients opened on the running event loop, returning their connections.
+    """
+    loop = asyncio.get_running_loop()
+    for clients in _loop_client_registries:
+        client = clients.pop(loop, None)
+        if client is None:
+            continue
+        try:
+            await (client.aclose() if hasattr(client, "aclose") else client.close())
+        except Exception as error:
+            logger.warning(f"Could not close {client.__class__.__name__}: {error}")
+
+
+def run_async(coroutine):
+    """
+    asyncio.run for the sync entry points: runs the coroutine in a new event loop and closes the async
+    clients opened on that loop before it is closed, so that every call does not leak a connection pool.
+    """
+
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await aclose_loop_clients()
+
+    return asyncio.run(run())
+
+
+def get_endpoint_profile(endpoint, timeout=None, max_retries=None):
+    profile = dict(ENDPOINT_PROFILES.get(endpoint, ENDPOINT_PROFILES["default"]))
+    if timeout is not None:
+        profile["timeout"] = timeout
+    if max_retries is not None:
+        profile["max_retries"] = max_retries
+    return profile
+
+
+def get_retry_delay(attempt):
+    return RETRY_BACKOFF_FACTOR * (2**attempt)
+
+
+def http_request(method, url, endpoint="default", timeout=None, max_retries=None, client=None, **kwargs):
+    """
+    Send a request through the pooled client (or the given one), retrying transport errors and retryable
+    status codes within the endpoint's retry budget. Returns the last response, or None if no response was received.
+    """
+    profile = get_endpoint_profile(endpoint, timeout, max_retries)
+    client = client or get_http_client()
+    response = None
+
+    for attempt in range(profile["max_retries"] + 1):
+        try:
+            response = client.request(method, url, timeout=profile["timeout"], **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+            logger.warning(f"URL: {url} | Retryable status {response.status_code} (attempt {attempt + 1})")
+        except httpx.TransportError as error:
+            logger.warning(f"URL: {url} | {error.__class__.__name__}: {error} (attempt {attempt + 1})")
+
+        if attempt < profile["max_retries"]:
+            time.sleep(get_retry_delay(attempt))
+
+    return response
+
+
+async def a_http_request(method, url, endpoint="default", timeout=None, max_retries=None, **kwargs):
+    """
+    Async version of http_request using the event loop's pooled client.
+    """
+    profile = get_endpoint_profile(endpoint, timeout, max_retries)
+    client = get_async_http_client()
+    response = None
+
+    for attempt in range(profile["max_retries"] + 1):
+        try:
+            response = await client.request(method, url, timeout=profile["timeout"], **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+            logger.warning(f"URL: {url} | Retryable status {response.status_code} (attempt {attempt + 1})")
+        except httpx.TransportError as error:
+            logger.warning(f"URL: {url} | {error.__class__.__name__}: {error} (attempt {attempt + 1})")
+
+        if attempt < profile["max_retries"]:
+            await asyncio.sleep(get_retry_delay(attempt))
+
+    return response
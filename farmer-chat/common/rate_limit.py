@@ -0,0 +1,171 @@
+"""
+Thread-safe token bucket rate limiting, process-local or shared through Redis
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from django_core.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most capacity tokens.
+
+    The bucket never blocks: try_acquire either takes the tokens or returns how long to wait,
+    so it can be shared between threads and event loops.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.capacity = float(capacity or rate_per_minute)
+        self.refill_rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def try_acquire(self, amount=1, reserve=0):
+        """
+        Take amount tokens if at least reserve tokens remain afterwards.
+        Returns 0 when the tokens were taken, otherwise the seconds until they should be available.
+        """
+        amount = min(amount, self.capacity)
+        reserve = min(reserve, self.capacity - amount)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens - amount >= reserve:
+                self.tokens -= amount
+                return 0
+            return (amount + reserve - self.tokens) / self.refill_rate
+
+    def refund(self, amount):
+        """
+        Return tokens to the bucket (or take more, with a negative amount) once the actual usage is known.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+    async def a_try_acquire(self, amount=1, reserve=0):
+        return self.try_acquire(amount, reserve)
+
+    async def a_refund(self, amount):
+        self.refund(amount)
+
+
+# refill the bucket stored at KEYS[1] (a hash of its tokens and last update time, on the Redis clock), then
+# take ARGV[3] tokens leaving ARGV[4] behind ("acquire"), return ARGV[3] tokens ("refund") or do nothing
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local reserve = tonumber(ARGV[4])
+local mode = ARGV[5]
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * refill_rate)
+local wait_time = 0
+if mode == 'acquire' then
+    if tokens - amount >= reserve then
+        tokens = tokens - amount
+    else
+        wait_time = (amount + reserve - tokens) / refill_rate
+    end
+elseif mode == 'refund' then
+    tokens = math.min(capacity, tokens + amount)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 60)
+return {tostring(wait_time), tostring(tokens)}
+"""
+
+
+class RedisTokenBucket:
+    """
+    TokenBucket shared by every process through Redis, refilled and taken from atomically by a Lua script.
+    When Redis cannot be reached, the fallback (process-local) bucket is used instead.
+    The Redis calls block, so the a_ methods run them in a worker thread for callers on an event loop.
+    """
+
+    def __init__(self, redis_url, key, rate_per_minute, capacity=None, fallback=None):
+        import redis
+
+        self.key = key
+        self.capacity = float(capacity or rate_per_minute)
+        self.refill_rate = rate_per_minute / 60.0
+        self.fallback = fallback
+        self._client = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._script = self._client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def _run(self, mode, amount=0, reserve=0):
+        wait_time, tokens = self._script(
+            keys=[self.key], args=[self.capacity, self.refill_rate, amount, reserve, mode]
+        )
+        return float(wait_time), float(tokens)
+
+    def try_acquire(self, amount=1, reserve=0):
+        amount = min(amount, self.capacity)
+        reserve = min(reserve, self.capacity - amount)
+        try:
+            return self._run("acquire", amount, reserve)[0]
+        except Exception as error:
+            if self.fallback is None:
+                raise
+            logger.warning(f"Shared rate limit {self.key} unavailable, using the process limit: {error}")
+            return self.fallback.try_acquire(amount, reserve * self.fallback.capacity / self.capacity)
+
+    def refund(self, amount):
+        try:
+            self._run("refund", amount)
+        except Exception as error:
+            if self.fallback is None:
+                raise
+            logger.warning(f"Shared rate limit {self.key} unavailable, using the process limit: {error}")
+            self.fallback.refund(amount * self.fallback.capacity / self.capacity)
+
+    def available(self):
+        try:
+            return self._run("available")[1]
+        except Exception:
+            if self.fallback is None:
+                raise
+            return self.fallback.available()
+
+    async def a_try_acquire(self, amount=1, reserve=0):
+        return await asyncio.to_thread(self.try_acquire, amount, reserve)
+
+    async def a_refund(self, amount):
+        await asyncio.to_thread(self.refund, amount)
+
+
+def build_token_bucket(name, rate_per_minute, capacity=None, process_count=1):
+    """
+    Build the token bucket of a limit shared by all the processes of the deployment.
+    With REDIS_URL (and redis installed) the bucket lives in Redis. Otherwise each process gets a
+    TokenBucket with its share of the limit, rate_per_minute / process_count, so that process_count
+    processes together stay within it.
+    """
+    process_count = max(int(process_count or 1), 1)
+    local_bucket = TokenBucket(rate_per_minute / process_count, capacity=(capacity or rate_per_minute) / process_count)
+    if Config.REDIS_URL:
+        try:
+            return RedisTokenBucket(
+                Config.REDIS_URL, f"rate_limit:{name}", rate_per_minute, capacity=capacity, fallback=local_bucket
+            )
+        except ImportError:
+            logger.warning(f"redis is not installed, the {name} rate limit is split across {process_count} processes")
+    return local_bucket
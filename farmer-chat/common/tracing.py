@@ -0,0 +1,236 @@
+"""
+Per-stage latency, retry and token tracing of the query pipeline
+
+A Trace is started per query and carried in a ContextVar, so spans opened anywhere in the pipeline
+(including concurrently scheduled stages) are collected on it. Every finished span is also exported
+to Prometheus when prometheus_client is installed. With PROMETHEUS_MULTIPROC_DIR set in the environment
+(see entrypoint.sh), every worker process writes its metrics there and /metrics reports them all.
+"""
+import datetime
+import functools
+import inspect
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django_core.config import Config
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+    from prometheus_client import multiprocess
+
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+
+if PROMETHEUS_AVAILABLE:
+    STAGE_DURATION = Histogram(
+        "farmer_chat_stage_duration_seconds",
+        "Latency of the query pipeline stages",
+        ["stage"],
+        buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+    )
+    STAGE_TOKENS = Counter("farmer_chat_stage_tokens_total", "LLM tokens used by the pipeline stages", ["stage", "kind"])
+    STAGE_RETRIES = Counter("farmer_chat_stage_retries_total", "LLM request retries of the pipeline stages", ["stage"])
+    STAGE_ERRORS = Counter("farmer_chat_stage_errors_total", "Failed pipeline stages", ["stage"])
+
+
+class Span:
+    """
+    Timing of one pipeline stage, with the retries, tokens and other attributes recorded while it ran.
+    """
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.start_time = datetime.datetime.now()
+        self.end_time = None
+        self.duration = None
+        self.error = None
+        self._started_at = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + (value or 0)
+
+    def finish(self, error=None):
+        self.end_time = datetime.datetime.now()
+        self.duration = time.perf_counter() - self._started_at
+        if error:
+            self.error = str(error)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.duration,
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+class Trace:
+    """
+    The spans recorded while processing one query.
+    """
+
+    def __init__(self, message_id=None):
+        self.trace_id = uuid.uuid4().hex
+        self.message_id = message_id
+        self.spans = []
+
+    def get_span(self, name):
+        """
+        Return the last finished span with the given name, or None.
+        """
+        for span in reversed(self.spans):
+            if span.name == name:
+                return span
+        return None
+
+    def summary(self):
+        return {span.name: round(span.duration, 4) for span in self.spans if span.duration is not None}
+
+
+def start_trace(message_id=None):
+    """
+    Start a trace for the current context, returning it.
+    """
+    trace = Trace(message_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def get_current_trace():
+    return _current_trace.get()
+
+
+def get_current_span():
+    return _current_span.get()
+
+
+def export_span(span):
+    if not PROMETHEUS_AVAILABLE or not Config.PROMETHEUS_METRICS_ENABLED:
+        return
+    STAGE_DURATION.labels(stage=span.name).observe(span.duration)
+    if span.error:
+        STAGE_ERRORS.labels(stage=span.name).inc()
+    if span.attributes.get("retries"):
+        STAGE_RETRIES.labels(stage=span.name).inc(span.attributes["retries"])
+    for kind in ("prompt_tokens", "completion_tokens", "saved_tokens"):
+        if span.attributes.get(kind):
+            STAGE_TOKENS.labels(stage=span.name, kind=kind).inc(span.attributes[kind])
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time the wrapped block as a pipeline stage span, recording it on the current trace (if any) and in Prometheus.
+    """
+    current_span = Span(name, **attributes)
+    token = _current_span.set(current_span)
+    error = None
+    try:
+        yield current_span
+    except BaseException as exception:
+        error = exception
+        raise
+    finally:
+        current_span.finish(error)
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # the span was closed from another context, e.g. by an async generator finalised elsewhere
+            pass
+
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append(current_span)
+        try:
+            export_span(current_span)
+        except Exception as export_error:
+            logger.warning(f"Could not export span {name}: {export_error}")
+
+
+def traced(name):
+    """
+    Decorate a sync or async function to run inside a span with the given name.
+    """
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_llm_call(response=None, retries=0, exception=None):
+    """
+    Add the token usage and retries of an LLM request to the current span.
+    """
+    current_span = _current_span.get()
+    if current_span is None:
+        return
+
+    usage = getattr(response, "usage", None)
+    current_span.add(
+        llm_requests=1,
+        retries=retries,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0),
+        completion_tokens=getattr(usage, "completion_tokens", 0),
+        total_tokens=getattr(usage, "total_tokens", 0),
+        saved_tokens=getattr(response, "saved_tokens", 0),
+    )
+    if getattr(response, "is_cached", False):
+        current_span.set(is_cached=True)
+    if exception:
+        current_span.set(exception=(current_span.attributes.get("exception", "") + exception)[-20000:])
+
+
+def mark_skipped():
+    """
+    Flag the current span as a stage that had nothing to do, so that it is not persisted as a metrics row.
+    """
+    current_span = _current_span.get()
+    if current_span is not None:
+        current_span.set(skipped=True)
+
+
+def render_prometheus_metrics():
+    """
+    Return the Prometheus exposition payload and its content type, or (None, None) when unavailable.
+    """
+    if not PROMETHEUS_AVAILABLE or not Config.PROMETHEUS_METRICS_ENABLED:
+        return None, None
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return generate_latest(), CONTENT_TYPE_LATEST
+
+    # the default registry only holds this process' metrics, collect those of every worker from their files
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
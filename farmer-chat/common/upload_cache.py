@@ -0,0 +1,139 @@
+"""
+Reuse of earlier analyses of the same uploads
+
+Images are identified by perceptual hashes (pHash and dHash, 64-bit, stored as hex), so that a re-encoded or
+resized copy of a photo still matches within a Hamming distance, and other files (PDFs) by a SHA-256 content
+hash. Lookups are scoped to the user's own analyses created within ANALYSIS_CACHE_TTL.
+"""
+import datetime
+import hashlib
+import io
+import logging
+
+import numpy as np
+from django.utils import timezone
+from django_core.config import Config
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+PHASH_HIGHFREQ_FACTOR = 4
+
+
+def _dct_matrix(size):
+    # orthogonal DCT-II basis, so that the 2D DCT of a block is D @ block @ D.T
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / size)
+
+
+_PHASH_DCT = _dct_matrix(HASH_SIZE * PHASH_HIGHFREQ_FACTOR)
+
+
+def bits_to_hex(bits):
+    return f"{int(''.join('1' if bit else '0' for bit in bits.ravel()), 2):0{bits.size // 4}x}"
+
+
+def compute_phash(image):
+    """
+    DCT-based perceptual hash: the signs of the lowest 8x8 frequencies of a 32x32 grayscale copy around their median.
+    """
+    size = HASH_SIZE * PHASH_HIGHFREQ_FACTOR
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.LANCZOS), dtype=np.float64)
+    low_frequencies = (_PHASH_DCT @ pixels @ _PHASH_DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    return bits_to_hex(low_frequencies > np.median(low_frequencies))
+
+
+def compute_dhash(image):
+    """
+    Difference hash: whether each pixel of a 9x8 grayscale copy is brighter than its right neighbour.
+    """
+    pixels = np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    return bits_to_hex(pixels[:, 1:] > pixels[:, :-1])
+
+
+def compute_image_hashes(image):
+    return {"phash": compute_phash(image), "dhash": compute_dhash(image)}
+
+
+def compute_content_hash(*contents):
+    """
+    SHA-256 of the concatenated contents, as hex.
+    """
+    digest = hashlib.sha256()
+    for content in contents:
+        digest.update(content)
+    return digest.hexdigest()
+
+
+def compute_file_hashes(file_data):
+    """
+    Hashes of an uploaded file: its SHA-256, plus the perceptual hashes when it is an image.
+    """
+    file_hashes = {"sha256": compute_content_hash(file_data)}
+    try:
+        with Image.open(io.BytesIO(file_data)) as image:
+            file_hashes.update(compute_image_hashes(image))
+    except Exception:
+        # not an image (e.g. a PDF), matched on its content hash only
+        pass
+    return file_hashes
+
+
+def hamming_distance(hex_hash, other_hex_hash):
+    return bin(int(hex_hash, 16) ^ int(other_hex_hash, 16)).count("1")
+
+
+def is_near_duplicate(image_hashes, other_image_hashes, max_distance=None):
+    """
+    Whether both the pHash and the dHash of two images are within max_distance bits.
+    """
+    max_distance = Config.ANALYSIS_CACHE_MAX_HAMMING_DISTANCE if max_distance is None else max_distance
+    try:
+        return all(
+            hamming_distance(image_hashes[name], other_image_hashes[name]) <= max_distance for name in ("phash", "dhash")
+        )
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def is_same_upload(file_hashes, other_file_hashes):
+    """
+    Whether two files hashed by compute_file_hashes are the same file, or near-duplicate images.
+    """
+    if file_hashes.get("sha256") == other_file_hashes.get("sha256"):
+        return True
+    return "phash" in file_hashes and "phash" in other_file_hashes and is_near_duplicate(file_hashes, other_file_hashes)
+
+
+def get_recent_user_analyses(model_class, email_id, ttl=None):
+    """
+    Queryset of the user's analyses still eligible for reuse, most recent first.
+    """
+    ttl = Config.ANALYSIS_CACHE_TTL if ttl is None else ttl
+    cutoff = timezone.now() - datetime.timedelta(seconds=ttl)
+    return model_class.objects.filter(email_id=email_id, created_at__gte=cutoff).order_by("-created_at")
+
+
+def find_cached_analysis(model_class, email_id, content_hash, is_match=None):
+    """
+    Return the user's most recent analysis of the same upload: an exact content hash match, or else the first of
+    their latest ANALYSIS_CACHE_LOOKUP_LIMIT analyses is_match(analysis) accepts. None when caching is disabled.
+    """
+    if not Config.ANALYSIS_CACHE_ENABLED or not email_id:
+        return None
+    try:
+        analyses = get_recent_user_analyses(model_class, email_id)
+        analysis = analyses.filter(content_hash=content_hash).exclude(result={}).first()
+        if analysis is None and is_match is not None:
+            candidates = analyses.exclude(content_hash="").exclude(result={})[: Config.ANALYSIS_CACHE_LOOKUP_LIMIT]
+            analysis = next((candidate for candidate in candidates if is_match(candidate)), None)
+        if analysis is not None:
+            logger.info(f"♻️ Reusing {model_class.__name__} {analysis.id} for {email_id}")
+        return analysis
+    except Exception as error:
+        logger.error(error, exc_info=True)
+        return None
@@ -7,9 +7,13 @@ import uuid
 
 import certifi
 import regex
+from common.cache import MemoryCache, build_redis_cache
+from common.chat_history import chat_history_store
 from common.constants import Constants
-from database.database_config import db_conn
+from common.http_client import http_request
+from database.database_config import connection_context
 from database.db_operations import create_record, get_record_by_field, update_record
+from database.write_behind import flush_user_writes, get_current_write_batch
 from database.models import (
     Conversation,
     FollowUpQuestion,
@@ -20,51 +24,54 @@ from database.models import (
 )
 from django_core import celery
 from django_core.config import Config
-from language_service.translation import a_translate_to  # ✅ ADD THIS
-from language_service.utils import get_language_by_code
+from language_service.translation import a_translate_batch_to, a_translate_to  # ✅ ADD THIS
+from language_service.utils import LANGUAGE_TABLE_KEY, get_language_by_code, language_cache, load_language_table
 from peewee import DoesNotExist
-from requests import Request, Session
-from requests.adapters import HTTPAdapter
-from urllib3.util import Retry
 
 logger = logging.getLogger(__name__)
 
+# sentence ends (including the Devanagari danda) followed by whitespace, or line breaks
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?\u0964\u0965])\s+|\n+")
+
+MULTILINGUAL_TEXTS_KEY = "multilingual_texts"
+
+# read-through caches of the rows read on every request: users by email and the whole static text table.
+# Users can change (e.g. their language), so they are only cached in Redis, where every worker sees the
+# invalidation; without Redis they are read from the DB.
+user_cache = build_redis_cache("user", Config.USER_CACHE_TTL)
+multilingual_text_cache = MemoryCache(max_entries=1, ttl=Config.MULTILINGUAL_TEXT_CACHE_TTL)
+
 def send_request(
     url,
     headers={},
     data=None,
     content_type="form-data",
     request_type="GET",
-    total_retry=10,
+    total_retry=None,
     params=None,
+    endpoint="default",
 ):
     """
     Generic helper function to send requests to a specified URL with the relevant HTTP method,
     query params, request body, content negotiation and number of retries.
+    Requests go through the shared connection pool, with the timeout and retry budget of the given endpoint profile.
     """
     response = None
     try:
+        headers = dict(headers)
         if content_type == "JSON":
             headers["Content-Type"] = "application/json"
             data = json.dumps(data)
 
-        request_obj = Request(
-            request_type, url, data=data, headers=headers, params=params
-        )
-        session = Session()
-        request_prepped = session.prepare_request(request_obj)
-        retries = Retry(
-            total=total_retry,
-            backoff_factor=0.1,
-            status_forcelist=[403, 502, 503, 504],
-            allowed_methods={"GET", "POST", "PUT"},
-        )
-        session.mount(url, HTTPAdapter(max_retries=retries))
-        response = session.send(
-            request_prepped,
-            stream=True,
-            # verify=certifi.where(),  # Disabled due to SSL certificate error
-            verify=False,  # FIXED: Bypass SSL verification
+        response = http_request(
+            request_type,
+            url,
+            endpoint=endpoint,
+            max_retries=total_retry,
+            content=data if isinstance(data, (str, bytes)) else None,
+            data=data if isinstance(data, dict) else None,
+            headers=headers,
+            params=params,
         )
         logger.info(f"URL: {url} | Response Status Code: {response.status_code}")
         # json_response = json.loads(response.text) if response and response.status_code == 200 else {}
@@ -84,15 +91,15 @@ def get_or_create_latest_conversation(conversation_data: dict) -> Conversation:
     conversation = None
     user_id = conversation_data.get("user_id", None)
     try:
-        with db_conn:
+        with connection_context():
             conversation_qs = (
                 Conversation.select()
                 .where(Conversation.user_id == user_id)
                 .order_by(Conversation.created_on.desc())
                 # .get()
             )
+            conversation = conversation_qs.get() if len(conversation_qs) >= 1 else None
 
-        conversation = conversation_qs.get() if len(conversation_qs) >= 1 else None
         if not conversation:
             conversation = create_record(Conversation, conversation_data)
             logger.info(f"New conversation created for user_id:{user_id}")
@@ -105,13 +112,21 @@ def get_or_create_latest_conversation(conversation_data: dict) -> Conversation:
 
 def get_user_chat_history(user_id, window=Config.CHAT_HISTORY_WINDOW):
     """
-    Fetch user chat history by querying the previous messages associated with the user.
+    Fetch the compact chat history of the user, from the rolling history store or, on a miss, from their latest messages.
+    """
+    return chat_history_store.get(user_id, lambda: load_chat_history_turns(user_id, int(window)))
+
+
+def load_chat_history_turns(user_id, window):
+    """
+    Load the (query, response) pairs of the latest messages of the user, oldest first.
+    The user's writes still pending in the write-behind queue are flushed first, so that the latest turns are read.
     """
-    chat_history = None
-    with db_conn:
+    flush_user_writes(user_id)
+    with connection_context():
         conversation = get_or_create_latest_conversation({"user_id": user_id})
         messages = (
-            Messages.select()
+            Messages.select(Messages.translated_message, Messages.message_response)
             .where(
                 Messages.conversation_id == conversation.id,
                 Messages.is_deleted == False,
@@ -121,17 +136,18 @@ def get_user_chat_history(user_id, window=Config.CHAT_HISTORY_WINDOW):
             .order_by(Messages.created_on.desc())
             .limit(window)
         )
-        chat_history = ""
-        for message in reversed(messages):
-            chat_history = (
-                chat_history
-                + f"\n\nUser : {message.translated_message}\nAI Assistant : {message.message_response}"
-            )
-        # history.append((message.translated_message, message.message_response))
+        turns = [(message.translated_message, message.message_response) for message in reversed(messages)]
+    return turns
 
-    # print(f"\n ######## USER CHAT HISTORY BEGINS ########\n{chat_history} ######## USER CHAT HISTORY END ########\n")
-    # logger.info(f"User chat history :\n {chat_history}")
-    return chat_history
+
+async def a_append_chat_history_turn(user_id, query, response):
+    """
+    Add a completed turn to the user's rolling chat history, so that it is not reloaded from the DB.
+    """
+    try:
+        await chat_history_store.a_append_turn(user_id, query, response)
+    except Exception as error:
+        logger.error(error, exc_info=True)
 
 
 def insert_message_record(
@@ -143,7 +159,14 @@ def insert_message_record(
     message_inserted, message_id, conversation_id = None, None, None
     try:
         conversation_id = message_data.get("conversation_id")
-        message_inserted = create_record(Messages, message_data)
+        write_batch = get_current_write_batch()
+        if write_batch is not None:
+            # the row is written with the rest of the request, under a client-side id
+            message_inserted = Messages(**message_data)
+            message_inserted.id = str(message_inserted.id)
+            write_batch.insert(Messages, [{**message_data, "id": message_inserted.id}])
+        else:
+            message_inserted = create_record(Messages, message_data)
         message_id = message_inserted.id
     except Exception as error:
         logger.error(error, exc_info=True)
@@ -171,7 +194,7 @@ def get_or_create_user_by_email(user_data: dict) -> User:
     user_obj = None
     email_id = user_data.get("email", None)
     try:
-        with db_conn:
+        with connection_context():
             user_obj = (
                 User.get(User.email == email_id)
                 # .where(User.email == email_id)
@@ -196,8 +219,17 @@ def create_or_update_user_by_email(user_data: dict) -> User:
         if not user_obj:
             user_obj = create_record(User, user_data)
             logger.info(f"New User created for the email_id:{email_id}")
+            invalidate_cached_user(email_id)
+        elif get_current_write_batch() is not None:
+            for field, value in user_data.items():
+                setattr(user_obj, field, value)
+            write_batch = get_current_write_batch()
+            write_batch.update(User, user_obj.id, user_data)
+            # the cached user is dropped once the update is written, not before
+            write_batch.on_commit(lambda: invalidate_cached_user(email_id))
         else:
             user_obj = update_record(User, user_obj.id, user_data)
+            invalidate_cached_user(email_id)
 
     except Exception as e:
         logger.error(e, exc_info=True)
@@ -213,12 +245,65 @@ def create_follow_up_questions(data) -> FollowUpQuestion:
     # with database_config.db:
     inserted_objs = None
 
-    with db_conn:
+    with connection_context():
         inserted_objs = FollowUpQuestion.insert_many(data).execute()
 
     return inserted_objs
 
 
+def build_follow_up_questions(translated_questions, message_id, with_db_config=Config.WITH_DB_CONFIG):
+    """
+    Build the follow-up question options of a response and save them in the FollowUpQuestion table.
+    """
+    follow_up_question_options = []
+    follow_up_question_data_to_insert = []
+
+    sequence = 0
+    for translated_question in translated_questions:
+        sequence += 1
+        follow_up_question_id = uuid.uuid4()
+        follow_up_question_text = re.sub(
+            "[1-3]\.\s*", "", str(translated_question).strip(), count=1
+        )
+        follow_up_question_options.append(
+            {
+                "follow_up_question_id": str(follow_up_question_id),
+                "sequence": sequence,
+                "question": follow_up_question_text,
+            }
+        )
+
+        # append insertion data or saving of questions in FollowUpQuestion table
+        follow_up_question_data_to_insert.append(
+            {
+                "id": follow_up_question_id,
+                "message": follow_up_question_text,
+                "ref_id": message_id,
+                "follow_up_question_type": "message",
+                "sequence": sequence,
+            }
+        )
+
+    # insert data in FollowUpQuestion table
+    if len(follow_up_question_data_to_insert) > 1 and with_db_config:
+        write_batch = get_current_write_batch()
+        if write_batch is not None:
+            write_batch.insert(FollowUpQuestion, follow_up_question_data_to_insert)
+        else:
+            create_follow_up_questions(follow_up_question_data_to_insert)
+
+    return follow_up_question_options, follow_up_question_data_to_insert
+
+
+def split_complete_sentences(text):
+    """
+    Split off the complete sentences of a partially generated text.
+    Returns the list of complete sentences and the unfinished remainder.
+    """
+    parts = SENTENCE_BOUNDARY_PATTERN.split(text)
+    return [part for part in parts[:-1] if part.strip()], parts[-1]
+
+
 async def postprocess_and_translate_query_response(
     original_response, input_language, message_id, with_db_config=Config.WITH_DB_CONFIG
 ):
@@ -253,56 +338,20 @@ async def postprocess_and_translate_query_response(
                     break
 
         if index != -1:
-            translated_response = (
-                await a_translate_to(final_response, output_language)
-                if input_language != Constants.LANGUAGE_SHORT_CODE_ENG
-                else final_response
-            )
+            follow_up_questions = questions.split("\n")[:3]
 
-            # translated_response += (
-            #     await a_translate_to(Constants.HERE_ARE_FOLLOW_UP_QUESTIONS_TO_ASK_TEXT, output_language)
-            #     if input_language != Constants.LANGUAGE_SHORT_CODE_ENG
-            #     else Constants.HERE_ARE_FOLLOW_UP_QUESTIONS_TO_ASK_TEXT
-            # )
-
-            sequence = 0
-            for question in questions.split("\n")[:3]:
-                # final_response += f"{question}\n"
-                translated_question = (
-                    await a_translate_to(f"{question}\n", output_language)
-                    if input_language != Constants.LANGUAGE_SHORT_CODE_ENG
-                    else f"{question}\n"
+            # the answer and its follow-up questions are translated in a single batched call
+            if input_language != Constants.LANGUAGE_SHORT_CODE_ENG:
+                translated_response, *translated_questions = await a_translate_batch_to(
+                    [final_response, *follow_up_questions], output_language
                 )
+            else:
+                translated_response, translated_questions = final_response, follow_up_questions
 
-                # translated_response += translated_question
-
-                sequence += 1
-                follow_up_question_id = uuid.uuid4()
-                follow_up_question_text = re.sub(
-                    "[1-3]\.\s*", "", str(translated_question).strip(), count=1
-                )
-                follow_up_question_options.append(
-                    {
-                        "follow_up_question_id": str(follow_up_question_id),
-                        "sequence": sequence,
-                        "question": follow_up_question_text,
-                    }
-                )
-
-                # append insertion data or saving of questions in FollowUpQuestion table
-                follow_up_question_data_to_insert.append(
-                    {
-                        "id": follow_up_question_id,
-                        "message": follow_up_question_text,
-                        "ref_id": message_id,
-                        "follow_up_question_type": "message",
-                        "sequence": sequence,
-                    }
-                )
-
-            # insert data in FollowUpQuestion table
-            if len(follow_up_question_data_to_insert) > 1 and with_db_config:
-                create_follow_up_questions(follow_up_question_data_to_insert)
+            (
+                follow_up_question_options,
+                follow_up_question_data_to_insert,
+            ) = build_follow_up_questions(translated_questions, message_id, with_db_config)
 
         else:
             # if original_response does not have "Example Questions:\n" translate original_response as it is
@@ -326,8 +375,12 @@ async def postprocess_and_translate_query_response(
 
 def save_message_obj(message_id, message_data_to_insert_or_update):
     """
-    Update a Message instance.
+    Update a Message instance, as part of the request's write batch when there is one.
     """
+    write_batch = get_current_write_batch()
+    if write_batch is not None:
+        write_batch.update(Messages, message_id, message_data_to_insert_or_update)
+        return
     update_record(Messages, message_id, message_data_to_insert_or_update)
 
 
@@ -352,6 +405,13 @@ def clean_text(text):
     return text
 
 
+def encode_bytes_to_base64(audio_content):
+    """
+    Encode binary audio content to base64 string.
+    """
+    return base64.b64encode(audio_content).decode() if audio_content else None
+
+
 def encode_binary_to_base64(audio_file):
     """
     Encode binary audio file to base64 string.
@@ -388,22 +448,43 @@ def get_user_by_email(email_id):
     """
     user = None
     try:
-        with db_conn:
-            user_query = User.select(
+        if user_cache is not None:
+            user = user_cache.get_many([email_id]).get(email_id)
+        if user is None:
+            user = load_user_by_email(email_id)
+            if user is not None and user_cache is not None:
+                user_cache.set_many({email_id: user})
+    except Exception as error:
+        logger.error(error, exc_info=True)
+
+    return user
+
+
+def load_user_by_email(email_id):
+    """
+    Query the user with email ID in a single select.
+    """
+    with connection_context():
+        return (
+            User.select(
                 (User.id).alias("user_id"),
                 User.first_name,
                 User.last_name,
                 User.phone,
                 (User.preferred_language_id).alias("preferred_language_id"),
-            ).where(User.is_deleted == False, User.email == email_id)
-
-            if user_query.count() >= 1:
-                user = list(user_query.dicts().execute())[0]
+            )
+            .where(User.is_deleted == False, User.email == email_id)
+            .dicts()
+            .first()
+        )
 
-    except Exception as error:
-        logger.error(error, exc_info=True)
 
-    return user
+def invalidate_cached_user(email_id):
+    """
+    Drop a user from the shared user cache, once their row is updated in the DB.
+    """
+    if user_cache is not None and email_id:
+        user_cache.delete_many([email_id])
 
 
 def set_user_preferred_language(user_id, language_id):
@@ -413,6 +494,8 @@ def set_user_preferred_language(user_id, language_id):
     saved_user_preferred_language = update_record(
         User, user_id, {"preferred_language_id": language_id}
     )
+    if saved_user_preferred_language is not None:
+        invalidate_cached_user(saved_user_preferred_language.email)
     return saved_user_preferred_language
 
 
@@ -426,6 +509,40 @@ def format_multilingual_text_code(string):
     return final_string
 
 
+def load_multilingual_texts():
+    """
+    Query the text of every active MultilingualText by text code, returning None if the query fails.
+    """
+    try:
+        with connection_context():
+            return {
+                row["text_code"]: row["text"]
+                for row in MultilingualText.select(MultilingualText.text_code, MultilingualText.text)
+                .where(MultilingualText.is_deleted == False)
+                .dicts()
+            }
+    except Exception as error:
+        logger.error(error, exc_info=True)
+        return None
+
+
+def warm_lookup_caches(with_db_config=Config.WITH_DB_CONFIG):
+    """
+    Load the Language and MultilingualText tables into their caches, e.g. at startup.
+    """
+    if not with_db_config:
+        return
+    languages = load_language_table()
+    if languages is not None:
+        language_cache.set(LANGUAGE_TABLE_KEY, languages)
+    multilingual_texts = load_multilingual_texts()
+    if multilingual_texts is not None:
+        multilingual_text_cache.set(MULTILINGUAL_TEXTS_KEY, multilingual_texts)
+    logger.info(
+        f"Lookup caches warmed: {len(languages or [])} languages, {len(multilingual_texts or {})} static texts"
+    )
+
+
 def fetch_multilingual_texts_for_static_text_messages(
     text_code_without_lang_code_list,
     language_code=Constants.LANGUAGE_SHORT_CODE_NATIVE,
@@ -445,28 +562,22 @@ def fetch_multilingual_texts_for_static_text_messages(
         ]
 
         if with_db_config:
-            with db_conn:
-                multilingual_text_query = MultilingualText.select(
-                    MultilingualText.text_code, MultilingualText.text
-                ).where(
-                    MultilingualText.is_deleted == False,
-                    MultilingualText.text_code.in_(text_code_list),
-                )
-
-                if len(multilingual_text_query) >= 1:
-                    multilingual_text_query_list = list(
-                        multilingual_text_query.dicts().execute()
-                    )
+            multilingual_texts = multilingual_text_cache.get_or_load(MULTILINGUAL_TEXTS_KEY, load_multilingual_texts) or {}
+            multilingual_text_query_list = [
+                {"text_code": text_code, "text": multilingual_texts[text_code]}
+                for text_code in text_code_list
+                if text_code in multilingual_texts
+            ]
 
-                if len(multilingual_text_query_list) >= 1:
-                    multilingual_text_list = [
-                        {
-                            text_code.get("text_code").strip(
-                                f"_{language_code}"
-                            ): text_code.get("text")
-                        }
-                        for text_code in multilingual_text_query_list
-                    ]
+            if len(multilingual_text_query_list) >= 1:
+                multilingual_text_list = [
+                    {
+                        text_code.get("text_code").strip(
+                            f"_{language_code}"
+                        ): text_code.get("text")
+                    }
+                    for text_code in multilingual_text_query_list
+                ]
 
         else:
             multilingual_text_list = [
@@ -1,6 +1,7 @@
 import os, sys
+import logging
+from contextlib import contextmanager
 from pathlib import Path
-from peewee import PostgresqlDatabase
 from playhouse.pool import PooledPostgresqlExtDatabase
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -8,12 +9,93 @@ CONFIG_DIR = os.path.join(BASE_DIR, "django_core")
 sys.path.append(str(CONFIG_DIR))
 from config import Config
 
-# normal DB connection
-db_conn = PostgresqlDatabase(
-    Config.DB_NAME, user=Config.DB_USER, password=Config.DB_PASSWORD, host=Config.DB_HOST, port=Config.DB_PORT
-)
+try:
+    from prometheus_client import Gauge
+
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+class MonitoredPooledPostgresqlExtDatabase(PooledPostgresqlExtDatabase):
+    """
+    Pooled database that exports its checked out and idle connections whenever a connection is checked out
+    or returned, so that the gauges also hold in Prometheus multiprocess mode, where they cannot be read at scrape time.
+    """
+
+    def _connect(self):
+        conn = super()._connect()
+        record_pool_stats(self)
+        return conn
 
-# Pooled DB connection
-pooled_db_conn = PooledPostgresqlExtDatabase(
-    Config.DB_NAME, user=Config.DB_USER, password=Config.DB_PASSWORD, host=Config.DB_HOST, port=Config.DB_PORT
+    def _close(self, conn, close_conn=False):
+        super()._close(conn, close_conn)
+        record_pool_stats(self)
+
+
+# Pooled DB connection, shared by the models, the DB helpers and the Celery workers.
+# Closing a connection returns it to the pool; connections idle for longer than STALE_TIMEOUT are discarded.
+db_conn = MonitoredPooledPostgresqlExtDatabase(
+    Config.DB_NAME,
+    user=Config.DB_USER,
+    password=Config.DB_PASSWORD,
+    host=Config.DB_HOST,
+    port=Config.DB_PORT,
+    max_connections=int(Config.MAX_CONNECTIONS or 20),
+    stale_timeout=int(Config.STALE_TIMEOUT or 300),
+    timeout=Config.DB_POOL_WAIT_TIMEOUT,
 )
+
+# kept for the callers that imported the pooled connection explicitly
+pooled_db_conn = db_conn
+
+
+@contextmanager
+def connection_context(database=db_conn):
+    """
+    Make sure the current thread holds a connection for the wrapped block.
+    Only a connection opened here is returned to the pool on exit, so an enclosing
+    request-scoped connection (see database.middleware) stays open for the rest of the request.
+    """
+    opened = database.is_closed()
+    if opened:
+        database.connect()
+    try:
+        yield database
+    finally:
+        if opened and not database.is_closed():
+            database.close()
+
+
+def get_pool_stats(database=db_conn):
+    """
+    Report the connections of the pool that are checked out and idle.
+    """
+    in_use = len(getattr(database, "_in_use", {}))
+    idle = len(getattr(database, "_connections", []))
+    return {
+        "max_connections": database._max_connections,
+        "stale_timeout": database._stale_timeout,
+        "in_use": in_use,
+        "idle": idle,
+        "available": max(database._max_connections - in_use, 0) if database._max_connections else None,
+    }
+
+
+if PROMETHEUS_AVAILABLE:
+    # in multiprocess mode the gauge reports the sum over the live worker processes, each with its own pool
+    DB_POOL_CONNECTIONS = Gauge(
+        "farmer_chat_db_pool_connections", "Connections of the peewee pool", ["state"], multiprocess_mode="livesum"
+    )
+
+
+def record_pool_stats(database=db_conn):
+    if not PROMETHEUS_AVAILABLE:
+        return
+    stats = get_pool_stats(database)
+    DB_POOL_CONNECTIONS.labels(state="in_use").set(stats["in_use"])
+    DB_POOL_CONNECTIONS.labels(state="idle").set(stats["idle"])
+
+
+record_pool_stats()
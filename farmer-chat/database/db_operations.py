@@ -1,7 +1,7 @@
 import logging
 
-from database.database_config import db_conn
-from peewee import DoesNotExist
+from database.database_config import connection_context, db_conn
+from peewee import DoesNotExist, IntegrityError
 
 logger = logging.getLogger(__name__)
 
@@ -10,7 +10,7 @@ def get_record_by_field(model_class, field_name, value):
     """Retrieve a record by a specific field."""
     record = None
     try:
-        with db_conn:
+        with connection_context():
             query = model_class.select().where(
                 getattr(model_class, field_name) == value
             )
@@ -24,13 +24,14 @@ def get_record_by_field(model_class, field_name, value):
 def create_record(model_class, data_to_be_inserted):
     """Create a new record in the database."""
     record = None
-    try:
-        with db_conn.atomic() as current_transaction:
-            record = model_class.create(**data_to_be_inserted)
+    with connection_context():
+        try:
+            # the transaction is rolled back by atomic() when the insert fails
+            with db_conn.atomic():
+                record = model_class.create(**data_to_be_inserted)
 
-    except Exception as error:
-        current_transaction.rollback()
-        logger.error(error, exc_info=True)
+        except Exception as error:
+            logger.error(error, exc_info=True)
 
     return record
 
@@ -38,33 +39,51 @@ def create_record(model_class, data_to_be_inserted):
 def create_multiple_records(model_class, data_to_be_inserted):
     """Create / insert multiple records in to the database."""
     records = None
-    try:
-        with db_conn.atomic() as current_transaction:
-            records = model_class.insert_many(data_to_be_inserted).execute()
+    with connection_context():
+        try:
+            with db_conn.atomic():
+                records = model_class.insert_many(data_to_be_inserted).execute()
 
-    except Exception as error:
-        current_transaction.rollback()
-        logger.error(error, exc_info=True)
+        except Exception as error:
+            logger.error(error, exc_info=True)
 
     return records
 
 
+def create_records_in_transaction(model_rows):
+    """Insert rows of several models, given as (model_class, rows) pairs, in a single transaction."""
+    inserted = False
+    with connection_context():
+        try:
+            with db_conn.atomic():
+                for model_class, rows in model_rows:
+                    if rows:
+                        model_class.insert_many(rows).execute()
+            inserted = True
+
+        except Exception as error:
+            logger.error(error, exc_info=True)
+
+    return inserted
+
+
 def update_record(model_class, record_id, data_to_be_updated, **kwargs):
     """Update a record."""
     record = None
-    try:
-        record = model_class.get_by_id(record_id)
+    with connection_context():
         try:
-            with db_conn.atomic() as current_transaction:
-                for field, value in data_to_be_updated.items():
-                    setattr(record, field, value)
-                record.save()
-        except IntegrityError as e:
-            logger.error(f"Error updating record {e}", exc_info=True)
-
-    except DoesNotExist:
-        logger.error(
-            f"Record with {record_id} in the model {model_class} does not exist."
-        )
+            record = model_class.get_by_id(record_id)
+            try:
+                with db_conn.atomic():
+                    for field, value in data_to_be_updated.items():
+                        setattr(record, field, value)
+                    record.save()
+            except IntegrityError as e:
+                logger.error(f"Error updating record {e}", exc_info=True)
+
+        except DoesNotExist:
+            logger.error(
+                f"Record with {record_id} in the model {model_class} does not exist."
+            )
 
     return record
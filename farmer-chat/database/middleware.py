@@ -0,0 +1,72 @@
+"""
+Request-scoped peewee connection handling
+"""
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from database.database_config import db_conn
+from django_core.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseConnectionMiddleware:
+    """
+    Check a pooled connection out for the whole of a synchronous view, so that the DB helpers reuse it
+    instead of checking a connection out and back in for every query, and return it to the pool when the
+    response is ready.
+
+    Under ASGI the middleware runs in the event loop, so async views are passed straight through. A sync
+    view runs in the request's thread-sensitive thread, so its connection is checked out and returned there.
+    Async views run their DB calls in worker threads that check connections out per call.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # awaited by Django in the event loop, so that async views skip the hook without a thread hop
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        try:
+            return self.get_response(request)
+        finally:
+            self.close_connection(request)
+
+    async def __acall__(self, request):
+        try:
+            return await self.get_response(request)
+        finally:
+            if getattr(request, "_db_connection_opened", False):
+                await sync_to_async(self.close_connection, thread_sensitive=True)(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if Config.WITH_DB_CONFIG and not iscoroutinefunction(view_func):
+            self.open_connection(request)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if Config.WITH_DB_CONFIG and not iscoroutinefunction(view_func):
+            await sync_to_async(self.open_connection, thread_sensitive=True)(request)
+        return None
+
+    def open_connection(self, request):
+        if not db_conn.is_closed():
+            return
+        try:
+            db_conn.connect()
+            request._db_connection_opened = True
+        except Exception as error:
+            # the DB helpers handle their own failures, the request itself should not fail here
+            logger.error(f"Could not check out a DB connection: {error}")
+
+    def close_connection(self, request):
+        if getattr(request, "_db_connection_opened", False) and not db_conn.is_closed():
+            db_conn.close()
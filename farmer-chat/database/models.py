@@ -4,9 +4,13 @@ from peewee import *
 import os, sys
 from pathlib import Path
 
-DB_CONN_DIR = Path(__file__).resolve().parent
-sys.path.append(str(DB_CONN_DIR))
-from database_config import db_conn
+try:
+    from database.database_config import db_conn
+except ImportError:
+    # loaded as a top-level module from the database directory, e.g. by peewee-migrations
+    DB_CONN_DIR = Path(__file__).resolve().parent
+    sys.path.append(str(DB_CONN_DIR))
+    from database_config import db_conn
 
 
 class BaseModel(Model):
@@ -429,6 +433,8 @@ class GenerationMetrics(BaseModel):
     total_tokens = CharField(null=True, max_length=10)
     response_gen_exception = CharField(null=True, max_length=20000)
     response_gen_retries = CharField(null=True, max_length=4)
+    is_cached = BooleanField(default=False)
+    saved_tokens = CharField(null=True, max_length=10)
 
     class Meta:
         table_name = "generation_metrics"
@@ -449,6 +455,8 @@ class RephraseMetrics(BaseModel):
     is_rerank_response_parsed = BooleanField(default=False)
     rephrase_exception = CharField(null=True, max_length=20000)
     rephrase_retries = CharField(null=True, max_length=4)
+    is_cached = BooleanField(default=False)
+    saved_tokens = CharField(null=True, max_length=10)
 
     class Meta:
         table_name = "rephrase_metrics"
@@ -0,0 +1,319 @@
+"""
+Write-behind persistence of the rows written while answering a query
+
+The message, follow-up question and metrics writes of a request are collected on a WriteBatch carried
+in a ContextVar and handed to a bounded queue when the request is done. A daemon worker drains the queue
+and flushes the queued batches in one transaction, so a slow DB never delays the answer.
+Row ids are generated client-side, so later updates of a row still pending insertion are merged into it.
+A failing flush is retried with exponential backoff before its batches are dropped, and the batches of a
+user still queued in this process can be flushed on demand, before their history is read from the DB.
+"""
+import atexit
+import datetime
+import logging
+import queue
+import threading
+import time
+from contextvars import ContextVar
+
+from database.database_config import connection_context, db_conn
+from django_core.config import Config
+
+logger = logging.getLogger(__name__)
+
+_current_batch = ContextVar("current_write_batch", default=None)
+
+
+class WriteBatch:
+    """
+    Inserts and updates collected for one request, in the order they were first made.
+    """
+
+    def __init__(self, user_id=None):
+        # the user whose request made the writes, set once known, so that their batches can be flushed on demand
+        self.user_id = user_id
+        self.operations = []
+        self.commit_callbacks = []
+        self.done = threading.Event()
+        self._claimed = False
+        self._pending_rows = {}
+        self._pending_updates = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_model_data(model_class, data):
+        # drop the keys that are not columns of the model, as Model.save() would
+        return {key: value for key, value in data.items() if key in model_class._meta.combined}
+
+    def insert(self, model_class, rows):
+        with self._lock:
+            for row in rows:
+                row = self.get_model_data(model_class, row)
+                self.operations.append(("insert", model_class, row))
+                if "id" in row:
+                    self._pending_rows[(model_class, str(row["id"]))] = row
+
+    def update(self, model_class, record_id, data):
+        data = self.get_model_data(model_class, data)
+        if not data:
+            return
+        key = (model_class, str(record_id))
+        with self._lock:
+            if key in self._pending_rows:
+                self._pending_rows[key].update(data)
+            elif key in self._pending_updates:
+                self._pending_updates[key].update(data)
+            else:
+                self._pending_updates[key] = {**data, "updated_on": datetime.datetime.now()}
+                self.operations.append(("update", model_class, (record_id, self._pending_updates[key])))
+
+    def on_commit(self, callback):
+        """
+        Call callback() once the writes of the batch are committed, e.g. to invalidate the cached rows.
+        """
+        self.commit_callbacks.append(callback)
+
+    def claim(self):
+        """
+        Claim the batch for writing, returning False when it was already claimed, so that it is written once.
+        """
+        with self._lock:
+            if self._claimed:
+                return False
+            self._claimed = True
+            return True
+
+    def run_commit_callbacks(self):
+        for callback in self.commit_callbacks:
+            try:
+                callback()
+            except Exception as error:
+                logger.error(error, exc_info=True)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def execute(self):
+        """
+        Run the collected operations; must be called inside a transaction.
+        Consecutive inserts of rows with the same columns into the same table are sent as one multi-row insert.
+        """
+        pending_model, pending_rows = None, []
+        for operation, model_class, payload in self.operations + [("end", None, None)]:
+            if pending_rows and (
+                operation != "insert" or model_class is not pending_model or payload.keys() != pending_rows[0].keys()
+            ):
+                pending_model.insert_many(pending_rows).execute()
+                pending_model, pending_rows = None, []
+
+            if operation == "insert":
+                pending_model = model_class
+                pending_rows.append(payload)
+            elif operation == "update":
+                record_id, data = payload
+                model_class.update(**data).where(model_class._meta.primary_key == record_id).execute()
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of WriteBatch instances flushed to the DB by a daemon worker thread.
+    """
+
+    def __init__(
+        self,
+        max_size=1000,
+        max_batches_per_flush=50,
+        enqueue_timeout=0.05,
+        max_retries=3,
+        retry_backoff=0.5,
+        flush_wait_timeout=5,
+    ):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.max_batches_per_flush = max_batches_per_flush
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.flush_wait_timeout = flush_wait_timeout
+        self.retried_flushes = 0
+        # user id -> their batches not written yet
+        self._pending_by_user = {}
+        self._pending_lock = threading.Lock()
+        self.flushed_batches = 0
+        self.failed_batches = 0
+        self.dropped_batches = 0
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._worker_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                    self._worker.start()
+
+    def submit(self, batch):
+        """
+        Queue a batch for writing, waiting at most enqueue_timeout when the queue is full.
+        """
+        if not batch:
+            return True
+        self._ensure_worker()
+        self._track(batch)
+        try:
+            self.queue.put(batch, timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            self.dropped_batches += 1
+            logger.error(f"Write-behind queue is full, dropping a batch of {len(batch)} writes")
+            self._untrack(batch)
+            return False
+
+    def _track(self, batch):
+        if batch.user_id:
+            with self._pending_lock:
+                self._pending_by_user.setdefault(str(batch.user_id), []).append(batch)
+
+    def _untrack(self, batch):
+        batch.done.set()
+        if batch.user_id:
+            with self._pending_lock:
+                user_batches = self._pending_by_user.get(str(batch.user_id), [])
+                if batch in user_batches:
+                    user_batches.remove(batch)
+                if not user_batches:
+                    self._pending_by_user.pop(str(batch.user_id), None)
+
+    def _run(self):
+        while True:
+            batches = [self.queue.get()]
+            while len(batches) < self.max_batches_per_flush:
+                try:
+                    batches.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.flush_batches(batches)
+            finally:
+                for _ in batches:
+                    self.queue.task_done()
+
+    def flush_batches(self, batches):
+        """
+        Write the batches in one transaction, falling back to one transaction per batch to isolate a failing one.
+        Batches already claimed (e.g. by flush_user) are skipped.
+        """
+        batches = [batch for batch in batches if batch.claim()]
+        if not batches:
+            return
+        self._flush_claimed(batches)
+
+    def _flush_claimed(self, batches):
+        if len(batches) > 1:
+            try:
+                self._write(batches)
+                return
+            except Exception as error:
+                logger.warning(f"Write-behind flush of {len(batches)} batches failed, retrying them one by one: {error}")
+            for batch in batches:
+                self._flush_claimed([batch])
+            return
+
+        # a single batch is retried with exponential backoff before it is dropped
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write(batches)
+                return
+            except Exception as error:
+                if attempt == self.max_retries:
+                    self.failed_batches += 1
+                    logger.error(f"Dropping a write-behind batch after {attempt + 1} attempts: {error}", exc_info=True)
+                    self._untrack(batches[0])
+                    return
+                self.retried_flushes += 1
+                delay = self.retry_backoff * (2**attempt)
+                logger.warning(f"Write-behind batch failed, retrying in {delay:.1f}s: {error}")
+                time.sleep(delay)
+
+    def _write(self, batches):
+        with connection_context(), db_conn.atomic():
+            for batch in batches:
+                batch.execute()
+        self.flushed_batches += len(batches)
+        for batch in batches:
+            self._untrack(batch)
+            batch.run_commit_callbacks()
+
+    def flush_user(self, user_id, timeout=None):
+        """
+        Write the user's batches still queued in this process, and wait for those being written by the worker,
+        so that their latest rows can be read back from the DB.
+        """
+        if not user_id:
+            return
+        with self._pending_lock:
+            user_batches = list(self._pending_by_user.get(str(user_id), []))
+        if not user_batches:
+            return
+        self.flush_batches(user_batches)
+        deadline = time.monotonic() + (self.flush_wait_timeout if timeout is None else timeout)
+        for batch in user_batches:
+            batch.done.wait(max(deadline - time.monotonic(), 0))
+
+    def drain(self):
+        """
+        Block until every queued batch has been written.
+        """
+        if self._worker is not None and self._worker.is_alive():
+            self.queue.join()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "max_size": self.queue.maxsize,
+            "flushed_batches": self.flushed_batches,
+            "failed_batches": self.failed_batches,
+            "retried_flushes": self.retried_flushes,
+            "dropped_batches": self.dropped_batches,
+        }
+
+
+write_behind_queue = WriteBehindQueue(
+    max_size=Config.WRITE_BEHIND_QUEUE_SIZE,
+    max_batches_per_flush=Config.WRITE_BEHIND_MAX_BATCHES_PER_FLUSH,
+    enqueue_timeout=Config.WRITE_BEHIND_ENQUEUE_TIMEOUT,
+    max_retries=Config.WRITE_BEHIND_MAX_RETRIES,
+    retry_backoff=Config.WRITE_BEHIND_RETRY_BACKOFF,
+    flush_wait_timeout=Config.WRITE_BEHIND_FLUSH_WAIT_TIMEOUT,
+)
+atexit.register(write_behind_queue.drain)
+
+
+def start_write_batch():
+    """
+    Start collecting the writes of the current request, returning the batch (None when write-behind is disabled).
+    """
+    batch = WriteBatch() if Config.WRITE_BEHIND_ENABLED else None
+    _current_batch.set(batch)
+    return batch
+
+
+def flush_user_writes(user_id):
+    """
+    Write the pending batches of the user before their rows are read back from the DB.
+    """
+    write_behind_queue.flush_user(user_id)
+
+
+def get_current_write_batch():
+    return _current_batch.get()
+
+
+def submit_write_batch(batch):
+    """
+    Stop collecting writes on the batch and queue it for writing.
+    """
+    if batch is None:
+        return False
+    if _current_batch.get() is batch:
+        _current_batch.set(None)
+    return write_behind_queue.submit(batch)
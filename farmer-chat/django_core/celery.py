@@ -1,6 +1,6 @@
 import os
 from celery import Celery, signals
-from database.database_config import pooled_db_conn
+from database.database_config import db_conn
 
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_core.settings")
@@ -16,23 +16,14 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
 
-db_conn = None
-
-
-# Define Celery signals for Peewee connection handling
+# Define Celery signals for Peewee connection handling: each task holds one pooled connection
 @signals.task_prerun.connect
 def task_prerun_handler(task_id, task, *args, **kwargs):
-    global db_conn
-    # Perform setup operations before task execution
-    if db_conn is None:
-        print("Initializing database connection for task.")
-        db_conn = pooled_db_conn
-    elif db_conn.is_closed():
-        print("Reusing database connection for task.")
-        db_conn.connect(reuse_if_open=True)
+    db_conn.connect(reuse_if_open=True)
 
 
 @signals.task_postrun.connect
 def task_postrun_handler(task_id, task, *args, **kwargs):
+    # closing returns the connection to the pool
     if not db_conn.is_closed():
         db_conn.close()
@@ -33,6 +33,26 @@ class Config:
     DB_PORT = ENV_CONFIG.get("DB_PORT")
     MAX_CONNECTIONS = ENV_CONFIG.get("DB_MAX_CONNECTIONS")
     STALE_TIMEOUT = ENV_CONFIG.get("DB_STALE_TIMEOUT")
+    # seconds to wait for a free pooled connection before failing, None waits indefinitely
+    DB_POOL_WAIT_TIMEOUT = float(ENV_CONFIG.get("DB_POOL_WAIT_TIMEOUT", 10)) or None
+
+    # Read-through caches of the users, languages and static multilingual texts, in seconds
+    USER_CACHE_TTL = int(ENV_CONFIG.get("USER_CACHE_TTL", 300))
+    LANGUAGE_CACHE_TTL = int(ENV_CONFIG.get("LANGUAGE_CACHE_TTL", 3600))
+    MULTILINGUAL_TEXT_CACHE_TTL = int(ENV_CONFIG.get("MULTILINGUAL_TEXT_CACHE_TTL", 3600))
+    WARM_LOOKUP_CACHES_ON_STARTUP = handle_boolean(ENV_CONFIG.get("WARM_LOOKUP_CACHES_ON_STARTUP", True))
+
+    # Write-behind persistence of the message, follow-up question and metrics rows of a query
+    WRITE_BEHIND_ENABLED = handle_boolean(ENV_CONFIG.get("WRITE_BEHIND_ENABLED", True))
+    WRITE_BEHIND_QUEUE_SIZE = int(ENV_CONFIG.get("WRITE_BEHIND_QUEUE_SIZE", 1000))
+    WRITE_BEHIND_MAX_BATCHES_PER_FLUSH = int(ENV_CONFIG.get("WRITE_BEHIND_MAX_BATCHES_PER_FLUSH", 50))
+    WRITE_BEHIND_ENQUEUE_TIMEOUT = float(ENV_CONFIG.get("WRITE_BEHIND_ENQUEUE_TIMEOUT", 0.05))
+    # a failing batch is retried WRITE_BEHIND_MAX_RETRIES times, after WRITE_BEHIND_RETRY_BACKOFF seconds doubling
+    # each time, before it is dropped; reading a user's history waits at most WRITE_BEHIND_FLUSH_WAIT_TIMEOUT
+    # seconds for their pending batches
+    WRITE_BEHIND_MAX_RETRIES = int(ENV_CONFIG.get("WRITE_BEHIND_MAX_RETRIES", 3))
+    WRITE_BEHIND_RETRY_BACKOFF = float(ENV_CONFIG.get("WRITE_BEHIND_RETRY_BACKOFF", 0.5))
+    WRITE_BEHIND_FLUSH_WAIT_TIMEOUT = float(ENV_CONFIG.get("WRITE_BEHIND_FLUSH_WAIT_TIMEOUT", 5))
 
     # prompts
     REPHRASE_QUESTION_PROMPT = ENV_CONFIG.get("REPHRASE_QUESTION_PROMPT")
@@ -40,6 +60,15 @@ class Config:
         "RERANKING_PROMPT_SINGLE_TEMPLATE"
     )
     RERANK_SINGLE_JSON_EXAMPLE = ENV_CONFIG.get("RERANK_SINGLE_JSON_EXAMPLE")
+
+    # reranking: RERANK_MODE is one of listwise, pointwise or local; BM25 is used unless a cross-encoder is set
+    RERANK_ENABLED = handle_boolean(ENV_CONFIG.get("RERANK_ENABLED", False))
+    RERANK_MODE = ENV_CONFIG.get("RERANK_MODE", "listwise")
+    RERANK_FIRST_STAGE_TOP_K = int(ENV_CONFIG.get("RERANK_FIRST_STAGE_TOP_K", 6))
+    RERANK_MAX_CONCURRENCY = int(ENV_CONFIG.get("RERANK_MAX_CONCURRENCY", 3))
+    RERANK_CROSS_ENCODER_MODEL = ENV_CONFIG.get("RERANK_CROSS_ENCODER_MODEL")
+    RERANK_CACHE_MAX_ENTRIES = int(ENV_CONFIG.get("RERANK_CACHE_MAX_ENTRIES", 20000))
+    RERANK_CACHE_TTL = int(ENV_CONFIG.get("RERANK_CACHE_TTL", 86400))
     INTENT_CLASSIFICATION_PROMPT_TEMPLATE = ENV_CONFIG.get(
         "INTENT_CLASSIFICATION_PROMPT_TEMPLATE"
     )
@@ -59,12 +88,63 @@ class Config:
     MAX_TOKENS = ENV_CONFIG.get("MAX_TOKENS", 500)
     CHAT_HISTORY_WINDOW = ENV_CONFIG.get("CHAT_HISTORY_WINDOW", 4)
 
+    # Rolling chat history: the latest CHAT_HISTORY_WINDOW turns are kept verbatim, older ones are summarised
+    # (CHAT_HISTORY_SUMMARY_MODE is extractive or llm) so that the history fits CHAT_HISTORY_TOKEN_BUDGET
+    CHAT_HISTORY_TOKEN_BUDGET = int(ENV_CONFIG.get("CHAT_HISTORY_TOKEN_BUDGET", 1000))
+    CHAT_HISTORY_ANSWER_TOKENS = int(ENV_CONFIG.get("CHAT_HISTORY_ANSWER_TOKENS", 150))
+    CHAT_HISTORY_SUMMARY_TOKENS = int(ENV_CONFIG.get("CHAT_HISTORY_SUMMARY_TOKENS", 250))
+    CHAT_HISTORY_SUMMARY_MODE = ENV_CONFIG.get("CHAT_HISTORY_SUMMARY_MODE", "extractive")
+    CHAT_HISTORY_CACHE_TTL = int(ENV_CONFIG.get("CHAT_HISTORY_CACHE_TTL", 3600))
+
+    # OpenAI rate limits: defaults per model, overridden by a JSON map such as {"gpt-4-0125-preview": {"rpm": 500, "tpm": 30000}}.
+    # The limits are those of the API key: shared through Redis when REDIS_URL is set, otherwise split evenly
+    # across OPENAI_PROCESS_COUNT processes (by default the 3 gunicorn workers)
+    OPENAI_DEFAULT_RPM = int(ENV_CONFIG.get("OPENAI_DEFAULT_RPM", 500))
+    OPENAI_DEFAULT_TPM = int(ENV_CONFIG.get("OPENAI_DEFAULT_TPM", 60000))
+    OPENAI_MODEL_RATE_LIMITS = ENV_CONFIG.get("OPENAI_MODEL_RATE_LIMITS")
+    OPENAI_PROCESS_COUNT = int(ENV_CONFIG.get("OPENAI_PROCESS_COUNT", 3))
+    OPENAI_MAX_BACKOFF = float(ENV_CONFIG.get("OPENAI_MAX_BACKOFF", 60))
+
+    # Pipeline stage metrics exported on /metrics when prometheus_client is installed
+    PROMETHEUS_METRICS_ENABLED = handle_boolean(ENV_CONFIG.get("PROMETHEUS_METRICS_ENABLED", True))
+
+    # Deterministic LLM response cache: LLM_CACHE_BACKEND is one of memory, redis or disk, a TTL of 0 never expires
+    LLM_CACHE_ENABLED = handle_boolean(ENV_CONFIG.get("LLM_CACHE_ENABLED", True))
+    LLM_CACHE_GENERATION_ENABLED = handle_boolean(ENV_CONFIG.get("LLM_CACHE_GENERATION_ENABLED", False))
+    LLM_CACHE_BACKEND = ENV_CONFIG.get("LLM_CACHE_BACKEND", "memory")
+    LLM_CACHE_MAX_ENTRIES = int(ENV_CONFIG.get("LLM_CACHE_MAX_ENTRIES", 10000))
+    LLM_CACHE_TTL = int(ENV_CONFIG.get("LLM_CACHE_TTL", 7 * 86400))
+    LLM_CACHE_DIR = ENV_CONFIG.get("LLM_CACHE_DIR", os.path.join("media", "llm_cache"))
+    LLM_CACHE_MAX_BYTES = int(ENV_CONFIG.get("LLM_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
     # Content Retrieval APIs
     CONTENT_DOMAIN_URL = ENV_CONFIG.get("CONTENT_DOMAIN_URL")
     CONTENT_AUTHENTICATE_ENDPOINT = ENV_CONFIG.get("CONTENT_AUTHENTICATE_ENDPOINT")
     CONTENT_RETRIEVAL_ENDPOINT = ENV_CONFIG.get("CONTENT_RETRIEVAL_ENDPOINT")
     FARMSTACK_ORG_ID = ENV_CONFIG.get("FARMSTACK_ORG_ID", "1")
 
+    # Pooled HTTP client for the Farmstack APIs
+    HTTP_POOL_MAX_CONNECTIONS = int(ENV_CONFIG.get("HTTP_POOL_MAX_CONNECTIONS", 100))
+    HTTP_POOL_MAX_KEEPALIVE = int(ENV_CONFIG.get("HTTP_POOL_MAX_KEEPALIVE", 20))
+    HTTP_KEEPALIVE_EXPIRY = float(ENV_CONFIG.get("HTTP_KEEPALIVE_EXPIRY", 30))
+    HTTP2_ENABLED = handle_boolean(ENV_CONFIG.get("HTTP2_ENABLED", True))
+    HTTP_TIMEOUT = float(ENV_CONFIG.get("HTTP_TIMEOUT", 30))
+    HTTP_MAX_RETRIES = int(ENV_CONFIG.get("HTTP_MAX_RETRIES", 3))
+    RETRIEVAL_TIMEOUT = float(ENV_CONFIG.get("RETRIEVAL_TIMEOUT", 30))
+    RETRIEVAL_MAX_RETRIES = int(ENV_CONFIG.get("RETRIEVAL_MAX_RETRIES", 2))
+    AUTHENTICATION_TIMEOUT = float(ENV_CONFIG.get("AUTHENTICATION_TIMEOUT", 10))
+    AUTHENTICATION_MAX_RETRIES = int(ENV_CONFIG.get("AUTHENTICATION_MAX_RETRIES", 3))
+    SPECULATIVE_RETRIEVAL_ENABLED = handle_boolean(ENV_CONFIG.get("SPECULATIVE_RETRIEVAL_ENABLED", True))
+
+    # Shared cache backend, used by the caches that persist across processes when set
+    REDIS_URL = ENV_CONFIG.get("REDIS_URL")
+
+    # Semantic answer cache
+    SEMANTIC_CACHE_ENABLED = handle_boolean(ENV_CONFIG.get("SEMANTIC_CACHE_ENABLED", True))
+    SEMANTIC_CACHE_SIMILARITY_THRESHOLD = float(ENV_CONFIG.get("SEMANTIC_CACHE_SIMILARITY_THRESHOLD", 0.95))
+    SEMANTIC_CACHE_TTL = int(ENV_CONFIG.get("SEMANTIC_CACHE_TTL", 86400))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(ENV_CONFIG.get("SEMANTIC_CACHE_MAX_ENTRIES", 5000))
+
     # Language
     LANGUAGE_BCP_CODE_NATIVE = ENV_CONFIG.get("LANGUAGE_BCP_CODE_NATIVE", "en-US")
     LANGUAGE_SHORT_CODE_NATIVE = os.environ.get("LANGUAGE_SHORT_CODE_NATIVE", "en")
@@ -76,5 +156,85 @@ class Config:
         "GCP_TRANSLATION_CREDENTIALS_PATH", 
         GOOGLE_APPLICATION_CREDENTIALS
     )
-    # Gemini API for skin disease detection
+    GCP_GRPC_POOL_SIZE = int(ENV_CONFIG.get("GCP_GRPC_POOL_SIZE", 4))
+    TRANSLATION_CACHE_MAX_ENTRIES = int(ENV_CONFIG.get("TRANSLATION_CACHE_MAX_ENTRIES", 20000))
+    TRANSLATION_CACHE_TTL = int(ENV_CONFIG.get("TRANSLATION_CACHE_TTL", 7 * 86400))
+
+    # Text-to-speech audio cache, the disk tier is disabled when TTS_DISK_CACHE_DIR is empty
+    TTS_MEMORY_CACHE_MAX_ENTRIES = int(ENV_CONFIG.get("TTS_MEMORY_CACHE_MAX_ENTRIES", 256))
+    TTS_DISK_CACHE_DIR = ENV_CONFIG.get("TTS_DISK_CACHE_DIR", os.path.join("media", "tts_cache"))
+    TTS_DISK_CACHE_MAX_BYTES = int(ENV_CONFIG.get("TTS_DISK_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+    # Sentence-level speech synthesis
+    TTS_SEGMENT_MAX_CHARS = int(ENV_CONFIG.get("TTS_SEGMENT_MAX_CHARS", 400))
+    TTS_STREAM_CONCURRENCY = int(ENV_CONFIG.get("TTS_STREAM_CONCURRENCY", 4))
+
+    # Speech-to-text: audio larger than ASR_LONG_AUDIO_MIN_BYTES is split on silence into chunks of at most
+    # ASR_CHUNK_MAX_SECONDS recognised concurrently, or streamed (the API caps each message at 25 KB) without pydub
+    ASR_LONG_AUDIO_MIN_BYTES = int(ENV_CONFIG.get("ASR_LONG_AUDIO_MIN_BYTES", 256 * 1024))
+    ASR_STREAMING_CHUNK_BYTES = int(ENV_CONFIG.get("ASR_STREAMING_CHUNK_BYTES", 16 * 1024))
+    ASR_CHUNK_MAX_SECONDS = float(ENV_CONFIG.get("ASR_CHUNK_MAX_SECONDS", 50))
+    ASR_CHUNK_MIN_SILENCE_MS = int(ENV_CONFIG.get("ASR_CHUNK_MIN_SILENCE_MS", 500))
+    ASR_CHUNK_SILENCE_OFFSET_DB = float(ENV_CONFIG.get("ASR_CHUNK_SILENCE_OFFSET_DB", 16))
+    ASR_CHUNK_CONCURRENCY = int(ENV_CONFIG.get("ASR_CHUNK_CONCURRENCY", 4))
+
+    # Medical phrase translations and STT corrections by language, compiled once per process
+    MEDICAL_PHRASE_DICTIONARY_PATH = ENV_CONFIG.get(
+        "MEDICAL_PHRASE_DICTIONARY_PATH",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "language_service", "dictionaries", "medical_phrases.json"),
+    )
+
+    # Gemini API for skin disease detection and lab report analysis
     GOOGLE_API_KEY = ENV_CONFIG.get("GOOGLE_API_KEY")
+    GEMINI_API_KEY = (
+        ENV_CONFIG.get("GEMINI_API_KEY") or GOOGLE_API_KEY or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    )
+    GEMINI_SKIN_MODEL = ENV_CONFIG.get("GEMINI_SKIN_MODEL", "models/gemini-2.0-flash")
+    GEMINI_LAB_REPORT_MODEL = ENV_CONFIG.get("GEMINI_LAB_REPORT_MODEL", "gemini-2.0-flash-exp")
+    # client-side quota of the Gemini gateway: requests per minute and per day of the API key, how long a
+    # request may wait in line, and how many may wait before new ones are shed. The quota is shared through
+    # Redis when REDIS_URL is set, otherwise split evenly across GEMINI_PROCESS_COUNT processes (by default
+    # the 3 gunicorn workers and the 2 analysis job worker processes)
+    GEMINI_RPM = int(ENV_CONFIG.get("GEMINI_RPM", 15))
+    GEMINI_RPD = int(ENV_CONFIG.get("GEMINI_RPD", 1500))
+    GEMINI_PROCESS_COUNT = int(ENV_CONFIG.get("GEMINI_PROCESS_COUNT", 5))
+    GEMINI_MAX_QUEUE_WAIT = float(ENV_CONFIG.get("GEMINI_MAX_QUEUE_WAIT", 30))
+    GEMINI_MAX_WAITING = int(ENV_CONFIG.get("GEMINI_MAX_WAITING", 20))
+    GEMINI_RATE_LIMIT_BACKOFF = float(ENV_CONFIG.get("GEMINI_RATE_LIMIT_BACKOFF", 30))
+    GEMINI_REQUEST_TIMEOUT = float(ENV_CONFIG.get("GEMINI_REQUEST_TIMEOUT", 120))
+
+    # Lab report text extraction: PDF pages with this much text are read from their text layer, the others
+    # are rendered at LAB_REPORT_OCR_DPI and sent to OCR, at most LAB_REPORT_OCR_CONCURRENCY at a time
+    LAB_REPORT_TEXT_LAYER_MIN_CHARS = int(ENV_CONFIG.get("LAB_REPORT_TEXT_LAYER_MIN_CHARS", 50))
+    LAB_REPORT_OCR_DPI = int(ENV_CONFIG.get("LAB_REPORT_OCR_DPI", 150))
+    LAB_REPORT_OCR_CONCURRENCY = int(ENV_CONFIG.get("LAB_REPORT_OCR_CONCURRENCY", 4))
+    LAB_REPORT_OCR_CACHE_MAX_ENTRIES = int(ENV_CONFIG.get("LAB_REPORT_OCR_CACHE_MAX_ENTRIES", 2000))
+    LAB_REPORT_OCR_CACHE_TTL = int(ENV_CONFIG.get("LAB_REPORT_OCR_CACHE_TTL", 7 * 86400))
+    # longest side of the skin image sent to the model, and of the copy the pre-screening statistics are computed on
+    SKIN_MODEL_IMAGE_MAX_SIDE = int(ENV_CONFIG.get("SKIN_MODEL_IMAGE_MAX_SIDE", 1536))
+    SKIN_WORKING_IMAGE_MAX_SIDE = int(ENV_CONFIG.get("SKIN_WORKING_IMAGE_MAX_SIDE", 768))
+
+    # Reuse of the user's earlier skin and lab report analyses of the same (or a near-duplicate) upload
+    ANALYSIS_CACHE_ENABLED = handle_boolean(ENV_CONFIG.get("ANALYSIS_CACHE_ENABLED", True))
+    ANALYSIS_CACHE_TTL = int(ENV_CONFIG.get("ANALYSIS_CACHE_TTL", 7 * 86400))
+    ANALYSIS_CACHE_MAX_HAMMING_DISTANCE = int(ENV_CONFIG.get("ANALYSIS_CACHE_MAX_HAMMING_DISTANCE", 6))
+    ANALYSIS_CACHE_LOOKUP_LIMIT = int(ENV_CONFIG.get("ANALYSIS_CACHE_LOOKUP_LIMIT", 50))
+
+    # Background skin and lab report analysis jobs (Celery). Without a broker, the job endpoints answer 503
+    # and entrypoint.sh does not start the worker.
+    CELERY_BROKER_URL = ENV_CONFIG.get("CELERY_BROKER_URL", ENV_CONFIG.get("REDIS_URL"))
+    ANALYSIS_JOB_QUEUE = ENV_CONFIG.get("ANALYSIS_JOB_QUEUE", "analysis")
+    # worker processes of the analysis queue, and the rate each worker node starts jobs at (celery's rate limit
+    # applies per worker node, shared by its processes); worker nodes x rate limit should stay within the
+    # Gemini requests per minute quota
+    ANALYSIS_JOB_CONCURRENCY = int(ENV_CONFIG.get("ANALYSIS_JOB_CONCURRENCY", 2))
+    ANALYSIS_JOB_RATE_LIMIT = ENV_CONFIG.get("ANALYSIS_JOB_RATE_LIMIT", "5/m")
+    ANALYSIS_JOB_MAX_RETRIES = int(ENV_CONFIG.get("ANALYSIS_JOB_MAX_RETRIES", 5))
+    ANALYSIS_JOB_RETRY_BACKOFF = float(ENV_CONFIG.get("ANALYSIS_JOB_RETRY_BACKOFF", 10))
+    ANALYSIS_JOB_RETRY_BACKOFF_MAX = float(ENV_CONFIG.get("ANALYSIS_JOB_RETRY_BACKOFF_MAX", 300))
+    ANALYSIS_JOB_WEBHOOK_TIMEOUT = float(ENV_CONFIG.get("ANALYSIS_JOB_WEBHOOK_TIMEOUT", 10))
+    ANALYSIS_JOB_WEBHOOK_MAX_RETRIES = int(ENV_CONFIG.get("ANALYSIS_JOB_WEBHOOK_MAX_RETRIES", 2))
+    # comma-separated hosts (and their subdomains) webhooks may be posted to; empty allows any public host
+    ANALYSIS_JOB_WEBHOOK_ALLOWED_HOSTS = ENV_CONFIG.get("ANALYSIS_JOB_WEBHOOK_ALLOWED_HOSTS", "")
+    ANALYSIS_JOB_STREAM_POLL_INTERVAL = float(ENV_CONFIG.get("ANALYSIS_JOB_STREAM_POLL_INTERVAL", 1))
+    ANALYSIS_JOB_STREAM_TIMEOUT = float(ENV_CONFIG.get("ANALYSIS_JOB_STREAM_TIMEOUT", 300))
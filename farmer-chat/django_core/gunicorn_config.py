@@ -0,0 +1,15 @@
+"""
+Gunicorn server hooks, loaded by entrypoint.sh
+"""
+import os
+
+
+def child_exit(server, worker):
+    # drop the live gauges of an exited worker from the Prometheus multiprocess directory
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
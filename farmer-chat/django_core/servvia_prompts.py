@@ -44,6 +44,16 @@ RESPONSE_GEN_PROMPT = """You are ServVia, a caring and intelligent AI health com
 Now provide your PERSONALIZED, SAFE response for {name_1}:"""
 
 
+RERANKING_PROMPT_LISTWISE_TEMPLATE = """Given the numbered text chunks related to home remedies and health below, and a user question, classify each chunk as YES or NO, whether it is relevant to the question or not. Also include a relevance score for each chunk: a number from 1 to 10, where 10 means the chunk is very relevant to answer the question and 1 means the chunk is not relevant at all.
+
+Output a JSON array with one object per chunk, with the keys: id, classification, and relevance_score. Acceptable values for classification: YES or NO. Acceptable values for relevance_score: integer between 1 to 10. Example Response: [{{"id": "123", "classification": "YES", "relevance_score": 8}}]. Do not include any explanations, only provide a RFC8259 compliant JSON response following this format without deviation.
+
+### User question: {question}
+
+### Text chunks:
+{chunks}"""
+
+
 def get_user_profile_context(profile_data):
     """Format user profile for prompt inclusion"""
     if not profile_data:
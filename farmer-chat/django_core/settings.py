@@ -5,7 +5,7 @@ Generated by 'django-admin startproject' using Django 4.1.5.
 """
 import os
 from pathlib import Path
-from django_core.config import ENV_CONFIG
+from django_core.config import ENV_CONFIG, Config
 from django_core.logging_config import configure_logging
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -50,6 +50,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "database.middleware.DatabaseConnectionMiddleware",
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -116,4 +117,16 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760
\ No newline at end of file
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760
+
+# Celery: the skin and lab report analysis jobs run on their own queue, results are stored on the models.
+# Without a broker the job endpoints are disabled (see common.analysis_jobs), jobs never run in the request.
+CELERY_BROKER_URL = Config.CELERY_BROKER_URL
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_WORKER_CONCURRENCY = Config.ANALYSIS_JOB_CONCURRENCY
+CELERY_TASK_ROUTES = {
+    "skin_analysis.tasks.*": {"queue": Config.ANALYSIS_JOB_QUEUE},
+    "lab_report.tasks.*": {"queue": Config.ANALYSIS_JOB_QUEUE},
+}
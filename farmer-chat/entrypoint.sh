@@ -3,8 +3,22 @@ touch /app/logs
 tail -n 0 -f /app/logs &
 cd /app
 
+# Prometheus multiprocess mode: each gunicorn worker writes its metrics to PROMETHEUS_MULTIPROC_DIR and
+# /metrics aggregates them. The directory is emptied on start, as the files of previous runs would be counted.
+PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 # Gunicorn run
-/opt/venv/bin/gunicorn --workers=3 -k uvicorn.workers.UvicornH11Worker --bind 0.0.0.0:8000 -m 007 --log-level debug --access-logfile /app/logs --error-logfile /app/logs --log-file /app/logs --capture-output django_core.asgi:application &
+PROMETHEUS_MULTIPROC_DIR="$PROMETHEUS_MULTIPROC_DIR" /opt/venv/bin/gunicorn -c django_core/gunicorn_config.py --workers=3 -k uvicorn.workers.UvicornH11Worker --bind 0.0.0.0:8000 -m 007 --log-level debug --access-logfile /app/logs --error-logfile /app/logs --log-file /app/logs --capture-output django_core.asgi:application &
+
+# Celery worker of the skin and lab report analysis jobs (concurrency and queue from the config),
+# started only when a broker is configured (CELERY_BROKER_URL or REDIS_URL)
+ANALYSIS_JOB_QUEUE=$(/opt/venv/bin/python -c "from django_core.config import Config; print(Config.ANALYSIS_JOB_QUEUE if Config.CELERY_BROKER_URL else '')")
+if [ -n "$ANALYSIS_JOB_QUEUE" ]; then
+    /opt/venv/bin/celery -A django_core worker -Q "$ANALYSIS_JOB_QUEUE" --loglevel info --logfile /app/logs &
+else
+    echo "No Celery broker configured, the analysis job worker is not started" >> /app/logs
+fi
 
 wait
 
@@ -78,6 +78,8 @@ async def generate_query_response(original_query, user_name, context_chunks, rep
 
     response_gen_exception = None
     response_gen_retries = 0
+    is_cached = False
+    saved_tokens = 0
 
     response_map.update({
         "response": llm_response,
@@ -90,16 +92,22 @@ async def generate_query_response(original_query, user_name, context_chunks, rep
         "total_tokens": generation_total_tokens,
         "response_gen_exception": response_gen_exception,
         "response_gen_retries": response_gen_retries,
+        "is_cached": is_cached,
+        "saved_tokens": saved_tokens,
     })
 
     response_prompt = await setup_prompt(user_name, context_chunks, rephrased_query, email_id, user_profile)
 
     response_gen_start = datetime.datetime.now()
-    generated_response, response_gen_exception, response_gen_retries = await make_openai_request(response_prompt)
+    generated_response, response_gen_exception, response_gen_retries = await make_openai_request(
+        response_prompt, use_cache=Config.LLM_CACHE_GENERATION_ENABLED
+    )
     response_gen_end = datetime.datetime.now()
 
     if generated_response:
         llm_response = generated_response.choices[0].message.content
+        is_cached = getattr(generated_response, "is_cached", False)
+        saved_tokens = getattr(generated_response, "saved_tokens", 0)
         usage = getattr(generated_response, "usage", None)
         if usage:
             generation_completion_tokens = getattr(usage, "completion_tokens", 0)
@@ -117,6 +125,8 @@ async def generate_query_response(original_query, user_name, context_chunks, rep
         "total_tokens": generation_total_tokens,
         "response_gen_exception": response_gen_exception,
         "response_gen_retries": response_gen_retries,
+        "is_cached": is_cached,
+        "saved_tokens": saved_tokens,
     })
 
     return response_map
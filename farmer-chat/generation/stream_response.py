@@ -0,0 +1,110 @@
+"""
+Streaming response generation for the text query SSE endpoint
+"""
+import json
+import logging
+
+from common.constants import Constants
+from common.utils import split_complete_sentences
+from generation.generate_response import setup_prompt
+from language_service.translation import a_translate_to
+from rag_service.openai_service import stream_openai_request
+
+logger = logging.getLogger(__name__)
+
+
+async def stream_query_response(original_query, user_name, context_chunks, rephrased_query, email_id=None, user_profile=None):
+    """
+    Stream the final response with user profile context as text deltas.
+    """
+    response_prompt = await setup_prompt(user_name, context_chunks, rephrased_query, email_id, user_profile)
+    async for delta in stream_openai_request(response_prompt):
+        yield delta
+
+
+class FollowUpQuestionSplitter:
+    """
+    Separate the streamed answer from the follow-up questions that trail it.
+
+    Text that could still turn out to be the start of a follow-up question marker
+    (SPLIT_STRING_LIST_FOR_FOLLOW_UP_QUESTIONS) is held back until it can be decided.
+    """
+
+    def __init__(self, markers=None):
+        self.markers = markers or Constants.SPLIT_STRING_LIST_FOR_FOLLOW_UP_QUESTIONS
+        self.buffer = ""
+        self.questions_text = ""
+        self.marker_found = False
+
+    def feed(self, delta):
+        """
+        Add a streamed delta and return the answer text that is safe to emit.
+        """
+        if self.marker_found:
+            self.questions_text += delta
+            return ""
+
+        self.buffer += delta
+        for marker in self.markers:
+            index = self.buffer.find(marker)
+            if index != -1:
+                answer_text = self.buffer[:index]
+                self.questions_text = self.buffer[index + len(marker):]
+                self.buffer = ""
+                self.marker_found = True
+                return answer_text
+
+        emit_length = len(self.buffer) - self.get_partial_marker_length()
+        answer_text, self.buffer = self.buffer[:emit_length], self.buffer[emit_length:]
+        return answer_text
+
+    def get_partial_marker_length(self):
+        """
+        Length of the longest buffer suffix that is the beginning of a marker.
+        """
+        partial_marker_length = 0
+        for marker in self.markers:
+            for length in range(min(len(marker) - 1, len(self.buffer)), partial_marker_length, -1):
+                if self.buffer.endswith(marker[:length]):
+                    partial_marker_length = length
+                    break
+        return partial_marker_length
+
+    def finish(self):
+        """
+        Return the answer text still held back at the end of the stream.
+        """
+        answer_text, self.buffer = self.buffer, ""
+        return answer_text
+
+    def get_follow_up_questions(self):
+        return self.questions_text.strip().split("\n")[:3] if self.questions_text.strip() else []
+
+
+async def stream_translated_answer(answer_deltas, input_language):
+    """
+    Stream the answer in the user's language. English deltas are passed through as they arrive,
+    other languages are translated sentence by sentence as each sentence completes.
+    """
+    output_language = input_language.split("-")[0] if "-" in input_language else input_language
+    if output_language == Constants.LANGUAGE_SHORT_CODE_ENG:
+        async for delta in answer_deltas:
+            yield delta
+        return
+
+    pending_text = ""
+    async for delta in answer_deltas:
+        pending_text += delta
+        sentences, pending_text = split_complete_sentences(pending_text)
+        for sentence in sentences:
+            yield await a_translate_to(sentence, output_language) + " "
+
+    if pending_text.strip():
+        yield await a_translate_to(pending_text.strip(), output_language)
+
+
+def format_sse_event(event, data):
+    """
+    Format a server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -1,4 +1,5 @@
 from django_core.config import Config
+from rag_service.openai_scheduler import PRIORITY_INTENT
 from rag_service.openai_service import make_openai_request
 from intent_classification.constants import IntentConstants
 
@@ -8,7 +9,9 @@ async def classify_intent(qn):
     Classify the query or question intent into any of the classification to which it falls under.
     """
     prompt = Config.INTENT_CLASSIFICATION_PROMPT_TEMPLATE.format(input=qn)
-    intent_response, ex, retries = await make_openai_request(prompt, model=Config.GPT_4_MODEL)
+    intent_response, ex, retries = await make_openai_request(
+        prompt, model=Config.GPT_4_MODEL, priority=PRIORITY_INTENT, use_cache=Config.LLM_CACHE_ENABLED
+    )
     return intent_response.choices[0].message.content if intent_response else IntentConstants.USER_INTENT_HEALTH
 
 
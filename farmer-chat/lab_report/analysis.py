@@ -0,0 +1,93 @@
+from common.analysis_jobs import JOB_COMPLETED
+from common.gemini_gateway import GeminiGatewayError, gateway_error_result
+from . report_analyzer import LabReportAnalyzer
+import logging
+
+logger = logging.getLogger(__name__)
+analyzer = LabReportAnalyzer()
+
+
+def extract_report_text(report_files):
+    """Extract and join the text of every page of the report, the pages needing OCR in parallel"""
+    all_extracted_text = ""
+    logger.info(f"📄 Processing {len(report_files)} page(s)")
+
+    for idx, extracted_text in enumerate(analyzer.extract_texts(report_files), 1):
+        if extracted_text:
+            all_extracted_text += f"\n\n=== PAGE {idx} ===\n\n{extracted_text}"
+        else:
+            logger.warning(f"⚠️ No text extracted from page {idx}")
+
+    return all_extracted_text
+
+
+def run_lab_report_analysis(lab_report, report_files):
+    """
+    Extract the text of the report pages, analyse it and, when the analysis succeeds, save it on the LabReport.
+    Returns the analysis result; 'error_type' is 'no_text' when no text could be extracted, and failed Gemini
+    requests carry the HTTP 'status_code' to answer with (see common.gemini_gateway).
+    """
+    try:
+        all_extracted_text = extract_report_text(report_files)
+    except GeminiGatewayError as e:
+        logger.warning(f"⚠️ Text extraction not served: {e}")
+        return gateway_error_result(e)
+
+    if not all_extracted_text. strip():
+        return {
+            'success': False,
+            'error': 'Could not extract text from any report page.  Please ensure images are clear.',
+            'error_type': 'no_text'
+        }
+
+    logger.info(f"✅ Extracted total {len(all_extracted_text)} characters from {len(report_files)} page(s)")
+
+    # Analyze combined text
+    analysis_result = analyzer.summarize_report(all_extracted_text, lab_report.email_id)
+
+    if not analysis_result. get('success'):
+        return analysis_result
+
+    lab_report.extracted_text = all_extracted_text
+    lab_report.summary = analysis_result.get('summary', '')
+    lab_report.analysis = analysis_result.get('analysis', {})
+    lab_report.abnormal_values = analysis_result.get('abnormal_values', [])
+    lab_report.result = analysis_result
+    lab_report.status = JOB_COMPLETED
+    lab_report.error = ''
+    lab_report.save()
+
+    logger.info(f"✅ Lab report saved: ID {lab_report.id} ({len(report_files)} pages)")
+    return analysis_result
+
+
+def build_lab_report_response(lab_report, analysis_result, pages_processed=None, is_cached=False):
+    """Build the analysis response of a saved LabReport from its analysis result"""
+    # Get formatted summary
+    formatted_summary = analysis_result.get('summary', '')
+
+    if not formatted_summary or formatted_summary == 'undefined':
+        formatted_summary = analysis_result.get('analysis', {}).get('summary', 'No summary available')
+
+    return {
+        'success': True,
+        'report_id': lab_report.id,
+        'pages_processed': pages_processed if pages_processed is not None else len(lab_report.page_hashes),
+        'test_type': analysis_result.get('analysis', {}).get('test_type', 'Lab Report'),
+        'report_date': analysis_result.get('analysis', {}).get('report_date', ''),
+        'summary': formatted_summary,
+        'formatted_summary': formatted_summary,
+        'abnormal_count': analysis_result.get('analysis', {}).get('abnormal_count', 0),
+        'normal_count': analysis_result.get('visual_indicators', {}).get('normal_count', 0),
+        'critical_count': analysis_result.get('visual_indicators', {}).get('critical_count', 0),
+        'parameters': analysis_result.get('abnormal_values', []),
+        'recommendations': analysis_result.get('recommendations', []),
+        'critical_flags': analysis_result.get('critical_flags', []),
+        'overall_status': analysis_result.get('analysis', {}).get('overall_status', ''),
+        'follow_up_needed': analysis_result.get('analysis', {}).get('follow_up_needed', False),
+        'is_cached': is_cached
+    }
+
+
+def build_saved_lab_report_response(lab_report):
+    return build_lab_report_response(lab_report, lab_report.result)
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.4 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lab_report", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="labreport",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="labreport",
+            name="page_hashes",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="labreport",
+            name="result",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
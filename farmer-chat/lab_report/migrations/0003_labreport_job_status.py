@@ -0,0 +1,43 @@
+# Generated by Django 4.2.4 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lab_report", "0002_labreport_upload_hashes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="labreport",
+            name="page_files",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="labreport",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                db_index=True,
+                default="completed",
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="labreport",
+            name="error",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="labreport",
+            name="webhook_url",
+            field=models.URLField(blank=True, max_length=500),
+        ),
+    ]
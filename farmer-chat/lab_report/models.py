@@ -1,5 +1,7 @@
 from django.db import models
 
+from common.analysis_jobs import JOB_COMPLETED, JOB_STATUS_CHOICES
+
 class LabReport(models.Model):
     email_id = models.EmailField()
     report_file = models.FileField(upload_to='lab_reports/')
@@ -7,6 +9,14 @@ class LabReport(models.Model):
     summary = models.TextField(blank=True)
     analysis = models.JSONField(default=dict, blank=True)
     abnormal_values = models.JSONField(default=list, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    page_hashes = models.JSONField(default=list, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    # stored names of the pages after the first (report_file), for the background analysis
+    page_files = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=16, choices=JOB_STATUS_CHOICES, default=JOB_COMPLETED, db_index=True)
+    error = models.TextField(blank=True)
+    webhook_url = models.URLField(max_length=500, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
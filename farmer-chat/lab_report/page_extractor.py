@@ -0,0 +1,137 @@
+"""
+Tiered text extraction of lab report uploads
+
+PDF pages are read from their text layer with PyMuPDF, which is near-instant for the digitally generated
+reports most labs send. Only the pages without one (scans) are rasterised and sent to the vision model,
+along with uploaded photos, in parallel with at most LAB_REPORT_OCR_CONCURRENCY requests in flight.
+OCR results are cached by the hash of the page image, so a page seen before is not sent again. Without
+PyMuPDF, a PDF is sent to the model as a whole.
+"""
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from common.cache import build_tiered_cache
+from common.gemini_gateway import get_request_key
+from django_core.config import Config
+from PIL import Image
+
+try:
+    import fitz
+
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+PDF_SIGNATURE = b"%PDF"
+
+# page content hash -> OCR text, shared across requests and, with REDIS_URL, across workers
+page_ocr_cache = build_tiered_cache(
+    "lab_report_ocr", Config.LAB_REPORT_OCR_CACHE_MAX_ENTRIES, Config.LAB_REPORT_OCR_CACHE_TTL
+)
+
+
+class ReportPage:
+    """
+    A page of an upload: its text when it has a text layer, otherwise the content part to OCR
+    (a PIL image, or a {"mime_type", "data"} part for a whole PDF).
+    """
+
+    def __init__(self, text=None, ocr_part=None):
+        self.text = text
+        self.ocr_part = ocr_part
+
+    @property
+    def needs_ocr(self):
+        return self.text is None
+
+
+def is_pdf(file_data):
+    return file_data[:1024].lstrip().startswith(PDF_SIGNATURE)
+
+
+def rasterize_pdf_page(page, dpi=None):
+    """
+    Render a PDF page to an RGB PIL image.
+    """
+    pixmap = page.get_pixmap(dpi=dpi or Config.LAB_REPORT_OCR_DPI, alpha=False)
+    return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def load_pdf_pages(file_data, min_text_chars=None):
+    """
+    Read each page of a PDF from its text layer, rasterising the pages with less than min_text_chars of text.
+    """
+    min_text_chars = Config.LAB_REPORT_TEXT_LAYER_MIN_CHARS if min_text_chars is None else min_text_chars
+    pages = []
+    with fitz.open(stream=file_data, filetype="pdf") as document:
+        for page in document:
+            text = page.get_text("text").strip()
+            if len(text) >= min_text_chars:
+                pages.append(ReportPage(text=text))
+            else:
+                pages.append(ReportPage(ocr_part=rasterize_pdf_page(page)))
+
+    text_pages = sum(1 for page in pages if not page.needs_ocr)
+    logger.info(f"📄 PDF text layer: {text_pages}/{len(pages)} page(s), {len(pages) - text_pages} to OCR")
+    return pages
+
+
+def load_report_pages(file_data):
+    """
+    Split an upload (PDF or image bytes) into its pages.
+    """
+    if is_pdf(file_data):
+        if PYMUPDF_AVAILABLE:
+            return load_pdf_pages(file_data)
+        logger.warning("PyMuPDF is not installed, sending the whole PDF to OCR")
+        return [ReportPage(ocr_part={"mime_type": "application/pdf", "data": file_data})]
+
+    image = Image.open(io.BytesIO(file_data))
+    # Convert to RGB if needed
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return [ReportPage(ocr_part=image)]
+
+
+def get_ocr_prompt(ocr_part, image_prompt, pdf_prompt):
+    return pdf_prompt if isinstance(ocr_part, dict) else image_prompt
+
+
+def ocr_pages(pages, ocr_page, model_name, image_prompt, pdf_prompt, concurrency=None):
+    """
+    Fill in the text of the pages that need OCR: from the cache when the page was seen before, otherwise
+    with ocr_page(contents) called in parallel, at most concurrency at a time. Returns the pages.
+    Errors of ocr_page (e.g. GeminiGatewayError) are raised once the pages in flight have finished.
+    """
+    pending = {}
+    for page in pages:
+        if page.needs_ocr:
+            contents = [get_ocr_prompt(page.ocr_part, image_prompt, pdf_prompt), page.ocr_part]
+            pending.setdefault(get_request_key(model_name, contents), (contents, []))[1].append(page)
+    if not pending:
+        return pages
+
+    cached = page_ocr_cache.get_many(list(pending))
+    for key, text in cached.items():
+        for page in pending[key][1]:
+            page.text = text
+    missing = [key for key in pending if key not in cached]
+    logger.info(f"🔎 OCR of {len(pending)} page(s): {len(cached)} cached, {len(missing)} to send")
+
+    if missing:
+        executor = ThreadPoolExecutor(max_workers=concurrency or Config.LAB_REPORT_OCR_CONCURRENCY)
+        try:
+            futures = {key: executor.submit(ocr_page, pending[key][0]) for key in missing}
+            results = {key: future.result() for key, future in futures.items()}
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        for key, text in results.items():
+            for page in pending[key][1]:
+                page.text = text
+        page_ocr_cache.set_many({key: text for key, text in results.items() if text})
+
+    return pages
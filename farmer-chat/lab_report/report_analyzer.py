@@ -3,16 +3,30 @@ Lab Report Analyzer using Gemini Flash 2.0
 Extracts and analyzes lab reports with medical-grade accuracy
 """
 
-import google.generativeai as genai
 import json
 import logging
-from PIL import Image
-import io
-import os
-from django_core.config import ENV_CONFIG
+from common.gemini_gateway import GeminiGatewayError, gateway_error_result, gemini_gateway
+from django_core.config import Config
+from .page_extractor import load_report_pages, ocr_pages
 
 logger = logging.getLogger(__name__)
 
+# Extract text using Gemini Vision
+IMAGE_OCR_PROMPT = """Extract ALL text from this lab report image.  
+                
+Include:
+- Test names
+- Values
+- Units
+- Reference ranges
+- Dates
+- Patient information (if visible)
+
+Return the extracted text as-is, preserving structure."""
+
+# Note: Gemini 2.0 Flash supports PDF input, for whole PDFs when PyMuPDF is not installed
+PDF_OCR_PROMPT = "Extract all text from this lab report PDF, preserving structure."
+
 
 class LabReportAnalyzer:
     """
@@ -21,89 +35,70 @@ class LabReportAnalyzer:
     """
     
     def __init__(self):
-        """Initialize Gemini API"""
-        api_key = (
-            ENV_CONFIG.get('GOOGLE_API_KEY') or 
-            ENV_CONFIG.get('GEMINI_API_KEY') or 
-            os.getenv('GOOGLE_API_KEY') or 
-            os.getenv('GEMINI_API_KEY')
-        )
-        
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found in environment variables")
-        
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        """Use the shared Gemini gateway, which configures the model once and enforces the quota"""
+        self.model_name = Config.GEMINI_LAB_REPORT_MODEL
         logger.info("✅ Lab Report Analyzer initialized with ServVia AI")
     
     def extract_text_from_pdf(self, report_file):
         """
-        Extract text from PDF/image using Gemini Vision
+        Extract text from PDF/image, from the PDF text layer when there is one, using Gemini Vision otherwise
         
         Args:
             report_file: Django UploadedFile (PDF or image)
             
         Returns:
             str: Extracted text
+            
+        Raises:
+            GeminiGatewayError: when the Gemini request is rate limited or unavailable
         """
-        try:
-            # Read file
-            file_data = report_file.read()
+        return self.extract_texts([report_file])[0]
+    
+    def extract_texts(self, report_files):
+        """
+        Extract the text of several uploads, sending the pages that need OCR to Gemini in parallel
+        
+        Args:
+            report_files: Django UploadedFiles (PDFs or images)
+            
+        Returns:
+            list: Extracted text of each file, empty when it could not be read
             
-            # Try to open as image first
+        Raises:
+            GeminiGatewayError: when the Gemini request is rate limited or unavailable
+        """
+        file_pages = []
+        for report_file in report_files:
             try:
-                image = Image.open(io.BytesIO(file_data))
-                
-                # Convert to RGB if needed
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                
-                # Extract text using Gemini Vision
-                prompt = """Extract ALL text from this lab report image.  
-                
-Include:
-- Test names
-- Values
-- Units
-- Reference ranges
-- Dates
-- Patient information (if visible)
-
-Return the extracted text as-is, preserving structure."""
-                
-                response = self. model.generate_content([prompt, image])
-                extracted_text = response.text.strip()
-                
-                logger.info(f"✅ Extracted {len(extracted_text)} characters from image")
-                return extracted_text
-                
-            except Exception as img_error:
-                # If not an image, try as PDF
-                logger.warning(f"Not an image, treating as PDF: {img_error}")
-                
-                # For PDFs, Gemini can still read them if we save temporarily
-                import tempfile
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                    tmp.write(file_data)
-                    tmp_path = tmp.name
-                
-                # Note: Gemini 2.0 Flash supports PDF input
-                prompt = "Extract all text from this lab report PDF, preserving structure."
-                
-                # Upload file to Gemini
-                uploaded_file = genai.upload_file(tmp_path)
-                response = self.model.generate_content([prompt, uploaded_file])
-                
-                extracted_text = response.text.strip()
-                
-                # Cleanup
-                os.unlink(tmp_path)
-                
-                logger.info(f"✅ Extracted {len(extracted_text)} characters from PDF")
-                return extracted_text
-                
+                file_pages.append(load_report_pages(report_file.read()))
+            except Exception as e:
+                logger.error(f"❌ Text extraction failed: {e}", exc_info=True)
+                file_pages.append([])
+        
+        ocr_pages(
+            [page for pages in file_pages for page in pages],
+            self._ocr_page,
+            self.model_name,
+            IMAGE_OCR_PROMPT,
+            PDF_OCR_PROMPT,
+        )
+        
+        extracted_texts = []
+        for pages in file_pages:
+            extracted_text = "\n\n".join(page.text for page in pages if page.text)
+            logger.info(f"✅ Extracted {len(extracted_text)} characters from {len(pages)} page(s)")
+            extracted_texts.append(extracted_text)
+        return extracted_texts
+    
+    def _ocr_page(self, contents):
+        """Extract the text of one page image (or whole PDF) with Gemini Vision"""
+        try:
+            return gemini_gateway.generate_text(self.model_name, contents)
+        except GeminiGatewayError:
+            # quota and availability errors are reported, not mistaken for an unreadable page
+            raise
         except Exception as e:
-            logger.error(f"❌ Text extraction failed: {e}", exc_info=True)
+            logger.error(f"❌ Page OCR failed: {e}", exc_info=True)
             return ""
     
     def summarize_report(self, extracted_text, email_id):
@@ -213,8 +208,7 @@ Analyze the report now:"""
             
             logger.info("🔬 Analyzing lab report with Gemini...")
             
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
+            response_text = gemini_gateway.generate_text(self.model_name, prompt)
             
             # Parse JSON response
             analysis = self._parse_json_response(response_text)
@@ -238,6 +232,10 @@ Analyze the report now:"""
                     'error': 'Failed to parse analysis response'
                 }
                 
+        except GeminiGatewayError as e:
+            logger.warning(f"⚠️ Report analysis not served: {e}")
+            return gateway_error_result(e)
+            
         except Exception as e:
             logger.error(f"❌ Report analysis failed: {e}", exc_info=True)
             return {
@@ -0,0 +1,41 @@
+from celery import shared_task
+from common.analysis_jobs import TERMINAL_JOB_STATUSES, notify_webhook, retry_or_fail_job, start_job
+from django.core.files.storage import default_storage
+from django_core.config import Config
+from .analysis import build_saved_lab_report_response, run_lab_report_analysis
+from .models import LabReport
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(
+    bind=True,
+    acks_late=True,
+    rate_limit=Config.ANALYSIS_JOB_RATE_LIMIT,
+    max_retries=Config.ANALYSIS_JOB_MAX_RETRIES,
+)
+def analyze_lab_report_task(self, report_id):
+    """Analyse the pages of a submitted LabReport job"""
+    lab_report = LabReport.objects.filter(id=report_id).first()
+    if lab_report is None or lab_report.status in TERMINAL_JOB_STATUSES:
+        return
+
+    start_job(lab_report)
+    logger.info(f"📄 Analysing lab report job {lab_report.id} (attempt {self.request.retries + 1})")
+
+    report_files = [lab_report.report_file.open('rb')]
+    try:
+        report_files += [default_storage.open(name, 'rb') for name in lab_report.page_files]
+        analysis_result = run_lab_report_analysis(lab_report, report_files)
+    except Exception as e:
+        logger.error(f"❌ Lab report job error: {e}", exc_info=True)
+        analysis_result = {'success': False, 'error': str(e)}
+    finally:
+        for report_file in report_files:
+            report_file.close()
+
+    if not analysis_result.get('success'):
+        retry_or_fail_job(self, lab_report, analysis_result.get('error', 'Analysis failed'), analysis_result.get('retry_after'))
+
+    notify_webhook(lab_report, build_saved_lab_report_response)
@@ -1,3 +1,153 @@
-from django.test import TestCase
+import json
+import socket
+from types import SimpleNamespace
+from unittest.mock import patch
 
-# Create your tests here.
+import httpx
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase
+from django_core.config import Config
+from rest_framework.test import APIRequestFactory
+
+from common.analysis_jobs import clean_webhook_url, notify_webhook
+from common.gemini_gateway import GeminiGateway, GeminiOverloadedError, GeminiRateLimitError
+from lab_report.views import submit_lab_report_job
+
+
+def resolve_to(*addresses):
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [
+            (socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port or 443))
+            for address in addresses
+        ]
+
+    return patch("common.analysis_jobs.socket.getaddrinfo", side_effect=getaddrinfo)
+
+
+@patch.object(Config, "REDIS_URL", None)
+class GeminiGatewayAcquireTests(SimpleTestCase):
+    def build_gateway(self, **kwargs):
+        options = {"api_key": "test", "rpm": 60, "rpd": 1000, "max_queue_wait": 0, "max_waiting": 5, "process_count": 1}
+        return GeminiGateway(**{**options, **kwargs})
+
+    def test_requests_within_the_quota_are_admitted(self):
+        gateway = self.build_gateway(rpm=3)
+        for _ in range(3):
+            gateway.acquire()
+        self.assertEqual(gateway.waiting, 0)
+
+    def test_requests_beyond_the_rpm_are_shed_with_429(self):
+        gateway = self.build_gateway(rpm=2)
+        gateway.acquire()
+        gateway.acquire()
+        with self.assertRaises(GeminiRateLimitError) as context:
+            gateway.acquire()
+        self.assertEqual(context.exception.status_code, 429)
+        self.assertGreater(context.exception.retry_after, 0)
+        self.assertEqual(gateway.waiting, 0)
+
+    def test_requests_beyond_the_daily_quota_are_shed_and_refunded(self):
+        gateway = self.build_gateway(rpd=1)
+        gateway.acquire()
+        available = gateway.request_bucket.available()
+        with self.assertRaises(GeminiRateLimitError) as context:
+            gateway.acquire()
+        self.assertIn("daily", str(context.exception))
+        # the request bucket token taken for the shed request is given back
+        self.assertAlmostEqual(gateway.request_bucket.available(), available, places=0)
+
+    def test_requests_are_shed_with_503_when_too_many_are_waiting(self):
+        gateway = self.build_gateway(max_waiting=1)
+        gateway.waiting = 1
+        with self.assertRaises(GeminiOverloadedError) as context:
+            gateway.acquire()
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertEqual(gateway.waiting, 1)
+
+    def test_requests_are_shed_during_a_backoff_longer_than_the_queue_wait(self):
+        gateway = self.build_gateway(max_queue_wait=1)
+        gateway.backoff(30)
+        with self.assertRaises(GeminiRateLimitError):
+            gateway.acquire()
+
+    def test_quota_is_split_across_processes_without_redis(self):
+        gateway = self.build_gateway(rpm=15, process_count=5)
+        self.assertAlmostEqual(gateway.request_bucket.capacity, 3)
+
+
+@patch.object(Config, "ANALYSIS_JOB_WEBHOOK_ALLOWED_HOSTS", "")
+class WebhookUrlTests(SimpleTestCase):
+    def test_public_host_is_allowed(self):
+        with resolve_to("93.184.216.34"):
+            self.assertEqual(clean_webhook_url(" https://hooks.example.com/done "), "https://hooks.example.com/done")
+
+    def test_internal_hosts_are_rejected(self):
+        for address in (
+            "127.0.0.1",
+            "10.0.0.5",
+            "192.168.1.20",
+            "169.254.169.254",
+            "::1",
+            "::ffff:127.0.0.1",
+            "fe80::1",
+        ):
+            with self.subTest(address=address), resolve_to(address):
+                with self.assertRaises(ValidationError):
+                    clean_webhook_url("http://hooks.example.com/done")
+
+    def test_host_resolving_to_any_internal_address_is_rejected(self):
+        with resolve_to("93.184.216.34", "10.0.0.5"):
+            with self.assertRaises(ValidationError):
+                clean_webhook_url("https://hooks.example.com/done")
+
+    def test_unresolvable_host_is_rejected(self):
+        with patch("common.analysis_jobs.socket.getaddrinfo", side_effect=socket.gaierror("no such host")):
+            with self.assertRaises(ValidationError):
+                clean_webhook_url("https://missing.example.com/done")
+
+    def test_non_http_url_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            clean_webhook_url("file:///etc/passwd")
+
+    def test_allowed_hosts_restrict_the_webhook_hosts(self):
+        with patch.object(Config, "ANALYSIS_JOB_WEBHOOK_ALLOWED_HOSTS", "example.com"), resolve_to("93.184.216.34"):
+            self.assertEqual(clean_webhook_url("https://hooks.example.com/done"), "https://hooks.example.com/done")
+            for webhook_url in ("https://notexample.com/done", "https://example.com.evil.org/done"):
+                with self.subTest(webhook_url=webhook_url), self.assertRaises(ValidationError):
+                    clean_webhook_url(webhook_url)
+
+    def test_webhook_is_posted_to_the_validated_address(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200)
+
+        job = SimpleNamespace(id=1, webhook_url="https://hooks.example.com/done", status="completed")
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        with resolve_to("93.184.216.34"), patch("common.analysis_jobs.get_webhook_client", return_value=client):
+            notify_webhook(job, lambda job: {"summary": "ok"})
+
+        (request,) = requests
+        self.assertEqual(str(request.url), "https://93.184.216.34/done")
+        self.assertEqual(request.headers["host"], "hooks.example.com")
+        self.assertEqual(request.extensions["sni_hostname"], "hooks.example.com")
+        self.assertEqual(json.loads(request.content)["result"], {"summary": "ok"})
+
+    def test_webhook_is_not_posted_to_a_host_now_resolving_internally(self):
+        job = SimpleNamespace(id=1, webhook_url="https://hooks.example.com/done", status="completed")
+        with resolve_to("127.0.0.1"), patch("common.analysis_jobs.get_webhook_client") as get_webhook_client:
+            notify_webhook(job, lambda job: {})
+        get_webhook_client.assert_not_called()
+
+
+class SubmitLabReportJobTests(SimpleTestCase):
+    @patch.object(Config, "CELERY_BROKER_URL", None)
+    @patch("lab_report.views.analyze_lab_report_task")
+    def test_jobs_are_unavailable_without_a_broker(self, analyze_lab_report_task):
+        request = APIRequestFactory().post("/api/lab-report/analyze/async/", {"email_id": "asha@example.com"})
+        response = submit_lab_report_job(request)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data["error_type"], "jobs_unavailable")
+        analyze_lab_report_task.delay.assert_not_called()
@@ -3,5 +3,8 @@ from .  import views
 
 urlpatterns = [
     path('analyze/', views. analyze_lab_report, name='analyze_lab_report'),
+    path('analyze/async/', views.submit_lab_report_job, name='submit_lab_report_job'),
+    path('jobs/<int:job_id>/', views.get_lab_report_job, name='lab_report_job'),
+    path('jobs/<int:job_id>/events/', views.stream_lab_report_job, name='lab_report_job_events'),
     path('history/', views.get_lab_report_history, name='lab_report_history'),
 ]
\ No newline at end of file
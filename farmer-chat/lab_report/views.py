@@ -1,102 +1,125 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from rest_framework. decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from . models import LabReport
-from . report_analyzer import LabReportAnalyzer
+from .analysis import build_lab_report_response, build_saved_lab_report_response, run_lab_report_analysis
+from .tasks import analyze_lab_report_task
+from common.gemini_gateway import get_retry_after_headers
+from common.analysis_jobs import (
+    JOB_COMPLETED,
+    JOB_PENDING,
+    build_job_response,
+    clean_webhook_url,
+    find_active_job,
+    is_job_queue_configured,
+    stream_job_events,
+)
+from common.upload_cache import compute_content_hash, compute_file_hashes, find_cached_analysis, is_same_upload
 import logging
 
 logger = logging.getLogger(__name__)
-analyzer = LabReportAnalyzer()
+
+
+def read_lab_report_upload(request):
+    """
+    Check and hash the uploaded report pages.
+    Returns (upload, None), or (None, error Response) when the upload is rejected.
+    """
+    email = request.data.get('email_id')
+    if not email:
+        return None, Response({'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Support both single and multiple file uploads
+    report_files = request.FILES.getlist('report')  # Changed to getlist for multiple files
+    
+    if not report_files:
+        # Fallback to single file
+        single_file = request.FILES.get('report')
+        if single_file:
+            report_files = [single_file]
+        else:
+            return None, Response({
+                'error': 'At least one report file is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+    
+    logger.info(f"📄 Analyzing {len(report_files)} lab report page(s) for {email}")
+    
+    file_contents = []
+    for report_file in report_files:
+        file_contents.append(report_file.read())
+        report_file.seek(0)
+    return {
+        'email': email,
+        'report_files': report_files,
+        'content_hash': compute_content_hash(*file_contents),
+        'page_hashes': [compute_file_hashes(file_data) for file_data in file_contents],
+    }, None
+
+
+def find_cached_lab_report(upload):
+    """A re-upload of the same pages by the user reuses their analysis instead of calling the model again"""
+    page_hashes = upload['page_hashes']
+    return find_cached_analysis(
+        LabReport,
+        upload['email'],
+        upload['content_hash'],
+        lambda report: len(report.page_hashes) == len(page_hashes)
+        and all(is_same_upload(page, other_page) for page, other_page in zip(page_hashes, report.page_hashes)),
+    )
+
+
+def build_lab_report(upload, **fields):
+    return LabReport(
+        email_id=upload['email'],
+        report_file=upload['report_files'][0],  # Save first page as main file
+        content_hash=upload['content_hash'],
+        page_hashes=upload['page_hashes'],
+        **fields
+    )
+
+
+def build_lab_report_job_response(lab_report):
+    response = build_job_response(lab_report, build_saved_lab_report_response)
+    response['status_url'] = reverse('lab_report_job', args=[lab_report.id])
+    response['events_url'] = reverse('lab_report_job_events', args=[lab_report.id])
+    return response
+
 
 @api_view(['POST'])
 def analyze_lab_report(request):
     """Endpoint to upload and analyze lab reports (supports multiple images)"""
     try:
-        email = request.data.get('email_id')
-        if not email:
-            return Response({'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Support both single and multiple file uploads
-        report_files = request.FILES.getlist('report')  # Changed to getlist for multiple files
+        upload, error_response = read_lab_report_upload(request)
+        if error_response:
+            return error_response
         
-        if not report_files:
-            # Fallback to single file
-            single_file = request.FILES.get('report')
-            if single_file:
-                report_files = [single_file]
-            else:
-                return Response({
-                    'error': 'At least one report file is required'
-                }, status=status.HTTP_400_BAD_REQUEST)
+        cached_report = find_cached_lab_report(upload)
+        if cached_report:
+            return Response(build_lab_report_response(cached_report, cached_report.result, is_cached=True))
         
-        logger.info(f"📄 Analyzing {len(report_files)} lab report page(s) for {email}")
-        
-        # Extract text from all pages
-        all_extracted_text = ""
-        
-        for idx, report_file in enumerate(report_files, 1):
-            logger.info(f"📄 Processing page {idx}/{len(report_files)}")
-            
-            extracted_text = analyzer.extract_text_from_pdf(report_file)
-            
-            if extracted_text:
-                all_extracted_text += f"\n\n=== PAGE {idx} ===\n\n{extracted_text}"
-            else:
-                logger.warning(f"⚠️ No text extracted from page {idx}")
-        
-        if not all_extracted_text. strip():
-            return Response({
-                'error': 'Could not extract text from any report page.  Please ensure images are clear.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        logger.info(f"✅ Extracted total {len(all_extracted_text)} characters from {len(report_files)} page(s)")
-        
-        # Analyze combined text
-        analysis_result = analyzer.summarize_report(all_extracted_text, email)
+        # Save to database once the analysis succeeds
+        lab_report = build_lab_report(upload)
+        analysis_result = run_lab_report_analysis(lab_report, upload['report_files'])
         
         if not analysis_result. get('success'):
+            response_status = (
+                status.HTTP_400_BAD_REQUEST
+                if analysis_result.get('error_type') == 'no_text'
+                else analysis_result.get('status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
+            )
             return Response({
-                'error': analysis_result.get('error', 'Analysis failed')
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                'error': analysis_result.get('error', 'Analysis failed'),
+                'error_type': analysis_result.get('error_type', 'analysis_failed')
+            }, status=response_status, headers=get_retry_after_headers(analysis_result))
         
-        # Save to database (save first file as primary)
-        lab_report = LabReport.objects.create(
-            email_id=email,
-            report_file=report_files[0],  # Save first page as main file
-            extracted_text=all_extracted_text,
-            summary=analysis_result.get('summary', ''),
-            analysis=analysis_result.get('analysis', {}),
-            abnormal_values=analysis_result.get('abnormal_values', [])
-        )
+        response_data = build_lab_report_response(lab_report, analysis_result, pages_processed=len(upload['report_files']))
         
-        logger.info(f"✅ Lab report saved: ID {lab_report.id} ({len(report_files)} pages)")
-        
-        # Get formatted summary
-        formatted_summary = analysis_result.get('summary', '')
-        
-        if not formatted_summary or formatted_summary == 'undefined':
-            formatted_summary = analysis_result.get('analysis', {}).get('summary', 'No summary available')
-        
-        # Prepare response
-        response_data = {
-            'success': True,
-            'report_id': lab_report.id,
-            'pages_processed': len(report_files),
-            'test_type': analysis_result.get('analysis', {}).get('test_type', 'Lab Report'),
-            'report_date': analysis_result.get('analysis', {}).get('report_date', ''),
-            'summary': formatted_summary,
-            'formatted_summary': formatted_summary,
-            'abnormal_count': analysis_result.get('analysis', {}).get('abnormal_count', 0),
-            'normal_count': analysis_result.get('visual_indicators', {}).get('normal_count', 0),
-            'critical_count': analysis_result.get('visual_indicators', {}).get('critical_count', 0),
-            'parameters': analysis_result.get('abnormal_values', []),
-            'recommendations': analysis_result.get('recommendations', []),
-            'critical_flags': analysis_result.get('critical_flags', []),
-            'overall_status': analysis_result.get('analysis', {}).get('overall_status', ''),
-            'follow_up_needed': analysis_result.get('analysis', {}).get('follow_up_needed', False)
-        }
-        
-        logger.info(f"📤 Returning response with summary length: {len(formatted_summary)}")
+        logger.info(f"📤 Returning response with summary length: {len(response_data['summary'])}")
         
         return Response(response_data)
         
@@ -105,6 +128,101 @@ def analyze_lab_report(request):
         return Response({'error': str(e)}, status=status. HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+def submit_lab_report_job(request):
+    """
+    Endpoint to upload lab report pages for background analysis.
+    Returns a job to poll (jobs/<id>/) or follow as server-sent events (jobs/<id>/events/);
+    with webhook_url, the final job status is also posted there.
+    Answers 503 when no job broker is configured.
+    """
+    if not is_job_queue_configured():
+        return Response({
+            'error': 'Background analysis is not available, use analyze/ instead',
+            'error_type': 'jobs_unavailable'
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    try:
+        try:
+            webhook_url = clean_webhook_url(request.data.get('webhook_url'))
+        except ValidationError:
+            return Response({'error': 'Invalid webhook URL'}, status=status.HTTP_400_BAD_REQUEST)
+
+        upload, error_response = read_lab_report_upload(request)
+        if error_response:
+            return error_response
+
+        cached_report = find_cached_lab_report(upload)
+        if cached_report:
+            response = build_lab_report_job_response(cached_report)
+            response['result']['is_cached'] = True
+            return Response(response)
+
+        lab_report = find_active_job(LabReport, upload['email'], upload['content_hash'])
+        if lab_report:
+            logger.info(f"♻️ Following lab report job {lab_report.id} for {upload['email']}")
+            return Response(build_lab_report_job_response(lab_report), status=status.HTTP_202_ACCEPTED)
+
+        # the pages after the first are stored for the worker alongside the main file
+        page_files = [
+            default_storage.save(f"lab_reports/{report_file.name}", report_file)
+            for report_file in upload['report_files'][1:]
+        ]
+        lab_report = build_lab_report(upload, page_files=page_files, status=JOB_PENDING, webhook_url=webhook_url)
+        lab_report.save()
+        analyze_lab_report_task.delay(lab_report.id)
+        logger.info(f"📥 Lab report job {lab_report.id} submitted for {upload['email']} ({len(upload['report_files'])} pages)")
+
+        lab_report.refresh_from_db()
+        return Response(build_lab_report_job_response(lab_report), status=status.HTTP_202_ACCEPTED)
+
+    except Exception as e:
+        logger.error(f"❌ Lab report job submission error: {e}", exc_info=True)
+        return Response({'error': str(e)}, status=status. HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def get_user_lab_report(job_id, email):
+    return LabReport.objects.filter(id=job_id, email_id=email).first()
+
+
+@api_view(['GET'])
+def get_lab_report_job(request, job_id):
+    """Get the status, and once completed the result, of a lab report job"""
+    email = request.query_params.get('email_id')
+    if not email:
+        return Response({'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    lab_report = get_user_lab_report(job_id, email)
+    if lab_report is None:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(build_lab_report_job_response(lab_report))
+
+
+async def stream_lab_report_job(request, job_id):
+    """
+    Follow a lab report job as server-sent events.
+    Events: status (on every change), then result and done, error and done, or timeout.
+    """
+    email = request.GET.get('email_id')
+    if not email:
+        return JsonResponse({'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    lab_report = await sync_to_async(get_user_lab_report, thread_sensitive=False)(job_id, email)
+    if lab_report is None:
+        return JsonResponse({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    def load_job_response():
+        lab_report.refresh_from_db()
+        return build_lab_report_job_response(lab_report)
+
+    response = StreamingHttpResponse(stream_job_events(load_job_response), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 @api_view(['GET'])
 def get_lab_report_history(request):
     """Get user's lab report history"""
@@ -113,7 +231,7 @@ def get_lab_report_history(request):
         if not email:
             return Response({'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        reports = LabReport.objects.filter(email_id=email). order_by('-created_at')[:10]
+        reports = LabReport.objects.filter(email_id=email, status=JOB_COMPLETED). order_by('-created_at')[:10]
         
         results = []
         for r in reports:
@@ -1,29 +1,88 @@
-import asyncio, logging
+import asyncio, functools, logging
+from google.api_core.exceptions import InvalidArgument
 from google.cloud import speech_v1p1beta1 as speech
-from google.cloud import translate_v2 as translate
-from google.oauth2 import service_account
 
+from common.tracing import traced
 from django_core.config import Config
+from language_service.chunked_asr import (
+    PYDUB_AVAILABLE,
+    SAMPLE_RATE_HERTZ,
+    a_transcribe_audio_chunks,
+    load_linear16_audio,
+)
+from language_service.clients import get_speech_client, get_translate_client
 
 logger = logging.getLogger(__name__)
 
-credentials = service_account.Credentials.from_service_account_file(Config.GOOGLE_APPLICATION_CREDENTIALS)
+
+def iter_audio_chunks(audio_content, chunk_size):
+    """
+    Yield the audio as zero-copy slices of at most chunk_size bytes.
+    """
+    audio_view = memoryview(audio_content)
+    for offset in range(0, len(audio_view), chunk_size):
+        yield audio_view[offset : offset + chunk_size]
+
+
+def recognize(speech_client, config, audio_content, speech_types=speech):
+    """
+    One-shot recognition of the whole audio, limited by the API to about one minute.
+    Returns the (transcript, confidence) pairs of the results.
+    speech_types is the google.cloud speech module (API version) the client and config belong to.
+    """
+    audio = speech_types.RecognitionAudio(content=bytes(audio_content))
+    response = speech_client.recognize(config=config, audio=audio)
+    return [
+        (result.alternatives[0].transcript, result.alternatives[0].confidence)
+        for result in response.results
+        if result.alternatives
+    ]
 
 
+def streaming_recognize(speech_client, config, audio_content, speech_types=speech):
+    """
+    Recognition of long audio, sent to the API in chunks as a stream; only the final results are kept.
+    """
+    streaming_config = speech_types.StreamingRecognitionConfig(config=config, interim_results=False)
+    requests = (
+        speech_types.StreamingRecognizeRequest(audio_content=bytes(chunk))
+        for chunk in iter_audio_chunks(audio_content, Config.ASR_STREAMING_CHUNK_BYTES)
+    )
+    responses = speech_client.streaming_recognize(config=streaming_config, requests=requests)
+    return [
+        (result.alternatives[0].transcript, result.alternatives[0].confidence)
+        for response in responses
+        for result in response.results
+        if result.is_final and result.alternatives
+    ]
+
+
+async def transcribe_long_audio(speech_client, config, audio_content):
+    """
+    Recognise audio longer than the one-shot limit: split on silence and recognised concurrently when pydub
+    can decode it, otherwise streamed as a whole.
+    """
+    if not PYDUB_AVAILABLE:
+        return await asyncio.to_thread(streaming_recognize, speech_client, config, audio_content)
+
+    audio = await asyncio.to_thread(load_linear16_audio, audio_content)
+    chunk_config = speech.RecognitionConfig(config)
+    chunk_config.encoding = speech.RecognitionConfig.AudioEncoding.LINEAR16
+    chunk_config.sample_rate_hertz = SAMPLE_RATE_HERTZ
+    return await a_transcribe_audio_chunks(functools.partial(recognize, speech_client, chunk_config), audio)
+
+
+@traced("asr")
 async def transcribe_and_translate(
-    file_name, language_code, encoding_format=speech.RecognitionConfig.AudioEncoding.MP3, sample_rate_hertz=16000
+    audio_content, language_code, encoding_format=speech.RecognitionConfig.AudioEncoding.MP3, sample_rate_hertz=16000
 ):
     """
     Generate transcriptions (text) and confidence score for a given audio or voice file
     in a specified language using an ASR model.
+    The audio is given as bytes (or a memoryview); long audio is recognised in chunks.
     """
-    speech_client = speech.SpeechClient(credentials=credentials)
-    translate_client = translate.Client(credentials=credentials)
-
-    audio = None
-    with open(file_name, "rb") as audio_data:
-        audio_content = audio_data.read()
-        audio = speech.RecognitionAudio(content=audio_content)
+    speech_client = get_speech_client()
+    translate_client = get_translate_client()
 
     config = speech.RecognitionConfig(
         encoding=encoding_format,
@@ -36,13 +95,18 @@ async def transcribe_and_translate(
 
     # print(f"Trying to transcribe in the language: {language_code}")
     logger.info(f"Trying to transcribe in the language: {language_code}")
-    response = await asyncio.to_thread(speech_client.recognize, config=config, audio=audio)
-
-    # Retrieve the transcriptions
-    transcriptions = [result.alternatives[0].transcript for result in response.results]
+    if len(audio_content) > Config.ASR_LONG_AUDIO_MIN_BYTES:
+        results = await transcribe_long_audio(speech_client, config, audio_content)
+    else:
+        try:
+            results = await asyncio.to_thread(recognize, speech_client, config, audio_content)
+        except InvalidArgument as error:
+            # audio longer than the one-shot limit is rejected, recognise it in chunks instead
+            logger.info(f"One-shot recognition rejected the audio ({error}), retrying as long audio")
+            results = await transcribe_long_audio(speech_client, config, audio_content)
 
     # Send the transcriptions as a reply
-    transcriptions = "\n".join(transcriptions)
+    transcriptions = "\n".join(transcript for transcript, _ in results)
 
     detection_response = await asyncio.to_thread(translate_client.detect_language, transcriptions)
     confidence = detection_response["confidence"]
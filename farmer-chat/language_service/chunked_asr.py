@@ -0,0 +1,125 @@
+"""
+Chunked speech recognition of long voice notes
+
+The audio is decoded once to 16 kHz mono LINEAR16, split on silence into chunks shorter than the one-shot
+recognition limit, and the chunks are recognised concurrently. Each chunk transcript is post-processed
+(Kannada corrections) as soon as it is recognised, and the transcripts are stitched back in order.
+"""
+import asyncio
+import io
+import logging
+
+from django_core.config import Config
+from language_service.kannada_corrector import enhance_kannada_transcription
+
+try:
+    from pydub import AudioSegment
+    from pydub.silence import detect_nonsilent
+
+    PYDUB_AVAILABLE = True
+except ImportError:
+    PYDUB_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE_HERTZ = 16000
+# the window, in ms, silence is measured over
+SILENCE_SEEK_STEP_MS = 10
+
+
+def load_linear16_audio(audio_data):
+    """
+    Decode audio bytes in memory to a 16 kHz mono 16-bit AudioSegment.
+    """
+    audio = AudioSegment.from_file(io.BytesIO(audio_data))
+    return audio.set_frame_rate(SAMPLE_RATE_HERTZ).set_channels(1).set_sample_width(2)
+
+
+def split_on_silence_ranges(
+    audio,
+    max_chunk_ms=None,
+    min_silence_ms=None,
+    silence_offset_db=None,
+    keep_silence_ms=200,
+):
+    """
+    Return the (start_ms, end_ms) ranges of the chunks of the audio: speech between silences is packed into
+    chunks of at most max_chunk_ms, and speech longer than that is cut at max_chunk_ms.
+    """
+    max_chunk_ms = max_chunk_ms or int(Config.ASR_CHUNK_MAX_SECONDS * 1000)
+    min_silence_ms = min_silence_ms or Config.ASR_CHUNK_MIN_SILENCE_MS
+    silence_offset_db = Config.ASR_CHUNK_SILENCE_OFFSET_DB if silence_offset_db is None else silence_offset_db
+
+    if len(audio) <= max_chunk_ms:
+        return [(0, len(audio))]
+
+    speech_ranges = detect_nonsilent(
+        audio,
+        min_silence_len=min_silence_ms,
+        silence_thresh=audio.dBFS - silence_offset_db,
+        seek_step=SILENCE_SEEK_STEP_MS,
+    )
+    if not speech_ranges:
+        speech_ranges = [[0, len(audio)]]
+
+    chunks = []
+    for start, end in speech_ranges:
+        start, end = max(start - keep_silence_ms, chunks[-1][1] if chunks else 0), min(end + keep_silence_ms, len(audio))
+        if chunks and end - chunks[-1][0] <= max_chunk_ms:
+            # pack the speech with the previous chunk while it fits
+            chunks[-1][1] = end
+            continue
+        while end - start > max_chunk_ms:
+            chunks.append([start, start + max_chunk_ms])
+            start += max_chunk_ms
+        chunks.append([start, end])
+    return [tuple(chunk) for chunk in chunks]
+
+
+def correct_transcript(transcript, confidence, language=None):
+    """
+    Apply the language-specific corrections to a chunk transcript.
+    """
+    if language != "kn" or not transcript:
+        return transcript, confidence
+
+    enhanced = enhance_kannada_transcription(transcript, language)
+    if enhanced["corrected"]:
+        logger.info(f"✅ Kannada correction applied: '{enhanced['text']}' (from '{transcript}')")
+        return enhanced["text"], max(confidence, enhanced["confidence"])
+    return transcript, confidence
+
+
+async def a_transcribe_audio_chunks(recognize_chunk, audio, language=None, concurrency=None):
+    """
+    Recognise the chunks of a LINEAR16 AudioSegment concurrently, returning the corrected
+    (transcript, confidence) pairs in the order of the audio.
+    recognize_chunk(audio_content) recognises the PCM bytes of one chunk (see language_service.asr.recognize).
+    """
+    chunk_ranges = split_on_silence_ranges(audio)
+    semaphore = asyncio.Semaphore(concurrency or Config.ASR_CHUNK_CONCURRENCY)
+    raw_audio = memoryview(audio.raw_data)
+    bytes_per_ms = SAMPLE_RATE_HERTZ * 2 // 1000
+    logger.info(f"Recognising {len(audio) / 1000:.1f}s of audio in {len(chunk_ranges)} chunks")
+
+    async def transcribe_chunk(start_ms, end_ms):
+        async with semaphore:
+            results = await asyncio.to_thread(
+                recognize_chunk, raw_audio[start_ms * bytes_per_ms : end_ms * bytes_per_ms]
+            )
+        # corrected as soon as the chunk is recognised, while the other chunks are still in flight
+        return [correct_transcript(transcript.strip(), confidence, language) for transcript, confidence in results]
+
+    chunk_results = await asyncio.gather(*(transcribe_chunk(start_ms, end_ms) for start_ms, end_ms in chunk_ranges))
+    return [result for results in chunk_results for result in results if result[0]]
+
+
+def stitch_transcripts(results):
+    """
+    Join the chunk transcripts, returning the text and the mean confidence.
+    """
+    if not results:
+        return "", 0.0
+    transcription = " ".join(transcript for transcript, _ in results)
+    confidence = sum(confidence for _, confidence in results) / len(results)
+    return transcription, confidence
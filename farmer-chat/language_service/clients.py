@@ -0,0 +1,156 @@
+"""
+Process-wide registry of Google Cloud Translate, Text-to-Speech and Speech clients
+
+Clients are created lazily on first use and reused across requests. The gRPC clients (TTS, Speech)
+are kept in small round-robin pools so that concurrent calls are spread over several channels.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import threading
+
+from django_core.config import Config
+from google.oauth2 import service_account
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_credentials = None
+_credentials_loaded = False
+_translate_client = None
+_tts_pool = None
+_speech_pools = {}
+
+
+def get_credentials_path():
+    """
+    Return the first configured service account file that exists.
+    """
+    try:
+        from django.conf import settings
+
+        settings_path = getattr(settings, "GCP_TRANSLATION_CREDENTIALS_PATH", None)
+    except Exception:
+        settings_path = None
+
+    for path in (settings_path, Config.GCP_TRANSLATION_CREDENTIALS_PATH, Config.GOOGLE_APPLICATION_CREDENTIALS):
+        if path and os.path.exists(path):
+            return path
+    return None
+
+
+def get_credentials():
+    """
+    Load the Google service account credentials once per process, returning None if unavailable.
+    """
+    global _credentials, _credentials_loaded
+    if not _credentials_loaded:
+        with _lock:
+            if not _credentials_loaded:
+                credentials_path = get_credentials_path()
+                try:
+                    if credentials_path:
+                        _credentials = service_account.Credentials.from_service_account_file(credentials_path)
+                        logger.info(f"✅ GCP credentials loaded: {credentials_path}")
+                    else:
+                        logger.error("❌ GCP credentials file not found")
+                except Exception as error:
+                    logger.error(f"❌ Could not load GCP credentials: {error}", exc_info=True)
+                _credentials_loaded = True
+    return _credentials
+
+
+class ClientPool:
+    """
+    Fixed-size pool of thread-safe gRPC clients handed out round-robin.
+    """
+
+    def __init__(self, client_factory, size):
+        self.clients = [client_factory() for _ in range(max(1, size))]
+        self._cycle = itertools.cycle(self.clients)
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            return next(self._cycle)
+
+
+def get_translate_client():
+    """
+    Return the shared Google Translate (v2) client.
+    """
+    global _translate_client
+    if _translate_client is None:
+        credentials = get_credentials()
+        with _lock:
+            if _translate_client is None:
+                from google.cloud import translate_v2 as translate
+
+                _translate_client = translate.Client(credentials=credentials)
+    return _translate_client
+
+
+def get_tts_client():
+    """
+    Return a Text-to-Speech client from the shared pool.
+    """
+    global _tts_pool
+    if _tts_pool is None:
+        credentials = get_credentials()
+        with _lock:
+            if _tts_pool is None:
+                from google.cloud import texttospeech
+
+                _tts_pool = ClientPool(
+                    lambda: texttospeech.TextToSpeechClient(credentials=credentials), Config.GCP_GRPC_POOL_SIZE
+                )
+    return _tts_pool.get()
+
+
+def get_speech_client(api_version="v1p1beta1"):
+    """
+    Return a Speech-to-Text client of the given API version from the shared pool.
+    """
+    speech_pool = _speech_pools.get(api_version)
+    if speech_pool is None:
+        credentials = get_credentials()
+        with _lock:
+            speech_pool = _speech_pools.get(api_version)
+            if speech_pool is None:
+                if api_version == "v1":
+                    from google.cloud import speech_v1 as speech
+                else:
+                    from google.cloud import speech_v1p1beta1 as speech
+
+                speech_pool = ClientPool(
+                    lambda: speech.SpeechClient(credentials=credentials), Config.GCP_GRPC_POOL_SIZE
+                )
+                _speech_pools[api_version] = speech_pool
+    return speech_pool.get()
+
+
+async def a_translate_batch(texts, target_language, source_language=None):
+    """
+    Translate a list of texts to the target language in a single Translate API call.
+    Empty texts are passed through untouched.
+    """
+    texts = list(texts)
+    indexes = [index for index, text in enumerate(texts) if text and str(text).strip()]
+    if not indexes:
+        return texts
+
+    target_language = target_language.split("-")[0] if "-" in target_language else target_language
+    results = await asyncio.to_thread(
+        get_translate_client().translate,
+        [texts[index] for index in indexes],
+        target_language=target_language,
+        source_language=source_language,
+        format_="text",
+        model="nmt",
+    )
+
+    translated_texts = list(texts)
+    for index, result in zip(indexes, results):
+        translated_texts[index] = result["translatedText"]
+    return translated_texts
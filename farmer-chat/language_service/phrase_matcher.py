@@ -0,0 +1,221 @@
+"""
+Precompiled matchers for the medical phrase dictionaries
+
+The dictionaries are loaded once per process from a JSON file (MEDICAL_PHRASE_DICTIONARY_PATH) keyed by
+language code, each with "translations" (phrase -> English) and "corrections" (phrase -> known STT variants).
+Exact phrases are found with an Aho-Corasick automaton in one pass over the text, and fuzzy variants are
+looked up through a trigram index, so the cost of a lookup does not grow with the size of the dictionary.
+"""
+import json
+import logging
+import threading
+from collections import Counter, deque
+from difflib import SequenceMatcher
+
+from django_core.config import Config
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_dictionaries = None
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a set of phrases, reporting every occurrence in a single pass over the text.
+    """
+
+    def __init__(self, phrases):
+        self.transitions = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for phrase in phrases:
+            self._add(phrase)
+        self._build_fail_links()
+
+    def _add(self, phrase):
+        node = 0
+        for char in phrase:
+            next_node = self.transitions[node].get(char)
+            if next_node is None:
+                next_node = len(self.transitions)
+                self.transitions[node][char] = next_node
+                self.transitions.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            node = next_node
+        self.outputs[node].append(phrase)
+
+    def _build_fail_links(self):
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self.transitions[node].items():
+                queue.append(next_node)
+                fail_node = self.fail[node]
+                while fail_node and char not in self.transitions[fail_node]:
+                    fail_node = self.fail[fail_node]
+                self.fail[next_node] = self.transitions[fail_node].get(char, 0)
+                self.outputs[next_node] = self.outputs[next_node] + self.outputs[self.fail[next_node]]
+
+    def iter_matches(self, text):
+        """
+        Yield (start, end, phrase) for every occurrence of a phrase in the text.
+        """
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self.transitions[node]:
+                node = self.fail[node]
+            node = self.transitions[node].get(char, 0)
+            for phrase in self.outputs[node]:
+                yield index + 1 - len(phrase), index + 1, phrase
+
+
+def is_word_boundary(text, index):
+    return index <= 0 or index >= len(text) or not (text[index - 1].isalnum() and text[index].isalnum())
+
+
+def get_trigrams(text):
+    padded = f"  {text} "
+    return {padded[index : index + 3] for index in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted index of strings by character trigram, returning the strings most similar to a query as candidates.
+    """
+
+    def __init__(self, strings):
+        self.strings = list(strings)
+        self.trigram_counts = [len(get_trigrams(string)) for string in self.strings]
+        self.postings = {}
+        for string_id, string in enumerate(self.strings):
+            for trigram in get_trigrams(string):
+                self.postings.setdefault(trigram, []).append(string_id)
+
+    def candidates(self, text, limit=20):
+        """
+        Return up to limit strings sharing trigrams with the text, by decreasing Dice coefficient.
+        """
+        text_trigrams = get_trigrams(text)
+        shared = Counter()
+        for trigram in text_trigrams:
+            shared.update(self.postings.get(trigram, ()))
+        scored = [
+            (2 * count / (len(text_trigrams) + self.trigram_counts[string_id]), string_id)
+            for string_id, count in shared.items()
+        ]
+        scored.sort(reverse=True)
+        return [self.strings[string_id] for _, string_id in scored[:limit]]
+
+
+class PhraseDictionary:
+    """
+    Compiled translations and STT corrections of the medical phrases of one language.
+    """
+
+    def __init__(self, translations=None, corrections=None):
+        self.translations = {phrase.lower().strip(): english for phrase, english in (translations or {}).items()}
+        self.translation_matcher = AhoCorasick(self.translations)
+
+        self.correct_phrases = {phrase.lower().strip() for phrase in (corrections or {})}
+        self.variant_phrases = {}
+        for phrase, variants in (corrections or {}).items():
+            for variant in variants:
+                # the first phrase listing a variant wins, as with the former dictionary scan
+                self.variant_phrases.setdefault(variant.lower().strip(), phrase.lower().strip())
+        self.variant_index = TrigramIndex(self.variant_phrases)
+
+    def find_phrases(self, text):
+        """
+        Return the (start, end, phrase) matches of whole words or phrases in the text, leftmost-longest
+        and without overlaps.
+        """
+        matches = sorted(
+            (
+                (start, -end, phrase)
+                for start, end, phrase in self.translation_matcher.iter_matches(text)
+                if is_word_boundary(text, start) and is_word_boundary(text, end)
+            ),
+        )
+        selected, covered_until = [], 0
+        for start, negative_end, phrase in matches:
+            if start >= covered_until:
+                selected.append((start, -negative_end, phrase))
+                covered_until = -negative_end
+        return selected
+
+    def translate(self, text):
+        """
+        Translate the text when it is a known phrase, or replace the known phrases it contains.
+        Returns None when the text contains no known phrase.
+        """
+        text_lower = text.lower().strip()
+        if text_lower in self.translations:
+            return self.translations[text_lower]
+
+        matches = self.find_phrases(text_lower)
+        if not matches:
+            return None
+
+        translated_parts, position = [], 0
+        for start, end, phrase in matches:
+            translated_parts.append(text_lower[position:start])
+            translated_parts.append(self.translations[phrase])
+            position = end
+        translated_parts.append(text_lower[position:])
+        return "".join(translated_parts)
+
+    def correct(self, text, threshold=0.6, candidates=20):
+        """
+        Correct a transcript close to a known STT variant of a phrase.
+        Returns (corrected_text, similarity, was_corrected).
+        """
+        text_lower = text.lower().strip()
+        if text_lower in self.correct_phrases:
+            return text_lower, 1.0, False
+
+        best_match, best_similarity = None, 0.0
+        for variant in self.variant_index.candidates(text_lower, limit=candidates):
+            similarity = SequenceMatcher(None, text_lower, variant).ratio()
+            if similarity > best_similarity:
+                best_similarity, best_match = similarity, self.variant_phrases[variant]
+
+        if best_similarity > threshold:
+            return best_match, best_similarity, True
+        return text, 0.0, False
+
+
+def load_phrase_dictionaries(path=None):
+    """
+    Compile the phrase dictionaries of every language in the JSON dictionary file.
+    """
+    path = path or Config.MEDICAL_PHRASE_DICTIONARY_PATH
+    try:
+        with open(path, encoding="utf-8") as dictionary_file:
+            data = json.load(dictionary_file)
+    except (OSError, ValueError) as error:
+        logger.error(f"Could not load the medical phrase dictionary {path}: {error}")
+        return {}
+
+    dictionaries = {
+        language: PhraseDictionary(entry.get("translations"), entry.get("corrections"))
+        for language, entry in data.items()
+    }
+    logger.info(f"Loaded medical phrase dictionaries for {', '.join(dictionaries) or 'no languages'}")
+    return dictionaries
+
+
+def get_phrase_dictionary(language):
+    """
+    Return the compiled phrase dictionary of the language (empty when there is none), loading the file once.
+    """
+    global _dictionaries
+    if _dictionaries is None:
+        with _lock:
+            if _dictionaries is None:
+                _dictionaries = load_phrase_dictionaries()
+    return _dictionaries.get(language) or _empty_dictionary
+
+
+_empty_dictionary = PhraseDictionary()
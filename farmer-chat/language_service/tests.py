@@ -0,0 +1,126 @@
+import json
+from difflib import SequenceMatcher
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+from django_core.config import Config
+
+from language_service.chunked_asr import PYDUB_AVAILABLE, split_on_silence_ranges
+from language_service.phrase_matcher import load_phrase_dictionaries
+
+if PYDUB_AVAILABLE:
+    from pydub import AudioSegment
+    from pydub.generators import Sine
+
+
+def load_kannada_phrases():
+    with open(Config.MEDICAL_PHRASE_DICTIONARY_PATH, encoding="utf-8") as dictionary_file:
+        return json.load(dictionary_file)["kn"]
+
+
+def dictionary_scan_translate(translations, text):
+    """The former translation: a direct match, else a word by word replacement once any phrase is contained"""
+    text_lower = text.lower().strip()
+    if text_lower in translations:
+        return translations[text_lower]
+    for phrase in translations:
+        if phrase in text_lower:
+            return " ".join(translations.get(word, word) for word in text_lower.split())
+    return None
+
+
+def dictionary_scan_correct(corrections, text):
+    """The former STT correction: the most similar variant over the whole dictionary"""
+    text_lower = text.lower().strip()
+    best_match, best_similarity = None, 0.0
+    for phrase, variants in corrections.items():
+        if text_lower == phrase:
+            return phrase, 1.0, False
+        for variant in variants:
+            similarity = SequenceMatcher(None, text_lower, variant).ratio()
+            if similarity > best_similarity:
+                best_similarity, best_match = similarity, phrase
+    if best_similarity > 0.6:
+        return best_match, best_similarity, True
+    return text, 0.0, False
+
+
+class PhraseDictionaryTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.phrases = load_kannada_phrases()
+        cls.dictionary = load_phrase_dictionaries()["kn"]
+
+    def test_translate_matches_dictionary_scan(self):
+        translations = self.phrases["translations"]
+        texts = list(translations) + [phrase.upper() for phrase in translations] + [
+            "nange tala",
+            "kemmu jwara",
+            "bennu kai kaalu",
+            "nanage vanthi",
+            "what is this",
+        ]
+        for text in texts:
+            with self.subTest(text=text):
+                self.assertEqual(self.dictionary.translate(text), dictionary_scan_translate(translations, text))
+
+    def test_translate_replaces_whole_phrases_only(self):
+        # "kai" is a phrase, but not inside "kaichi" (a phrase of its own) or "kaisu"
+        self.assertEqual(self.dictionary.translate("kaichi"), "fever")
+        self.assertIsNone(self.dictionary.translate("kaisu"))
+        self.assertEqual(self.dictionary.translate("hotte novu bantu"), "stomach ache bantu")
+
+    def test_correct_matches_dictionary_scan(self):
+        corrections = self.phrases["corrections"]
+        texts = list(corrections) + [variant for variants in corrections.values() for variant in variants] + [
+            "ke jwara ide",
+            "nani ge kemu ide",
+            "jvara bantid",
+            "sardii",
+            "hello how are you",
+        ]
+        for text in texts:
+            with self.subTest(text=text):
+                corrected, similarity, was_corrected = self.dictionary.correct(text)
+                expected, expected_similarity, expected_corrected = dictionary_scan_correct(corrections, text)
+                self.assertEqual((corrected, was_corrected), (expected, expected_corrected))
+                self.assertAlmostEqual(similarity, expected_similarity)
+
+
+@skipUnless(PYDUB_AVAILABLE, "pydub is not installed")
+class SplitOnSilenceRangesTests(SimpleTestCase):
+    def speech(self, duration_ms):
+        return Sine(440).to_audio_segment(duration=duration_ms, volume=-10).set_frame_rate(16000).set_channels(1)
+
+    def silence(self, duration_ms):
+        return AudioSegment.silent(duration=duration_ms, frame_rate=16000)
+
+    def assert_valid_chunks(self, chunks, audio, max_chunk_ms):
+        for start, end in chunks:
+            self.assertLess(start, end)
+            self.assertLessEqual(end - start, max_chunk_ms)
+        for (_, previous_end), (start, _) in zip(chunks, chunks[1:]):
+            self.assertLessEqual(previous_end, start)
+        self.assertLessEqual(chunks[-1][1], len(audio))
+
+    def test_short_audio_is_a_single_chunk(self):
+        audio = self.speech(5000)
+        self.assertEqual(split_on_silence_ranges(audio, max_chunk_ms=10000), [(0, 5000)])
+
+    def test_speech_is_packed_between_silences(self):
+        audio = self.speech(4000) + self.silence(1000) + self.speech(4000) + self.silence(1000) + self.speech(4000)
+        chunks = split_on_silence_ranges(audio, max_chunk_ms=10000, min_silence_ms=500, keep_silence_ms=200)
+
+        self.assertEqual(len(chunks), 2)
+        self.assert_valid_chunks(chunks, audio, 10000)
+        # the second chunk starts in the silence before the last speech
+        self.assertTrue(9000 <= chunks[1][0] <= 10000)
+
+    def test_long_speech_is_cut_at_the_chunk_limit(self):
+        audio = self.speech(25000)
+        chunks = split_on_silence_ranges(audio, max_chunk_ms=10000, min_silence_ms=500)
+
+        self.assertEqual(len(chunks), 3)
+        self.assert_valid_chunks(chunks, audio, 10000)
+        self.assertEqual(chunks[-1][1], len(audio))
@@ -11,9 +11,12 @@ Features:
 """
 import os
 import asyncio
-from google.cloud import translate_v2 as translate
-from google.oauth2 import service_account
+import hashlib
 from django.conf import settings
+from common.cache import build_tiered_cache
+from django_core.config import Config
+from language_service.clients import a_translate_batch, get_credentials, get_translate_client
+from language_service.phrase_matcher import get_phrase_dictionary
 
 # Constants
 BASE_DIR = settings.BASE_DIR
@@ -28,74 +31,10 @@ class Constants:
     LANGUAGE_CODE_TAMIL = 'ta'
     LANGUAGE_CODE_TELUGU = 'te'
 
-# Google Cloud credentials
-try:
-    from django.conf import settings
-    
-    # ✅ CORRECTED PATH: Use settings or fallback to direct path
-    gcp_cred_path = getattr(settings, 'GCP_TRANSLATION_CREDENTIALS_PATH', 
-                            r"C:\Users\cools\Downloads\servvia-google-credentials.json")
-    
-    if os.path.exists(gcp_cred_path):
-        credentials = service_account.Credentials.from_service_account_file(gcp_cred_path)
-        print(f"✅ GCP Translation credentials loaded: {gcp_cred_path}")
-    else:
-        print(f"⚠️ GCP credentials file not found at: {gcp_cred_path}")
-        credentials = None
-        
-except Exception as e:
-    print(f"⚠️ Could not load GCP credentials: {e}")
-    credentials = None
-
-
-# ✅ Kannada medical dictionary for common health terms
-KANNADA_MEDICAL = {
-    # Fever
-    "nange jwara ide": "I have fever",
-    "jwara idhe": "have fever",
-    "nange jwara edhe":"I have fever",
-    "jwara": "fever",
-    "jvara": "fever",
-    "kaichi": "fever",
-    
-    # Pain
-    "novu ide" : "have pain",
-    "novu": "pain",
-    "tala novu": "headache",
-    "hotte novu": "stomach ache",
-    "kaalu novu": "leg pain",
-    
-    # Cough/Cold
-    "nanige kemmu ide": "I have cough",
-    "nange kemmu ide": "I have cough",
-    "kemmu ide": "have cough",
-    "kemmu": "cough",
-    "mosaru": "cold",
-    "sali": "cough",
-    
-    # Common phrases
-    "nange": "I have",
-    "nanage": "I have",
-    "nanige":"I have",
-    "enu maadali" : "what to do",
-    "upachara": "treatment",
-    "aushadha": "medicine",
-    
-    # Body parts
-    "tala": "head",
-    "tale": "head",
-    "hotte": "stomach",
-    "otte":"stomach",
-    "kaalu": "leg",
-    "kai": "hand",
-    "bennu": "back",
-    
-    # Symptoms
-    "vanthi": "vomiting",
-    "hakki": "vomit",
-    "loose motion": "loose motion",
-    "khushi": "happy",  # Sometimes used in context
-}
+# (text, source, target) -> translation, shared across requests and, with REDIS_URL, across workers
+translation_cache = build_tiered_cache(
+    "translation", Config.TRANSLATION_CACHE_MAX_ENTRIES, Config.TRANSLATION_CACHE_TTL
+)
 
 
 def check_kannada_medical(text: str) -> str:
@@ -109,30 +48,11 @@ def check_kannada_medical(text: str) -> str:
     Returns:
         English translation if found, None otherwise
     """
-    text_lower = text.lower().strip()
-    
-    # Direct match
-    if text_lower in KANNADA_MEDICAL:
-        translation = KANNADA_MEDICAL[text_lower]
-        print(f"✅ Direct match: '{text}' → '{translation}'")
-        return translation
-    
-    # Partial match - check if text contains any key
-    for kannada, english in KANNADA_MEDICAL.items():
-        if kannada in text_lower:
-            # Build translated sentence
-            translated_parts = []
-            for word in text_lower.split():
-                if word in KANNADA_MEDICAL:
-                    translated_parts.append(KANNADA_MEDICAL[word])
-                else:
-                    translated_parts.append(word)
-            
-            translation = ' '.join(translated_parts)
-            print(f"✅ Partial match: '{text}' → '{translation}'")
-            return translation
-    
-    return None
+    # direct and whole-phrase matches against the compiled dictionary (see language_service/dictionaries)
+    translation = get_phrase_dictionary(Constants.LANGUAGE_CODE_KANNADA).translate(text)
+    if translation:
+        print(f"✅ Dictionary match: '{text}' → '{translation}'")
+    return translation
 
 
 async def a_translate_to_english(text: str) -> str:
@@ -145,20 +65,8 @@ async def a_translate_to_english(text: str) -> str:
     Returns:
         Translated English text
     """
-    if not credentials:
-        return text
-        
-    translate_client = translate.Client(credentials=credentials)
-    
-    # Add healthcare context hint for better translation
-    translation = await asyncio.to_thread(
-        translate_client.translate,
-        text,
-        target_language=Constants.LANGUAGE_SHORT_CODE_ENG,
-        format_="text",
-        model="nmt"  # Use Neural Machine Translation for better accuracy
-    )
-    return translation["translatedText"]
+    translations = await a_translate_batch_to([text], Constants.LANGUAGE_SHORT_CODE_ENG)
+    return translations[0]
 
 
 async def a_translate_to(text: str, lang_code: str) -> str:
@@ -172,22 +80,56 @@ async def a_translate_to(text: str, lang_code: str) -> str:
     Returns:
         Translated text
     """
-    if not credentials:
-        return text
-        
-    translate_client = translate.Client(credentials=credentials)
+    translations = await a_translate_batch_to([text], lang_code)
+    return translations[0]
+
+
+def get_translation_cache_key(text: str, source_language, target_language: str) -> str:
+    key_data = f"{source_language or 'auto'}\x00{target_language}\x00{text}"
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+async def a_translate_batch_to(texts, lang_code: str, source_language=None) -> list:
+    """
+    Translate several texts to specified language, serving repeated texts from the translation cache
+    and sending the rest in a single API call
     
-    # Extract base language code (hi-Latn -> hi, kn -> kn)
+    Args:
+        texts: Texts to translate
+        lang_code: Target language code (e.g., 'kn' for Kannada)
+        source_language: Source language code, detected when None
+        
+    Returns:
+        Translated texts, in the same order
+    """
+    texts = list(texts)
+    if not get_credentials():
+        return texts
+
     lang_code = lang_code.split("-")[0] if "-" in lang_code else lang_code
-    
-    translation = await asyncio.to_thread(
-        translate_client.translate,
-        text,
-        target_language=lang_code,
-        format_="text",
-        model="nmt"  # Use Neural Machine Translation
-    )
-    return translation["translatedText"]
+    keys = [get_translation_cache_key(text, source_language, lang_code) for text in texts]
+
+    if translation_cache.is_remote:
+        cached = await asyncio.to_thread(translation_cache.get_many, keys)
+    else:
+        cached = translation_cache.get_many(keys)
+
+    # translate each distinct uncached text once
+    missing = {}
+    for text, key in zip(texts, keys):
+        if key not in cached and text and str(text).strip():
+            missing.setdefault(key, text)
+
+    if missing:
+        translations = await a_translate_batch(list(missing.values()), lang_code, source_language)
+        new_entries = dict(zip(missing.keys(), translations))
+        if translation_cache.is_remote:
+            await asyncio.to_thread(translation_cache.set_many, new_entries)
+        else:
+            translation_cache.set_many(new_entries)
+        cached.update(new_entries)
+
+    return [cached.get(key, text) for text, key in zip(texts, keys)]
 
 
 async def detect_language_and_translate_to_english(input_msg):
@@ -201,7 +143,7 @@ async def detect_language_and_translate_to_english(input_msg):
     Returns:
         Tuple of (translated_text, detected_language)
     """
-    if not credentials:
+    if not get_credentials():
         return input_msg, "en"
     
     # Step 0: Check Kannada medical dictionary first (with better logging)
@@ -215,7 +157,7 @@ async def detect_language_and_translate_to_english(input_msg):
         return dict_translation, "kn"  # ✅ Return "kn" for Kannada
     
     # Step 1: Detect language with Google
-    translate_client = translate.Client(credentials=credentials)
+    translate_client = get_translate_client()
     
     try:
         language_detection = await asyncio.to_thread(translate_client.detect_language, input_msg)
@@ -256,12 +198,10 @@ async def translate_text_to_language(text, target_language_code):
     Returns:
         Translated text
     """
-    if not credentials:
+    if not get_credentials():
         return text
         
     try:
-        translate_client = translate.Client(credentials=credentials)
-        
         # Extract base language code (hi-Latn -> hi, kn -> kn, en-US -> en)
         base_lang = target_language_code.split("-")[0] if "-" in target_language_code else target_language_code
         
@@ -270,15 +210,9 @@ async def translate_text_to_language(text, target_language_code):
         print(f"   Target: {base_lang} (from {target_language_code})")
         
         # Translate the text to the detected language
-        result = await asyncio.to_thread(
-            translate_client.translate,
-            text,
-            target_language=base_lang,
-            format_="text",
-            model="nmt"  # Neural Machine Translation for better quality
-        )
+        result = await a_translate_batch_to([text], base_lang)
         
-        translated = result['translatedText']
+        translated = result[0]
         print(f"   ✅ Translated successfully")
         
         return translated
@@ -1,12 +1,12 @@
 import asyncio
-from google.cloud import translate_v2 as translate
+from language_service.clients import get_translate_client
 
 async def translate_text_to_language(text, target_language_code):
     """
     Translate text to target language
     """
     try:
-        translate_client = translate.Client()
+        translate_client = get_translate_client()
         
         # Translate the text
         result = await asyncio.to_thread(
@@ -11,47 +11,22 @@ Features:
 """
 import asyncio
 import aiohttp
+import hashlib
 import logging
 import uuid
 import os
 from google.cloud import texttospeech
-from google.oauth2 import service_account
 
+from common.cache import DiskCache, MemoryCache
 from common.constants import Constants
+from common.tracing import traced
 from common.utils import clean_text
+from language_service.clients import get_credentials, get_tts_client
 from language_service.utils import get_language_by_code
 from django_core.config import Config
 
 logger = logging.getLogger(__name__)
 
-# ============================================================
-# GOOGLE CLOUD TTS CREDENTIALS
-# Current Date and Time (UTC): 2025-11-25 05:23:15
-# Current User: lil-choco
-# ============================================================
-
-try:
-    # ✅ Try to load from settings first
-    from django.conf import settings
-    
-    gcp_cred_path = getattr(settings, 'GCP_TRANSLATION_CREDENTIALS_PATH', 
-                            r"C:\Users\cools\Downloads\servvia-google-credentials.json")
-    
-    if os.path.exists(gcp_cred_path):
-        credentials = service_account.Credentials.from_service_account_file(gcp_cred_path)
-        logger.info(f"✅ TTS credentials loaded: {gcp_cred_path}")
-    elif hasattr(Config, 'GOOGLE_APPLICATION_CREDENTIALS') and os.path.exists(Config.GOOGLE_APPLICATION_CREDENTIALS):
-        credentials = service_account.Credentials.from_service_account_file(Config.GOOGLE_APPLICATION_CREDENTIALS)
-        logger.info(f"✅ TTS credentials loaded from Config: {Config.GOOGLE_APPLICATION_CREDENTIALS}")
-    else:
-        logger.error(f"❌ TTS credentials file not found at: {gcp_cred_path}")
-        credentials = None
-        
-except Exception as e:
-    logger.error(f"❌ Could not load TTS credentials: {e}")
-    credentials = None
-
-
 async def synthesize_speech_azure(text_to_synthesize, language_code, aiohttp_session):
     """
     Synthesise speech using Azure TTS model.
@@ -120,36 +95,93 @@ async def synthesize_speech_azure(text_to_synthesize, language_code, aiohttp_ses
     return audio_content
 
 
-async def synthesize_speech(
+# Fallback: Map common language codes to BCP-47 codes
+TTS_LANGUAGE_MAP = {
+    "en": "en-US",
+    "hi": "hi-IN",
+    "kn": "kn-IN",  # Kannada
+    "ta": "ta-IN",  # Tamil
+    "te": "te-IN",  # Telugu
+    "ml": "ml-IN",  # Malayalam
+    "bn": "bn-IN",  # Bengali
+    "mr": "mr-IN",  # Marathi
+    "gu": "gu-IN",  # Gujarati
+    "pa": "pa-IN",  # Punjabi
+    "es": "es-ES",  # Spanish
+    "fr": "fr-FR",  # French
+    "de": "de-DE",  # German
+    "zh": "zh-CN",  # Chinese
+    "ja": "ja-JP",  # Japanese
+    "ko": "ko-KR",  # Korean
+}
+TTS_VOICE_GENDER = texttospeech.SsmlVoiceGender.FEMALE
+
+# Synthesised audio keyed on the cleaned text and voice settings; the disk tier survives restarts
+tts_memory_cache = MemoryCache(max_entries=Config.TTS_MEMORY_CACHE_MAX_ENTRIES)
+tts_disk_cache = None
+
+
+def get_tts_disk_cache():
+    global tts_disk_cache
+    if tts_disk_cache is None and Config.TTS_DISK_CACHE_DIR:
+        try:
+            tts_disk_cache = DiskCache(
+                Config.TTS_DISK_CACHE_DIR, max_bytes=Config.TTS_DISK_CACHE_MAX_BYTES, suffix=".audio"
+            )
+        except OSError as e:
+            logger.error(f"❌ Could not open TTS disk cache: {e}")
+    return tts_disk_cache
+
+
+def get_tts_language_code(input_language):
+    """
+    Resolve the BCP-47 code used for synthesis from a language code.
+    """
+    # Extract base language code (kn-IN → kn)
+    input_language_base = input_language.split("-")[0] if "-" in input_language else input_language
+
+    # Try to get language from database
+    language = get_language_by_code(input_language_base)
+    if language:
+        language_code = language.get("bcp_code")
+        logger.info(f"✅ Using BCP code: {language_code} for language: {input_language_base}")
+        return language_code
+
+    language_code = TTS_LANGUAGE_MAP.get(input_language_base, "en-US")
+    logger.warning(f"⚠️ Language {input_language_base} not in database, using: {language_code}")
+    return language_code
+
+
+def get_tts_cache_key(text, language_code, voice, audio_encoding_format, sample_rate_hertz):
+    key_data = "\x00".join(
+        [text, str(language_code), str(voice), str(int(audio_encoding_format)), str(sample_rate_hertz)]
+    )
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+@traced("tts")
+async def synthesize_speech_bytes(
     input_text: str,
     input_language: str,
-    id_string: str = None,
     aiohttp_session=None,
     audio_encoding_format=texttospeech.AudioEncoding.OGG_OPUS,
     sample_rate_hertz=48000,
-) -> str:
+) -> bytes:
     """
-    Synthesise speech using Google TTS with fallback to Azure
-    Current Date and Time (UTC): 2025-11-25 05:23:15
-    Current User: lil-choco
+    Synthesise speech using Google TTS with fallback to Azure, serving repeated texts from the audio cache
     
     Google TTS Docs: https://cloud.google.com/text-to-speech/docs/
     
     Args:
         input_text: Text to convert to speech
         input_language: Language code (e.g., 'en', 'kn', 'hi')
-        id_string: Unique identifier for the audio file
         aiohttp_session: Async HTTP session for Azure fallback
         audio_encoding_format: Audio format (OGG_OPUS or MP3)
         sample_rate_hertz: Sample rate (default: 48000)
         
     Returns:
-        Path to generated audio file or None if failed
+        Audio content as bytes or None if failed
     """
-    # Generate unique file ID
-    id_string = uuid.uuid4() if not id_string else id_string
-    file_name = f"response_{id_string}.{Constants.OGG}"
-    
     # Clean and validate input text
     input_text = clean_text(input_text)
     
@@ -161,77 +193,49 @@ async def synthesize_speech(
     if len(input_text) > 5000:
         logger.warning(f"⚠️ Text too long ({len(input_text)} chars), truncating to 5000")
         input_text = input_text[:4997] + "..."
-    
-    logger.info(f"🔊 Synthesizing speech: '{input_text[:50]}...' in language: {input_language}")
-    
-    synthesis_input = texttospeech.SynthesisInput(text=input_text)
-    
-    # Default language code
-    language_code = "en-US"
-    
-    # Extract base language code (kn-IN → kn)
-    input_language_base = input_language.split("-")[0] if "-" in input_language else input_language
 
     # Determine audio format
     if audio_encoding_format and str(audio_encoding_format).lower() == Constants.MP3:
         audio_encoding_format = texttospeech.AudioEncoding.MP3
-        file_name = f"response_{id_string}.{Constants.MP3}"
     else:
         audio_encoding_format = texttospeech.AudioEncoding.OGG_OPUS
 
     sample_rate_hertz = sample_rate_hertz if sample_rate_hertz else 48000
 
     try:
-        # Try to get language from database
-        language = get_language_by_code(input_language_base)
-        
-        if language:
-            language_code = language.get("bcp_code")
-            logger.info(f"✅ Using BCP code: {language_code} for language: {input_language_base}")
-        else:
-            # Fallback: Map common language codes to BCP-47 codes
-            language_map = {
-                "en": "en-US",
-                "hi": "hi-IN",
-                "kn": "kn-IN",  # Kannada
-                "ta": "ta-IN",  # Tamil
-                "te": "te-IN",  # Telugu
-                "ml": "ml-IN",  # Malayalam
-                "bn": "bn-IN",  # Bengali
-                "mr": "mr-IN",  # Marathi
-                "gu": "gu-IN",  # Gujarati
-                "pa": "pa-IN",  # Punjabi
-                "es": "es-ES",  # Spanish
-                "fr": "fr-FR",  # French
-                "de": "de-DE",  # German
-                "zh": "zh-CN",  # Chinese
-                "ja": "ja-JP",  # Japanese
-                "ko": "ko-KR",  # Korean
-            }
-            language_code = language_map.get(input_language_base, "en-US")
-            logger.warning(f"⚠️ Language {input_language_base} not in database, using: {language_code}")
+        language_code = get_tts_language_code(input_language)
+
+        cache_key = get_tts_cache_key(
+            input_text, language_code, TTS_VOICE_GENDER, audio_encoding_format, sample_rate_hertz
+        )
+        audio_content = tts_memory_cache.get(cache_key)
+        if audio_content is None and get_tts_disk_cache():
+            audio_content = await asyncio.to_thread(tts_disk_cache.get, cache_key)
+            if audio_content is not None:
+                tts_memory_cache.set(cache_key, audio_content)
+        if audio_content is not None:
+            logger.info(f"🔊 Serving cached speech for: '{input_text[:50]}...' ({len(audio_content)} bytes)")
+            return audio_content
+
+        logger.info(f"🔊 Synthesizing speech: '{input_text[:50]}...' in language: {input_language}")
 
         # Check if Google TTS credentials are available
-        if not credentials:
+        if not get_credentials():
             logger.error("❌ Google TTS credentials not available")
             
             # Try Azure fallback if available
             if aiohttp_session:
                 logger.info("🔄 Attempting Azure TTS fallback...")
-                audio_content = await synthesize_speech_azure(input_text, language_code, aiohttp_session)
-                
-                if audio_content:
-                    with open(file_name, "wb") as out:
-                        out.write(audio_content)
-                    logger.info(f"✅ Azure TTS successful: {file_name}")
-                    return file_name
+                return await synthesize_speech_azure(input_text, language_code, aiohttp_session)
             
             return None
 
         # Use Google TTS for speech synthesis
+        synthesis_input = texttospeech.SynthesisInput(text=input_text)
+
         voice = texttospeech.VoiceSelectionParams(
             language_code=language_code,
-            ssml_gender=texttospeech.SsmlVoiceGender.FEMALE,
+            ssml_gender=TTS_VOICE_GENDER,
         )
         
         audio_config = texttospeech.AudioConfig(
@@ -239,7 +243,7 @@ async def synthesize_speech(
             sample_rate_hertz=sample_rate_hertz
         )
         
-        text_to_speech_client = texttospeech.TextToSpeechClient(credentials=credentials)
+        text_to_speech_client = get_tts_client()
 
         try:
             logger.info(f"📡 Calling Google TTS API...")
@@ -257,17 +261,14 @@ async def synthesize_speech(
                 logger.error("❌ Google TTS returned empty audio content")
                 return None
 
-            # Write audio to file
-            with open(file_name, "wb") as out:
-                out.write(audio_content)
-            
-            # Verify file was created and has content
-            if os.path.exists(file_name):
-                file_size = os.path.getsize(file_name)
-                logger.info(f"✅ Successfully wrote voice response to file: {file_name} ({file_size} bytes)")
-            else:
-                logger.error(f"❌ File not created: {file_name}")
-                return None
+            logger.info(f"✅ Successfully synthesized voice response ({len(audio_content)} bytes)")
+
+            # only Google output is cached, the Azure fallback returns a different voice and format
+            tts_memory_cache.set(cache_key, audio_content)
+            if get_tts_disk_cache():
+                await asyncio.to_thread(tts_disk_cache.set, cache_key, audio_content)
+
+            return audio_content
 
         except Exception as tts_error:
             logger.error(f"❌ Google TTS API error: {str(tts_error)}", exc_info=True)
@@ -275,13 +276,7 @@ async def synthesize_speech(
             # Try Azure fallback
             if aiohttp_session:
                 logger.info("🔄 Attempting Azure TTS fallback after Google TTS failure...")
-                audio_content = await synthesize_speech_azure(input_text, language_code, aiohttp_session)
-                
-                if audio_content:
-                    with open(file_name, "wb") as out:
-                        out.write(audio_content)
-                    logger.info(f"✅ Azure TTS fallback successful: {file_name}")
-                    return file_name
+                return await synthesize_speech_azure(input_text, language_code, aiohttp_session)
             
             return None
 
@@ -289,6 +284,43 @@ async def synthesize_speech(
         logger.error(f"❌ TTS Error: {e}", exc_info=True)
         return None
 
+
+async def synthesize_speech(
+    input_text: str,
+    input_language: str,
+    id_string: str = None,
+    aiohttp_session=None,
+    audio_encoding_format=texttospeech.AudioEncoding.OGG_OPUS,
+    sample_rate_hertz=48000,
+) -> str:
+    """
+    Synthesise speech and write it to an audio file, for callers that need a file on disk
+    
+    Args:
+        input_text: Text to convert to speech
+        input_language: Language code (e.g., 'en', 'kn', 'hi')
+        id_string: Unique identifier for the audio file
+        aiohttp_session: Async HTTP session for Azure fallback
+        audio_encoding_format: Audio format (OGG_OPUS or MP3)
+        sample_rate_hertz: Sample rate (default: 48000)
+        
+    Returns:
+        Path to generated audio file or None if failed
+    """
+    # Generate unique file ID
+    id_string = uuid.uuid4() if not id_string else id_string
+    file_extension = Constants.MP3 if str(audio_encoding_format).lower() == Constants.MP3 else Constants.OGG
+    file_name = f"response_{id_string}.{file_extension}"
+
+    audio_content = await synthesize_speech_bytes(
+        input_text, input_language, aiohttp_session, audio_encoding_format, sample_rate_hertz
+    )
+    if not audio_content:
+        return None
+
+    with open(file_name, "wb") as out:
+        out.write(audio_content)
+    logger.info(f"✅ Successfully wrote voice response to file: {file_name} ({len(audio_content)} bytes)")
     return file_name
 
 
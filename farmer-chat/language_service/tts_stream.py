@@ -0,0 +1,132 @@
+"""
+Sentence-level speech synthesis for streamed and long answers
+
+Answers are split into sentences that are synthesised concurrently, with bounded parallelism,
+and handed back as ordered audio segments so that playback can start with the first sentence.
+"""
+import asyncio
+import logging
+from collections import deque
+
+from common.utils import encode_bytes_to_base64, split_complete_sentences
+from django_core.config import Config
+from language_service.tts import synthesize_speech_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def split_text_for_speech(text, max_chars=None):
+    """
+    Split text into sentences for synthesis, breaking sentences longer than max_chars at word boundaries.
+    """
+    max_chars = max_chars or Config.TTS_SEGMENT_MAX_CHARS
+    sentences, remainder = split_complete_sentences(text)
+    if remainder.strip():
+        sentences.append(remainder)
+
+    segments = []
+    for sentence in sentences:
+        sentence = sentence.strip()
+        while len(sentence) > max_chars:
+            split_index = sentence.rfind(" ", 0, max_chars)
+            split_index = split_index if split_index > 0 else max_chars
+            segments.append(sentence[:split_index].strip())
+            sentence = sentence[split_index:].strip()
+        if sentence:
+            segments.append(sentence)
+    return segments
+
+
+class SpeechSegmentPipeline:
+    """
+    Synthesise text as it arrives, one sentence per segment, returning the segments in order.
+    """
+
+    def __init__(self, language, concurrency=None):
+        self.language = language
+        self.semaphore = asyncio.Semaphore(concurrency or Config.TTS_STREAM_CONCURRENCY)
+        self.tasks = deque()
+        self.pending_text = ""
+        self.sequence = 0
+
+    def add_text(self, text):
+        """
+        Add streamed text, starting synthesis of every sentence it completes.
+        """
+        self.pending_text += text
+        sentences, self.pending_text = split_complete_sentences(self.pending_text)
+        for sentence in sentences:
+            self._submit(sentence)
+
+    def _submit(self, text):
+        for segment_text in split_text_for_speech(text):
+            self.sequence += 1
+            self.tasks.append(asyncio.ensure_future(self._synthesize(self.sequence, segment_text)))
+
+    async def _synthesize(self, sequence, text):
+        async with self.semaphore:
+            try:
+                audio_content = await synthesize_speech_bytes(text, self.language)
+            except Exception as error:
+                logger.error(f"Segment {sequence} synthesis failed: {error}", exc_info=True)
+                audio_content = None
+        return {"sequence": sequence, "text": text, "audio": encode_bytes_to_base64(audio_content)}
+
+    def pop_ready(self):
+        """
+        Return the segments that are synthesised, stopping at the first one still in progress to keep the order.
+        """
+        ready_segments = []
+        while self.tasks and self.tasks[0].done():
+            ready_segments.append(self.tasks.popleft().result())
+        return ready_segments
+
+    async def drain(self):
+        """
+        Synthesise the remaining text and yield all outstanding segments in order.
+        """
+        if self.pending_text.strip():
+            self._submit(self.pending_text)
+        self.pending_text = ""
+        while self.tasks:
+            yield await self.tasks.popleft()
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+
+
+async def synthesize_text_segments(text, language, concurrency=None):
+    """
+    Synthesise a text of any length as an ordered list of audio segments.
+    """
+    pipeline = SpeechSegmentPipeline(language, concurrency)
+    pipeline.add_text(text)
+    return [segment async for segment in pipeline.drain()]
+
+
+async def add_speech_events(events, concurrency=None):
+    """
+    Interleave "audio" segment events with the (event, data) pairs of a streamed answer.
+    The answer language is taken from the "start" event; remaining segments are sent before "done".
+    """
+    pipeline = None
+    try:
+        async for event, data in events:
+            if event == "start":
+                pipeline = SpeechSegmentPipeline(data.get("input_language_detected") or "en", concurrency)
+            elif event == "answer" and pipeline:
+                pipeline.add_text(data.get("text", ""))
+            elif event == "done" and pipeline:
+                async for segment in pipeline.drain():
+                    yield "audio", segment
+
+            yield event, data
+
+            if pipeline:
+                for segment in pipeline.pop_ready():
+                    yield "audio", segment
+    finally:
+        if pipeline:
+            pipeline.cancel()
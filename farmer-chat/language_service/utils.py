@@ -1,12 +1,46 @@
 import logging
 
-from database.database_config import db_conn
+from common.cache import MemoryCache
+from database.database_config import connection_context
 from database. db_operations import get_record_by_field
 from database.models import Language
 from django_core. config import Config
 
 logger = logging. getLogger(__name__)
 
+LANGUAGE_TABLE_KEY = "languages"
+
+# the Language table is small and almost never changes, so it is cached whole
+language_cache = MemoryCache(max_entries=1, ttl=Config.LANGUAGE_CACHE_TTL)
+
+
+def load_language_table():
+    """Query all active languages, returning None if the query fails."""
+    try:
+        with connection_context():
+            return list(
+                Language.select(
+                    Language.id,
+                    Language.name,
+                    Language.display_name,
+                    Language.code,
+                    Language.latn_code,
+                    Language.bcp_code,
+                )
+                .where(Language.is_deleted == False)
+                .dicts()
+            )
+    except Exception as error:
+        logger.error(error, exc_info=True)
+        return None
+
+
+def get_cached_languages(with_db_config=Config.WITH_DB_CONFIG) -> list:
+    """Return the active languages from the cache, loading the Language table on a miss."""
+    if not with_db_config:
+        return []
+    return language_cache.get_or_load(LANGUAGE_TABLE_KEY, load_language_table) or []
+
 
 def get_language_by_code(language_code, with_db_config=Config. WITH_DB_CONFIG):
     """Get language details by code"""
@@ -24,21 +58,16 @@ def get_language_by_code(language_code, with_db_config=Config. WITH_DB_CONFIG):
         'mr': {'code': 'mr', 'name': 'Marathi', 'bcp_code': 'mr-IN'},
     }
     
-    if with_db_config:
-        try:
-            with db_conn:
-                language_query = Language.select(
-                    (Language.id).alias("language_id"),
-                    Language.name,
-                    Language. code,
-                    Language.bcp_code,
-                ).where(Language.is_deleted == False, Language.code == language_code)
+    for row in get_cached_languages(with_db_config):
+        if row["code"] == language_code:
+            language = {
+                "language_id": row["id"],
+                "name": row["name"],
+                "code": row["code"],
+                "bcp_code": row["bcp_code"],
+            }
+            break
 
-                if language_query. count() >= 1:
-                    language = list(language_query.dicts().execute())[0]
-        except Exception as error:
-            logger.warning(f"Language by code {language_code} does not exist in DB")
-    
     # Fallback to dictionary if not in DB
     if not language:
         language = languages. get(language_code, languages['en'])
@@ -48,45 +77,32 @@ def get_language_by_code(language_code, with_db_config=Config. WITH_DB_CONFIG):
 
 def get_all_languages(with_db_config=Config.WITH_DB_CONFIG) -> list:
     """Query the list of all active languages."""
-    language_list = []
-    if with_db_config: 
-        try:
-            with db_conn:
-                language_query = Language.select(
-                    (Language.id).alias("language_id"),
-                    (Language. name).alias("language_name"),
-                    (Language.display_name).alias("language_display_name"),
-                    (Language. code).alias("language_code"),
-                    (Language.latn_code).alias("language_latn_code"),
-                    (Language.bcp_code).alias("language_bcp_code"),
-                ).where(Language.is_deleted == False)
-
-                if language_query.count() >= 1:
-                    language_list = list(language_query. dicts().execute())
-        except Exception as error:
-            logger.error(error, exc_info=True)
-
-    return language_list
+    return [
+        {
+            "language_id": row["id"],
+            "language_name": row["name"],
+            "language_display_name": row["display_name"],
+            "language_code": row["code"],
+            "language_latn_code": row["latn_code"],
+            "language_bcp_code": row["bcp_code"],
+        }
+        for row in get_cached_languages(with_db_config)
+    ]
 
 
 def get_language_by_id(language_id, with_db_config=Config.WITH_DB_CONFIG):
     """Query a specific language by the given language ID."""
     language = {}
-    if with_db_config:
-        try:
-            with db_conn:
-                language_query = Language.select(
-                    (Language.id).alias("language_id"),
-                    Language.name,
-                    Language.display_name,
-                    Language.code,
-                    Language.latn_code,
-                    Language.bcp_code,
-                ).where(Language.is_deleted == False, Language.id == language_id)
+    for row in get_cached_languages(with_db_config):
+        if str(row["id"]) == str(language_id):
+            language = {
+                "language_id": row["id"],
+                "name": row["name"],
+                "display_name": row["display_name"],
+                "code": row["code"],
+                "latn_code": row["latn_code"],
+                "bcp_code": row["bcp_code"],
+            }
+            break
 
-                if language_query. count() >= 1:
-                    language = list(language_query.dicts().execute())[0]
-        except Exception as error: 
-            logger.error(error, exc_info=True)
-
-    return language
\ No newline at end of file
+    return language
@@ -0,0 +1,214 @@
+"""
+Semantic cache of generated answers, keyed on the rephrased query embedding and the user's health profile
+
+Answers are shared between users with the same allergies, conditions and medications. The user's name is
+replaced with a placeholder when an answer is cached, and the name of the user served is put back in its place.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django_core.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+USER_NAME_PLACEHOLDER = "{user_name}"
+
+
+def get_profile_fingerprint(user_profile):
+    """
+    Hash the parts of the health profile that change the generated answer.
+    Answers are only shared between users with the same allergies, conditions and medications.
+    """
+    user_profile = user_profile or {}
+    profile_data = {
+        field: sorted({str(value).strip().lower() for value in user_profile.get(field) or [] if str(value).strip()})
+        for field in ("allergies", "medical_conditions", "current_medications")
+    }
+    return hashlib.sha256(json.dumps(profile_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def anonymise_answer(response, user_name):
+    """
+    Replace the user's name in a generated answer with a placeholder, so that it can be served to other users.
+    """
+    if not response or not user_name or not str(user_name).strip():
+        return response
+    return re.sub(rf"\b{re.escape(str(user_name).strip())}\b", USER_NAME_PLACEHOLDER, response)
+
+
+def personalise_answer(response, user_name):
+    """
+    Put the name of the user served in place of the placeholder of a cached answer.
+    """
+    if not response:
+        return response
+    return response.replace(USER_NAME_PLACEHOLDER, str(user_name or "").strip() or "User")
+
+
+def get_fingerprint_code(profile_fingerprint):
+    # 60 bits of the fingerprint, to select a profile's rows of the embedding matrix in one vectorised comparison
+    return int(profile_fingerprint[:15], 16)
+
+
+def normalise_query(query):
+    return " ".join(str(query).lower().split())
+
+
+def normalise_embedding(embedding):
+    embedding = np.asarray(embedding, dtype=np.float32)
+    return embedding / (np.linalg.norm(embedding) or 1.0)
+
+
+class SemanticAnswerCache:
+    """
+    Nearest-neighbour cache of answers with a cosine similarity threshold and TTL/LRU eviction.
+
+    The normalised query embeddings are kept in a matrix preallocated for max_entries rows, so that a lookup
+    is one matrix-vector product over the occupied rows, masked to the profile's live rows.
+    """
+
+    def __init__(self, similarity_threshold=0.95, ttl=86400, max_entries=5000):
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self._reset()
+
+    def _reset(self):
+        # (profile fingerprint, query hash) -> row, in least recently used order
+        self._rows = OrderedDict()
+        self._free_rows = []
+        self._used_rows = 0
+        self._embeddings = None
+        self._row_fingerprints = np.full(self.max_entries, -1, dtype=np.int64)
+        self._row_expires_at = np.zeros(self.max_entries, dtype=np.float64)
+        self._row_keys = [None] * self.max_entries
+        self._row_entries = [None] * self.max_entries
+
+    def _free_row(self, row):
+        self._rows.pop(self._row_keys[row], None)
+        self._row_fingerprints[row] = -1
+        self._row_keys[row] = None
+        self._row_entries[row] = None
+        self._free_rows.append(row)
+
+    def _allocate_row(self, now):
+        if self._free_rows:
+            return self._free_rows.pop()
+        if self._used_rows < self.max_entries:
+            self._used_rows += 1
+            return self._used_rows - 1
+
+        expired_rows = np.flatnonzero((self._row_fingerprints >= 0) & (self._row_expires_at <= now))
+        for row in expired_rows:
+            self._free_row(int(row))
+        self.evictions += len(expired_rows)
+        if self._free_rows:
+            return self._free_rows.pop()
+
+        # evict the least recently used answer
+        _, row = self._rows.popitem(last=False)
+        self._free_row(row)
+        self.evictions += 1
+        return self._free_rows.pop()
+
+    def lookup(self, query_embedding, profile_fingerprint):
+        """
+        Return the cached entry closest to the query embedding for this profile, if it is similar enough.
+        """
+        query_vector = None if query_embedding is None else normalise_embedding(query_embedding)
+        now = time.monotonic()
+
+        with self._lock:
+            self.lookups += 1
+            if query_vector is None or self._embeddings is None or query_vector.shape[0] != self._embeddings.shape[1]:
+                return None
+
+            used_rows = self._used_rows
+            candidates = (self._row_fingerprints[:used_rows] == get_fingerprint_code(profile_fingerprint)) & (
+                self._row_expires_at[:used_rows] > now
+            )
+            if not candidates.any():
+                return None
+
+            similarities = self._embeddings[:used_rows] @ query_vector
+            similarities[~candidates] = -np.inf
+            best_row = int(np.argmax(similarities))
+            best_similarity = float(similarities[best_row])
+            key = self._row_keys[best_row]
+            if best_similarity < self.similarity_threshold or key[0] != profile_fingerprint:
+                return None
+
+            # read through the LRU so that frequently asked questions stay cached
+            self._rows.move_to_end(key)
+            entry = self._row_entries[best_row]
+            self.hits += 1
+
+        logger.info(f"Semantic answer cache hit (similarity {best_similarity:.4f}) for: {entry['query']}")
+        return {**entry, "similarity": best_similarity}
+
+    def store(self, query, query_embedding, profile_fingerprint, answer_data):
+        """
+        Cache the answer generated for the query.
+        """
+        if query_embedding is None:
+            return
+
+        embedding = normalise_embedding(query_embedding)
+        key = (profile_fingerprint, hashlib.sha256(normalise_query(query).encode("utf-8")).hexdigest())
+        now = time.monotonic()
+
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+            elif embedding.shape[0] != self._embeddings.shape[1]:
+                logger.warning(f"Not caching an answer with a {embedding.shape[0]}-dimensional embedding")
+                return
+
+            row = self._rows.get(key)
+            if row is None:
+                row = self._allocate_row(now)
+            self._embeddings[row] = embedding
+            self._row_fingerprints[row] = get_fingerprint_code(profile_fingerprint)
+            self._row_expires_at[row] = now + self.ttl if self.ttl else np.inf
+            self._row_keys[row] = key
+            self._row_entries[row] = {"query": query, **answer_data}
+            self._rows[key] = row
+            self._rows.move_to_end(key)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            lookups, hits = self.lookups, self.hits
+            entries, evictions = len(self._rows), self.evictions
+        return {
+            "enabled": Config.SEMANTIC_CACHE_ENABLED,
+            "similarity_threshold": self.similarity_threshold,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "evictions": evictions,
+            "lookups": lookups,
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=Config.SEMANTIC_CACHE_SIMILARITY_THRESHOLD,
+    ttl=Config.SEMANTIC_CACHE_TTL,
+    max_entries=Config.SEMANTIC_CACHE_MAX_ENTRIES,
+)
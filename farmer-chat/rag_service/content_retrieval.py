@@ -2,67 +2,87 @@
 Content retrieval from Farmstack vector database
 """
 import logging
-import requests
-import urllib3
-from django_core.config import Config
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from common.http_client import a_http_request, http_request
+from django_core.config import Config
 
 logger = logging.getLogger(__name__)
 
+EMPTY_RETRIEVAL = {'chunks': [], 'reference': [], 'youtube_url': []}
+
+
+def get_retrieval_request(query, email_id):
+    """Build the Farmstack retrieval URL and payload"""
+    base_url = Config.CONTENT_DOMAIN_URL.rstrip('/')
+    endpoint = Config.CONTENT_RETRIEVAL_ENDPOINT.lstrip('/')
+    retrieval_url = f"{base_url}/{endpoint}"
+
+    # Use correct parameter names from original code
+    payload = {
+        "email": email_id,
+        "query": query,
+    }
+
+    logger.info(f"Farmstack URL: {retrieval_url}")
+    logger.info(f"Payload: {payload}")
+    return retrieval_url, payload
+
+
+def parse_retrieval_response(response):
+    """Extract the content chunks from a Farmstack retrieval response"""
+    if response is None:
+        logger.error("❌ Farmstack returned no response")
+        return dict(EMPTY_RETRIEVAL)
+
+    logger.info(f"Farmstack status: {response.status_code}")
+
+    if response.status_code == 200:
+        data = response.json()
+        logger.info(f"Farmstack response type: {type(data)}")
+
+        if isinstance(data, dict):
+            chunks = data.get('chunks') or data.get('results') or data.get('data') or []
+            if chunks:
+                logger.info(f"✅ Retrieved {len(chunks)} chunks from Farmstack")
+                return {
+                    'chunks': chunks,
+                    'reference': data.get('reference', []),
+                    'youtube_url': data.get('youtube_url', [])
+                }
+        elif isinstance(data, list) and data:
+            logger.info(f"✅ Retrieved {len(data)} chunks")
+            return {
+                'chunks': [{'text': item} if isinstance(item, str) else item for item in data],
+                'reference': [],
+                'youtube_url': []
+            }
+
+        logger.warning(f"⚠️ No chunks found. Response: {str(data)[:300]}")
+    else:
+        logger.error(f"❌ Farmstack error {response.status_code}: {response.text[:300]}")
+
+    return dict(EMPTY_RETRIEVAL)
+
 
 def retrieve_content(query, email_id, top_k=10):
     """Retrieve relevant content chunks from Farmstack vector database"""
     try:
-        base_url = Config.CONTENT_DOMAIN_URL.rstrip('/')
-        endpoint = Config.CONTENT_RETRIEVAL_ENDPOINT.lstrip('/')
-        retrieval_url = f"{base_url}/{endpoint}"
-        
-        # Use correct parameter names from original code
-        payload = {
-            "email": email_id,
-            "query": query,
-        }
-        
-        logger.info(f"Farmstack URL: {retrieval_url}")
-        logger.info(f"Payload: {payload}")
-        
-        response = requests.post(
-            retrieval_url,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=30,
-            verify=False
-        )
-        
-        logger.info(f"Farmstack status: {response.status_code}")
-        
-        if response.status_code == 200:
-            data = response.json()
-            logger.info(f"Farmstack response type: {type(data)}")
-            
-            if isinstance(data, dict):
-                chunks = data.get('chunks') or data.get('results') or data.get('data') or []
-                if chunks:
-                    logger.info(f"✅ Retrieved {len(chunks)} chunks from Farmstack")
-                    return {
-                        'chunks': chunks,
-                        'reference': data.get('reference', []),
-                        'youtube_url': data.get('youtube_url', [])
-                    }
-            elif isinstance(data, list) and data:
-                logger.info(f"✅ Retrieved {len(data)} chunks")
-                return {
-                    'chunks': [{'text': item} if isinstance(item, str) else item for item in data],
-                    'reference': [],
-                    'youtube_url': []
-                }
-            
-            logger.warning(f"⚠️ No chunks found. Response: {str(data)[:300]}")
-        else:
-            logger.error(f"❌ Farmstack error {response.status_code}: {response.text[:300]}")
-    
+        retrieval_url, payload = get_retrieval_request(query, email_id)
+        response = http_request("POST", retrieval_url, endpoint="retrieval", json=payload)
+        return parse_retrieval_response(response)
+    except Exception as e:
+        logger.error(f"❌ Retrieval failed: {e}", exc_info=True)
+
+    return dict(EMPTY_RETRIEVAL)
+
+
+async def a_retrieve_content(query, email_id, top_k=10):
+    """Retrieve relevant content chunks from Farmstack vector database without blocking the event loop"""
+    try:
+        retrieval_url, payload = get_retrieval_request(query, email_id)
+        response = await a_http_request("POST", retrieval_url, endpoint="retrieval", json=payload)
+        return parse_retrieval_response(response)
     except Exception as e:
         logger.error(f"❌ Retrieval failed: {e}", exc_info=True)
-    
-    return {'chunks': [], 'reference': [], 'youtube_url': []}
+
+    return dict(EMPTY_RETRIEVAL)
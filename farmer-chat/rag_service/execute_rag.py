@@ -2,14 +2,195 @@ import asyncio
 import logging
 from datetime import datetime
 
+from common.http_client import run_async
+from common.tracing import get_current_span, mark_skipped, span
+from django_core.config import Config
 from generation.generate_response import generate_query_response
-from rag_service.content_retrieval import retrieve_content
+from generation.stream_response import stream_query_response
+from rag_service.answer_cache import anonymise_answer, answer_cache, get_profile_fingerprint, personalise_answer
+from rag_service.content_retrieval import a_retrieve_content
+from rag_service.openai_service import get_text_embedding
 from rag_service.query_rephrase import rephrase_query
+from rag_service.stage_scheduler import StageScheduler
+from reranking.rerank import rerank_query
 
 logger = logging.getLogger(__name__)
 
 
-def execute_rag_pipeline(
+def is_same_query(rephrased_query, original_query):
+    """
+    Check whether rephrasing left the query effectively unchanged.
+    """
+    normalise = lambda query: " ".join(str(query).lower().strip(" ?.!\n\t").split())
+    return normalise(rephrased_query) == normalise(original_query)
+
+
+def build_context_chunks(retrieved_chunks, top_k=5, reranked=None):
+    """
+    Combine the top retrieved (or reranked, when reranking ran) chunks into the context string for generation.
+    """
+    if reranked and reranked.get('context_chunks'):
+        logger.info(f"Using {len(reranked['context_chunks'])} reranked chunks")
+        return "\n\n".join(reranked['context_chunks'][:top_k])
+
+    if not retrieved_chunks or not retrieved_chunks.get('chunks'):
+        logger.warning("No content retrieved from vector database")
+        return ""
+
+    logger.info(f"Retrieved {len(retrieved_chunks['chunks'])} chunks")
+    context_chunks = "\n\n".join([chunk.get('text', '') for chunk in retrieved_chunks['chunks'][:top_k]])
+    logger.info(f"Context length: {len(context_chunks)} characters")
+    return context_chunks
+
+
+def add_retrieval_stages(scheduler, query_in_english, email_id, chat_history, user_profile, retrieval_timings):
+    """
+    Register the rephrase, speculative retrieval, semantic cache lookup, retrieval and (optional) rerank stages.
+    Retrieval runs alongside the cache lookup and is cancelled on a hit.
+    Retrieval start and end times are written to retrieval_timings.
+    """
+    original_query = query_in_english
+    empty_retrieval = {'chunks': [], 'reference': [], 'youtube_url': []}
+    # the speculative retrieval runs as a task of its own, so that retrieval can reuse or cancel it
+    speculative_tasks = {}
+    cache_lookup_tasks = {}
+
+    def get_speculative_task():
+        if not Config.SPECULATIVE_RETRIEVAL_ENABLED:
+            return None
+        if "task" not in speculative_tasks:
+            speculative_tasks["task"] = asyncio.ensure_future(a_retrieve_content(original_query, email_id, top_k=10))
+        return speculative_tasks["task"]
+
+    def get_speculative_result():
+        # the speculative result, only if it has already finished successfully
+        task = get_speculative_task()
+        if task is None or not task.done() or task.cancelled() or task.exception() is not None:
+            return None
+        return task.result()
+
+    async def rephrase():
+        # Step 1: Rephrase query for better retrieval
+        logger.info("Step 1: Rephrasing query...")
+        rephrased = await rephrase_query(original_query, chat_history or [])
+        logger.info(f"Rephrased query: {rephrased}")
+        return rephrased or original_query
+
+    async def speculative_retrieval():
+        # Retrieve on the un-rephrased query while rephrasing is still in flight
+        task = get_speculative_task()
+        if task is None:
+            return None
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            logger.info("Speculative retrieval cancelled, the rephrased query differs")
+            mark_skipped()
+            return None
+
+    async def look_up_cached_answer(rephrase):
+        # Look for an answer already generated for a near-identical question and the same health profile
+        if not Config.SEMANTIC_CACHE_ENABLED:
+            return None
+        query_embedding = await get_text_embedding(rephrase)
+        profile_fingerprint = get_profile_fingerprint(user_profile)
+        return {
+            "embedding": query_embedding,
+            "profile_fingerprint": profile_fingerprint,
+            "entry": answer_cache.lookup(query_embedding, profile_fingerprint),
+        }
+
+    def get_cache_lookup_task(rephrase):
+        # shared by the cache_lookup and retrieval stages, so that the query is embedded once
+        if "task" not in cache_lookup_tasks:
+            cache_lookup_tasks["task"] = asyncio.ensure_future(look_up_cached_answer(rephrase))
+        return cache_lookup_tasks["task"]
+
+    async def cache_lookup(rephrase):
+        return await get_cache_lookup_task(rephrase)
+
+    async def retrieval(rephrase):
+        # retrieve while the query is embedded and looked up in the cache, and drop the retrieval on a hit
+        retrieval_task = asyncio.ensure_future(retrieve(rephrase))
+        try:
+            cached = await get_cache_lookup_task(rephrase)
+        except Exception as error:
+            logger.warning(f"Semantic cache lookup failed: {error}")
+            cached = None
+
+        if cached and cached["entry"]:
+            logger.info("Step 2: Skipping retrieval, answer served from the semantic cache")
+            retrieval_task.cancel()
+            speculative_task = get_speculative_task()
+            if speculative_task is not None:
+                speculative_task.cancel()
+            retrieval_timings.update({"retrieval_start": None, "retrieval_end": None})
+            mark_skipped()
+            return cached["entry"]["retrieved_chunks"]
+
+        return await retrieval_task
+
+    async def retrieve(rephrase):
+        speculative_task = get_speculative_task()
+        # Step 2: Retrieve relevant content chunks
+        logger.info("Step 2: Retrieving content from vector database...")
+        retrieval_timings["retrieval_start"] = datetime.now()
+        try:
+            if speculative_task is not None and is_same_query(rephrase, original_query):
+                logger.info("Rephrased query matches the original query, reusing speculative retrieval")
+                try:
+                    retrieved = await speculative_task
+                except Exception as error:
+                    logger.warning(f"Speculative retrieval failed ({error}), retrieving again")
+                    retrieved = await a_retrieve_content(rephrase, email_id, top_k=10)
+            else:
+                # the rephrased query differs: retrieve on it right away rather than after the speculative retrieval
+                retrieved = await a_retrieve_content(rephrase, email_id, top_k=10)
+                speculative_retrieval = get_speculative_result()
+                if not retrieved.get('chunks') and speculative_retrieval and speculative_retrieval.get('chunks'):
+                    logger.info("No chunks for the rephrased query, falling back to speculative retrieval")
+                    retrieved = speculative_retrieval
+                if speculative_task is not None:
+                    speculative_task.cancel()
+        finally:
+            retrieval_timings["retrieval_end"] = datetime.now()
+        return retrieved
+
+    async def rerank(rephrase, retrieval, cache_lookup):
+        if not Config.RERANK_ENABLED or (cache_lookup and cache_lookup["entry"]) or not retrieval.get('chunks'):
+            mark_skipped()
+            return None
+        logger.info("Reranking retrieved chunks...")
+        return await rerank_query(original_query, rephrase, email_id, retrieval['chunks'])
+
+    scheduler.add_stage("rephrase", rephrase, default=original_query)
+    scheduler.add_stage("speculative_retrieval", speculative_retrieval)
+    scheduler.add_stage("cache_lookup", cache_lookup, depends_on=("rephrase",))
+    scheduler.add_stage(
+        "retrieval",
+        retrieval,
+        depends_on=("rephrase",),
+        default=empty_retrieval,
+    )
+    scheduler.add_stage("rerank", rerank, depends_on=("rephrase", "retrieval", "cache_lookup"))
+
+
+def store_cached_answer(cache_result, rephrased_query, response, retrieved_chunks, user_name=None):
+    """
+    Add a freshly generated answer to the semantic answer cache, without the name of the user it addresses.
+    """
+    if cache_result and response:
+        answer_cache.store(
+            rephrased_query,
+            cache_result["embedding"],
+            cache_result["profile_fingerprint"],
+            {"response": anonymise_answer(response, user_name), "retrieved_chunks": retrieved_chunks},
+        )
+
+
+async def a_execute_rag_pipeline(
     query_in_english,
     input_language_detected,
     email_id,
@@ -19,7 +200,7 @@ def execute_rag_pipeline(
     user_profile=None,
 ):
     """
-    Execute the complete RAG pipeline with user profile integration
+    Execute the complete RAG pipeline with user profile integration within the caller's event loop
     
     Args:
         query_in_english: User query in English
@@ -37,59 +218,54 @@ def execute_rag_pipeline(
     message_data_update = {}
     
     original_query = query_in_english
-    rephrased_query = query_in_english
-    
-    retrieval_start = None
-    retrieval_end = None
-    retrieved_chunks = {}
-    context_chunks = ""
+    retrieval_timings = {"retrieval_start": None, "retrieval_end": None}
     
     logger.info(f"Starting RAG pipeline for: {query_in_english}")
-    
-    try:
-        # Step 1: Rephrase query for better retrieval
-        logger.info("Step 1: Rephrasing query...")
-        rephrased_query = asyncio.run(
-            rephrase_query(original_query, chat_history or [])
-        )
-        logger.info(f"Rephrased query: {rephrased_query}")
-        
-    except Exception as e:
-        logger.error(f"Query rephrasing failed: {e}", exc_info=True)
-        rephrased_query = original_query
-    
-    try:
-        # Step 2: Retrieve relevant content chunks
-        logger.info("Step 2: Retrieving content from vector database...")
-        retrieval_start = datetime.now()
+
+    async def generation(rephrase, retrieval, rerank, cache_lookup):
+        if cache_lookup and cache_lookup["entry"]:
+            logger.info("Step 3: Skipping generation, answer served from the semantic cache")
+            get_current_span().set(is_cached=True)
+            return {
+                'response': personalise_answer(cache_lookup["entry"]["response"], user_name),
+                'original_query': original_query,
+                'rephrased_query': rephrase,
+                'is_cached': True,
+            }
+
+        # Step 3: Generate response with user profile
+        logger.info("Step 3: Generating personalized response with OpenAI...")
         
-        retrieved_chunks = retrieve_content(
-            rephrased_query,
+        if user_profile:
+            logger.info(f"Using profile for {user_name}: {user_profile.get('allergies', [])}")
+
+        return await generate_query_response(
+            original_query,
+            user_name,
+            build_context_chunks(retrieval, reranked=rerank),
+            rephrase,
             email_id,
-            top_k=10
+            user_profile,
         )
-        
-        retrieval_end = datetime.now()
-        
-        if retrieved_chunks and 'chunks' in retrieved_chunks:
-            logger.info(f"Retrieved {len(retrieved_chunks['chunks'])} chunks")
-            
-            # Combine chunks into context string
-            context_chunks = "\n\n".join([
-                chunk.get('text', '') 
-                for chunk in retrieved_chunks['chunks'][:5]  # Use top 5 chunks
-            ])
-            
-            logger.info(f"Context length: {len(context_chunks)} characters")
-        else:
-            logger.warning("No content retrieved from vector database")
-            context_chunks = ""
-        
-    except Exception as e:
-        logger.error(f"Content retrieval failed: {e}", exc_info=True)
-        retrieval_end = datetime.now()
-        retrieved_chunks = {}
-        context_chunks = ""
+
+    scheduler = StageScheduler()
+    add_retrieval_stages(scheduler, original_query, email_id, chat_history, user_profile, retrieval_timings)
+    scheduler.add_stage("generation", generation, depends_on=("rephrase", "retrieval", "rerank", "cache_lookup"))
+    stage_results = await scheduler.run()
+
+    rephrased_query = stage_results["rephrase"]
+    retrieved_chunks = stage_results["retrieval"] or {}
+    generated_response = stage_results["generation"]
+    cache_result = stage_results["cache_lookup"]
+    is_cached = bool(generated_response and generated_response.get('is_cached'))
+
+    if generated_response and not is_cached:
+        store_cached_answer(
+            cache_result, rephrased_query, generated_response.get('response'), retrieved_chunks, user_name
+        )
+
+    retrieval_start = retrieval_timings["retrieval_start"]
+    retrieval_end = retrieval_timings["retrieval_end"]
     
     # Update response map with retrieval data
     response_map.update({
@@ -97,25 +273,8 @@ def execute_rag_pipeline(
         'retrieval_end': retrieval_end,
         'retrieved_chunks': retrieved_chunks,
     })
-    
-    try:
-        # Step 3: Generate response with user profile
-        logger.info("Step 3: Generating personalized response with OpenAI...")
-        
-        if user_profile:
-            logger.info(f"Using profile for {user_name}: {user_profile.get('allergies', [])}")
-        
-        generated_response = asyncio.run(
-            generate_query_response(
-                original_query,
-                user_name,
-                context_chunks,
-                rephrased_query,
-                email_id,
-                user_profile,
-            )
-        )
-        
+
+    if generated_response is not None:
         final_response = generated_response.get('response')
         
         if final_response:
@@ -133,13 +292,14 @@ def execute_rag_pipeline(
             'prompt_tokens': generated_response.get('prompt_tokens', 0),
             'total_tokens': generated_response.get('total_tokens', 0),
         })
-        
-    except Exception as e:
-        logger.error(f"Response generation failed: {e}", exc_info=True)
+    else:
         response_map.update({
             'generated_final_response': "I'm having trouble generating a response right now. Please try again.",
-            'generation_error': str(e),
+            'generation_error': "Response generation failed",
         })
+
+    response_map['stage_timings'] = scheduler.stage_timings
+    response_map['is_cached'] = is_cached
     
     # Prepare message data for database (future use)
     message_data_update = {
@@ -154,3 +314,110 @@ def execute_rag_pipeline(
     logger.info("RAG pipeline completed successfully")
     
     return response_map, message_data_update
+
+
+async def a_stream_rag_pipeline(
+    query_in_english,
+    email_id,
+    user_name=None,
+    chat_history=None,
+    user_profile=None,
+    rag_result=None,
+):
+    """
+    Run the retrieval stages of the RAG pipeline and stream the generated response as text deltas.
+    The rephrased query, retrieved chunks, timings and full response are written to rag_result
+    once the stream is exhausted.
+    """
+    rag_result = {} if rag_result is None else rag_result
+    original_query = query_in_english
+    retrieval_timings = {"retrieval_start": None, "retrieval_end": None}
+
+    logger.info(f"Starting streaming RAG pipeline for: {query_in_english}")
+
+    scheduler = StageScheduler()
+    add_retrieval_stages(scheduler, original_query, email_id, chat_history, user_profile, retrieval_timings)
+    stage_results = await scheduler.run()
+
+    rephrased_query = stage_results["rephrase"]
+    retrieved_chunks = stage_results["retrieval"] or {}
+    cache_result = stage_results["cache_lookup"]
+    is_cached = bool(cache_result and cache_result["entry"])
+
+    rag_result.update({
+        'rephrased_query': rephrased_query,
+        'retrieval_start': retrieval_timings["retrieval_start"],
+        'retrieval_end': retrieval_timings["retrieval_end"],
+        'retrieved_chunks': retrieved_chunks,
+        'stage_timings': scheduler.stage_timings,
+        'is_cached': is_cached,
+    })
+
+    if is_cached:
+        logger.info("Step 3: Skipping generation, answer served from the semantic cache")
+        final_response = personalise_answer(cache_result["entry"]["response"], user_name)
+        rag_result['generated_final_response'] = final_response
+        yield final_response
+        return
+
+    # Step 3: Stream response with user profile
+    logger.info("Step 3: Streaming personalized response with OpenAI...")
+    response_parts = []
+    generation_start_time = datetime.now()
+    with span("generation") as generation_span:
+        try:
+            async for delta in stream_query_response(
+                original_query,
+                user_name,
+                build_context_chunks(retrieved_chunks, reranked=stage_results["rerank"]),
+                rephrased_query,
+                email_id,
+                user_profile,
+            ):
+                response_parts.append(delta)
+                yield delta
+        except Exception as error:
+            logger.error(f"Response streaming failed: {error}", exc_info=True)
+            generation_span.error = str(error)
+            rag_result['generation_error'] = str(error)
+
+    final_response = "".join(response_parts)
+    if not final_response:
+        final_response = "I'm having trouble generating a response right now. Please try again."
+        yield final_response
+    else:
+        logger.info(f"Response streamed: {len(final_response)} characters")
+        if 'generation_error' not in rag_result:
+            store_cached_answer(cache_result, rephrased_query, final_response, retrieved_chunks, user_name)
+
+    rag_result.update({
+        'generated_final_response': final_response,
+        'generation_start_time': generation_start_time,
+        'generation_end_time': datetime.now(),
+    })
+
+
+def execute_rag_pipeline(
+    query_in_english,
+    input_language_detected,
+    email_id,
+    user_name=None,
+    message_id=None,
+    chat_history=None,
+    user_profile=None,
+):
+    """
+    Execute the complete RAG pipeline with user profile integration from synchronous code.
+    Runs all the pipeline stages inside one event loop.
+    """
+    return run_async(
+        a_execute_rag_pipeline(
+            query_in_english,
+            input_language_detected,
+            email_id,
+            user_name=user_name,
+            message_id=message_id,
+            chat_history=chat_history,
+            user_profile=user_profile,
+        )
+    )
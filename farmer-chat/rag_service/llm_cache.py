@@ -0,0 +1,153 @@
+"""
+Deterministic LLM response cache
+
+Chat completions are cached by (model, temperature, prompt hash), so that identical prompts at
+temperature 0 (e.g. rephrase and intent classification of recurring questions) skip the OpenAI call.
+Callers opt in per request through make_openai_request(use_cache=True).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from types import SimpleNamespace
+
+from common.cache import MISSING, DiskCache, MemoryCache, build_tiered_cache
+from django_core.config import Config
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_BACKENDS = ("memory", "redis", "disk")
+
+
+def get_llm_cache_key(model, temperature, prompt_message):
+    prompt_hash = hashlib.sha256(str(prompt_message).encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{model}:{float(temperature)}:{prompt_hash}".encode("utf-8")).hexdigest()
+
+
+class CachedChatCompletion:
+    """
+    Chat completion replayed from the cache, exposing the attributes callers read from an OpenAI response.
+    Usage is reported as zero tokens, with the tokens of the original request in saved_tokens.
+    """
+
+    is_cached = True
+
+    def __init__(self, payload):
+        self.model = payload.get("model")
+        self.choices = [SimpleNamespace(message=SimpleNamespace(role="assistant", content=payload.get("content")))]
+        self.usage = SimpleNamespace(completion_tokens=0, prompt_tokens=0, total_tokens=0)
+        self.saved_tokens = payload.get("total_tokens", 0)
+
+
+class LLMResponseCache:
+    """
+    Cache of chat completion payloads on the configured backend: memory (LRU), redis (memory in front of Redis)
+    or disk (memory in front of a directory of JSON files).
+    """
+
+    def __init__(self, backend="memory", max_entries=10000, ttl=None, directory=None, max_bytes=None):
+        if backend not in LLM_CACHE_BACKENDS:
+            logger.warning(f"Unknown LLM cache backend {backend}, using memory")
+            backend = "memory"
+
+        self.backend = backend
+        self.ttl = ttl
+        self.memory_cache = MemoryCache(max_entries=max_entries, ttl=ttl)
+        self.tiered_cache = build_tiered_cache("llm", max_entries, ttl) if backend == "redis" else None
+        self.disk_cache = DiskCache(directory, max_bytes=max_bytes, suffix=".json") if backend == "disk" else None
+        self.saved_tokens = 0
+
+    def get(self, key):
+        if self.tiered_cache:
+            return self.tiered_cache.get_many([key]).get(key)
+
+        payload = self.memory_cache.get(key, MISSING)
+        if payload is not MISSING:
+            return payload
+
+        if self.disk_cache:
+            cached_bytes = self.disk_cache.get(key)
+            if cached_bytes:
+                try:
+                    payload = json.loads(cached_bytes)
+                except ValueError:
+                    return None
+                if payload.get("expires_at") and payload["expires_at"] < time.time():
+                    return None
+                self.memory_cache.set(key, payload)
+                return payload
+        return None
+
+    def set(self, key, payload, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if self.tiered_cache:
+            self.tiered_cache.set_many({key: payload})
+            return
+
+        self.memory_cache.set(key, payload, ttl=ttl)
+        if self.disk_cache:
+            expires_at = time.time() + ttl if ttl else None
+            self.disk_cache.set(key, json.dumps({**payload, "expires_at": expires_at}).encode("utf-8"))
+
+    def lookup(self, model, temperature, prompt_message):
+        """
+        Return a CachedChatCompletion for the prompt, or None.
+        """
+        try:
+            payload = self.get(get_llm_cache_key(model, temperature, prompt_message))
+        except Exception as error:
+            logger.error(error, exc_info=True)
+            return None
+
+        if not payload:
+            return None
+        response = CachedChatCompletion(payload)
+        self.saved_tokens += response.saved_tokens
+        return response
+
+    def store(self, model, temperature, prompt_message, response, ttl=None):
+        """
+        Cache the content and token usage of a completed OpenAI response.
+        """
+        try:
+            content = response.choices[0].message.content
+            if content is None:
+                return
+            usage = getattr(response, "usage", None)
+            payload = {"model": model, "content": content, "total_tokens": getattr(usage, "total_tokens", 0) or 0}
+            self.set(get_llm_cache_key(model, temperature, prompt_message), payload, ttl)
+        except Exception as error:
+            logger.error(error, exc_info=True)
+
+    async def a_lookup(self, model, temperature, prompt_message):
+        """
+        lookup for the event loop: the Redis and disk tiers block, so they are read in a worker thread.
+        """
+        if self.backend == "memory":
+            return self.lookup(model, temperature, prompt_message)
+        return await asyncio.to_thread(self.lookup, model, temperature, prompt_message)
+
+    async def a_store(self, model, temperature, prompt_message, response, ttl=None):
+        """
+        store for the event loop, writing the Redis and disk tiers in a worker thread.
+        """
+        if self.backend == "memory":
+            self.store(model, temperature, prompt_message, response, ttl)
+            return
+        await asyncio.to_thread(self.store, model, temperature, prompt_message, response, ttl)
+
+    def stats(self):
+        stats = self.tiered_cache.stats() if self.tiered_cache else self.memory_cache.stats()
+        if self.disk_cache:
+            stats["disk"] = self.disk_cache.stats()
+        return {**stats, "backend": self.backend, "saved_tokens": self.saved_tokens}
+
+
+llm_cache = LLMResponseCache(
+    backend=Config.LLM_CACHE_BACKEND,
+    max_entries=Config.LLM_CACHE_MAX_ENTRIES,
+    ttl=Config.LLM_CACHE_TTL or None,
+    directory=Config.LLM_CACHE_DIR,
+    max_bytes=Config.LLM_CACHE_MAX_BYTES,
+)
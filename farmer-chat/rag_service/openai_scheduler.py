@@ -0,0 +1,177 @@
+"""
+Process-wide OpenAI client and rate-limit-aware request scheduler
+
+Every OpenAI request (generation, rephrase, intent, rerank, embeddings) acquires capacity from per-model
+RPM and TPM token buckets before it is sent. Lower priority classes must leave headroom in the buckets
+and yield to higher priority requests that are waiting, so that generation keeps flowing when the
+limits are tight. Rate limit errors pause all callers until the Retry-After time has passed.
+The RPM and TPM limits are those of the API key: the buckets are shared through Redis when REDIS_URL is set,
+otherwise each process gets 1/OPENAI_PROCESS_COUNT of them (see common.rate_limit.build_token_bucket).
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+import weakref
+from collections import Counter
+
+from common.http_client import register_loop_clients
+from common.rate_limit import build_token_bucket
+from django_core.config import Config
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_GENERATION = 0
+PRIORITY_REPHRASE = 1
+PRIORITY_INTENT = 2
+PRIORITY_RERANK = 3
+
+# share of each bucket a priority class has to leave free for the classes above it
+PRIORITY_HEADROOM = {
+    PRIORITY_GENERATION: 0.0,
+    PRIORITY_REPHRASE: 0.1,
+    PRIORITY_INTENT: 0.2,
+    PRIORITY_RERANK: 0.3,
+}
+
+SCHEDULER_POLL_INTERVAL = 0.05
+
+_async_clients = weakref.WeakKeyDictionary()
+register_loop_clients(_async_clients)
+
+
+def get_async_openai_client():
+    """
+    Return the shared AsyncOpenAI client for the running event loop.
+    Retries are disabled on the client, as they are coordinated by the scheduler.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(api_key=Config.OPEN_AI_KEY, max_retries=0)
+        _async_clients[loop] = client
+    return client
+
+
+def estimate_tokens(prompt_message, max_completion_tokens=None):
+    """
+    Rough token estimate of a request (about 4 characters per token) plus the expected completion.
+    """
+    if max_completion_tokens is None:
+        max_completion_tokens = int(Config.MAX_TOKENS)
+    return len(str(prompt_message)) // 4 + max_completion_tokens
+
+
+def get_retry_after(error):
+    """
+    Read the Retry-After delay, in seconds, from an OpenAI error response, if there is one.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class OpenAIScheduler:
+    """
+    Admission control for OpenAI requests across every caller in the process.
+    """
+
+    def __init__(self, model_limits=None, process_count=None):
+        self.model_limits = model_limits or {}
+        self.process_count = process_count or Config.OPENAI_PROCESS_COUNT
+        self.buckets = {}
+        self.blocked_until = 0.0
+        self.waiting = Counter()
+        self._lock = threading.Lock()
+
+    def get_buckets(self, model):
+        with self._lock:
+            if model not in self.buckets:
+                limits = self.model_limits.get(model, {})
+                rpm = limits.get("rpm", Config.OPENAI_DEFAULT_RPM)
+                tpm = limits.get("tpm", Config.OPENAI_DEFAULT_TPM)
+                self.buckets[model] = (
+                    build_token_bucket(f"openai:{model}:rpm", rpm, process_count=self.process_count),
+                    build_token_bucket(f"openai:{model}:tpm", tpm, process_count=self.process_count),
+                )
+            return self.buckets[model]
+
+    def has_higher_priority_waiting(self, priority):
+        with self._lock:
+            return any(count > 0 for waiting_priority, count in self.waiting.items() if waiting_priority < priority)
+
+    async def acquire(self, model, estimated_tokens, priority=PRIORITY_GENERATION):
+        """
+        Wait until the request fits the model's RPM and TPM budgets for its priority class.
+        """
+        request_bucket, token_bucket = self.get_buckets(model)
+        headroom = PRIORITY_HEADROOM.get(priority, PRIORITY_HEADROOM[PRIORITY_RERANK])
+
+        with self._lock:
+            self.waiting[priority] += 1
+        try:
+            while True:
+                wait_time = self.blocked_until - time.monotonic()
+                if wait_time > 0:
+                    await asyncio.sleep(wait_time + random.uniform(0, SCHEDULER_POLL_INTERVAL))
+                    continue
+
+                if self.has_higher_priority_waiting(priority):
+                    await asyncio.sleep(SCHEDULER_POLL_INTERVAL)
+                    continue
+
+                wait_time = await request_bucket.a_try_acquire(1, reserve=headroom * request_bucket.capacity)
+                if wait_time:
+                    await asyncio.sleep(min(wait_time, 1.0))
+                    continue
+
+                wait_time = await token_bucket.a_try_acquire(
+                    estimated_tokens, reserve=headroom * token_bucket.capacity
+                )
+                if wait_time:
+                    await request_bucket.a_refund(1)
+                    await asyncio.sleep(min(wait_time, 1.0))
+                    continue
+
+                return
+        finally:
+            with self._lock:
+                self.waiting[priority] -= 1
+
+    async def a_record_usage(self, model, estimated_tokens, used_tokens):
+        """
+        Correct the token bucket with the actual usage of a completed request.
+        """
+        _, token_bucket = self.get_buckets(model)
+        await token_bucket.a_refund(estimated_tokens - used_tokens)
+
+    def backoff(self, delay):
+        """
+        Pause every caller for delay seconds, e.g. after a rate limit error.
+        """
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        logger.warning(f"OpenAI rate limited, pausing requests for {delay:.2f} seconds")
+
+
+def load_model_limits():
+    try:
+        return json.loads(Config.OPENAI_MODEL_RATE_LIMITS) if Config.OPENAI_MODEL_RATE_LIMITS else {}
+    except json.JSONDecodeError as error:
+        logger.error(f"Invalid OPENAI_MODEL_RATE_LIMITS: {error}")
+        return {}
+
+
+openai_scheduler = OpenAIScheduler(load_model_limits())
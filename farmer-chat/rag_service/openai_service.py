@@ -4,6 +4,7 @@ import datetime
 import random
 import openai
 import time
+from types import SimpleNamespace
 from openai import (
     RateLimitError,
     APITimeoutError,
@@ -15,6 +16,15 @@ from openai import OpenAI, AsyncOpenAI
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import Filter, FieldCondition, MatchValue
 from common.constants import Constants
+from common.tracing import record_llm_call
+from rag_service.llm_cache import llm_cache
+from rag_service.openai_scheduler import (
+    PRIORITY_GENERATION,
+    estimate_tokens,
+    get_async_openai_client,
+    get_retry_after,
+    openai_scheduler,
+)
 
 
 async def make_openai_request(
@@ -25,27 +35,41 @@ async def make_openai_request(
     exponential_base: float = 2,
     jitter: bool = True,
     max_retries: int = 10,
+    priority=PRIORITY_GENERATION,
+    use_cache: bool = False,
+    cache_ttl=None,
 ):
     """
     Make OpenAI API request with the prompt message and other relevant OpenAI configuration.
+    Requests are admitted by the shared scheduler in priority order, within the model's rate limits.
+    With use_cache, a response cached for the same model, temperature and prompt is returned instead.
     """
-    async_client = AsyncOpenAI(api_key=Config.OPEN_AI_KEY)
-    openai.api_key = Config.OPEN_AI_KEY
+    if use_cache:
+        cached_response = await llm_cache.a_lookup(model, temperature, prompt_message)
+        if cached_response:
+            record_llm_call(cached_response)
+            return cached_response, "", 0
+
+    async_client = get_async_openai_client()
 
     exception_string = ""
     retries = 0
-    # base_delay = 5
-    # max_retries = 5
     delay = initial_delay
+    estimated_tokens = estimate_tokens(prompt_message)
     while retries < max_retries:
+        await openai_scheduler.acquire(model, estimated_tokens, priority)
         try:
-            # response = await openai.ChatCompletion.acreate(
             attempt_time = datetime.datetime.now()
             response = await async_client.chat.completions.create(
                 model=model,
                 messages=[{"role": "user", "content": prompt_message}],
                 temperature=temperature,
             )
+            if getattr(response, "usage", None):
+                await openai_scheduler.a_record_usage(model, estimated_tokens, response.usage.total_tokens)
+            if use_cache:
+                await llm_cache.a_store(model, temperature, prompt_message, response, cache_ttl)
+            record_llm_call(response, retries, exception_string)
             return response, exception_string, retries
         except (RateLimitError, APITimeoutError, InternalServerError) as e:
             e_time = datetime.datetime.now()
@@ -53,21 +77,112 @@ async def make_openai_request(
 
             print(f"Request failed (Retry {retries + 1}/{max_retries}): {e}")
 
-            # delay = base_delay * (2**retries)
             delay *= exponential_base * (1 + jitter * random.random())
+            retry_after = get_retry_after(e)
+            wait_time = min(retry_after if retry_after is not None else delay, Config.OPENAI_MAX_BACKOFF)
 
-            print(f"Retrying in {delay} seconds...")
-            await asyncio.sleep(delay)
-            # time.sleep(delay)
+            print(f"Retrying in {wait_time} seconds...")
+            if isinstance(e, RateLimitError):
+                # the limit is shared by every caller, so all of them back off together
+                openai_scheduler.backoff(wait_time)
+            else:
+                await asyncio.sleep(wait_time)
             retries += 1
         except Exception as e:
             e_time = datetime.datetime.now()
             exception_string += str(e) + f" \t{str((e_time-attempt_time).total_seconds())} seconds\n"
+            record_llm_call(None, retries, exception_string)
             return None, exception_string, retries
 
     print(f"Max retries reached ({max_retries}). Request failed.")
-    return (
-        None,
-        exception_string + f"\nMax retries reached ({max_retries}). Request failed.",
-        retries,
+    exception_string += f"\nMax retries reached ({max_retries}). Request failed."
+    record_llm_call(None, retries, exception_string)
+    return None, exception_string, retries
+
+
+async def get_text_embedding(text, model=Constants.EMBEDDING_MODEL):
+    """
+    Embed the text with the OpenAI embeddings API, returning None if the request fails.
+    """
+    async_client = get_async_openai_client()
+    try:
+        await openai_scheduler.acquire(model, len(str(text)) // 4 + 1, PRIORITY_GENERATION)
+        response = await async_client.embeddings.create(model=model, input=[text])
+        return response.data[0].embedding
+    except Exception as e:
+        print(f"Embedding request failed: {e}")
+        return None
+
+
+async def a_record_stream_usage(model, prompt_message, estimated_tokens, streamed_text, retries):
+    """
+    Correct the token bucket with the usage of a streamed completion, and record it on the current span.
+    The pinned openai client does not report the usage of a stream, so it is estimated from the streamed text.
+    """
+    prompt_tokens = estimate_tokens(prompt_message, max_completion_tokens=0)
+    completion_tokens = len("".join(streamed_text)) // 4
+    usage = SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
     )
+    await openai_scheduler.a_record_usage(model, estimated_tokens, usage.total_tokens)
+    record_llm_call(SimpleNamespace(usage=usage), retries)
+
+
+async def stream_openai_request(
+    prompt_message,
+    model=Config.GPT_3_MODEL,
+    temperature=0,
+    initial_delay: float = 1,
+    exponential_base: float = 2,
+    jitter: bool = True,
+    max_retries: int = 3,
+    priority=PRIORITY_GENERATION,
+):
+    """
+    Stream an OpenAI chat completion, yielding the content deltas as they arrive.
+    Failures are retried only until the first delta has been yielded. The token usage, estimated from the
+    streamed text, is recorded on the scheduler and the current span, as for make_openai_request.
+    """
+    async_client = get_async_openai_client()
+
+    retries = 0
+    delay = initial_delay
+    estimated_tokens = estimate_tokens(prompt_message)
+    while True:
+        started_streaming = False
+        await openai_scheduler.acquire(model, estimated_tokens, priority)
+        try:
+            stream = await async_client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt_message}],
+                temperature=temperature,
+                stream=True,
+            )
+            streamed_text = []
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        started_streaming = True
+                        streamed_text.append(delta)
+                        yield delta
+            finally:
+                await a_record_stream_usage(model, prompt_message, estimated_tokens, streamed_text, retries)
+            return
+        except (RateLimitError, APITimeoutError, InternalServerError) as e:
+            if started_streaming or retries >= max_retries:
+                raise
+
+            print(f"Streaming request failed (Retry {retries + 1}/{max_retries}): {e}")
+            delay *= exponential_base * (1 + jitter * random.random())
+            retry_after = get_retry_after(e)
+            wait_time = min(retry_after if retry_after is not None else delay, Config.OPENAI_MAX_BACKOFF)
+            if isinstance(e, RateLimitError):
+                openai_scheduler.backoff(wait_time)
+            else:
+                await asyncio.sleep(wait_time)
+            retries += 1
@@ -2,6 +2,8 @@
 Query rephrasing for better retrieval
 """
 import logging
+from django_core.config import Config
+from rag_service.openai_scheduler import PRIORITY_REPHRASE
 from rag_service.openai_service import make_openai_request
 
 logger = logging.getLogger(__name__)
@@ -18,7 +20,10 @@ Query: {original_query}
 
 Rephrased (concise):"""
 
-        response, error, retries = await make_openai_request(prompt)
+        # a cached response is recorded on the rephrase span with is_cached and saved_tokens, for its metrics row
+        response, error, retries = await make_openai_request(
+            prompt, priority=PRIORITY_REPHRASE, use_cache=Config.LLM_CACHE_ENABLED
+        )
         
         if response and response.choices:
             rephrased = response.choices[0].message.content.strip()
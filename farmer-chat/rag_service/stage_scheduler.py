@@ -0,0 +1,75 @@
+"""
+Dependency-driven scheduler for the query pipeline stages
+"""
+import asyncio
+import logging
+
+from common.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class StageScheduler:
+    """
+    Run async pipeline stages as a DAG, starting every stage as soon as the stages it depends on have finished.
+
+    Each stage function receives the results of its dependencies as keyword arguments named after them,
+    and runs inside a tracing span named after the stage. A failing stage is logged and resolves to its default, so that dependent stages can degrade gracefully.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.stage_timings = {}
+
+    def add_stage(self, name, stage_function, depends_on=(), default=None):
+        """
+        Register a stage. Dependencies must be registered before the stages depending on them.
+        """
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'")
+
+        self.stages[name] = {
+            "function": stage_function,
+            "depends_on": tuple(depends_on),
+            "default": default,
+        }
+
+    async def _run_stage(self, name, tasks):
+        """
+        Wait for the dependencies of a stage, run it and record its timings.
+        """
+        stage = self.stages[name]
+        dependency_results = {}
+        for dependency in stage["depends_on"]:
+            dependency_results[dependency] = await tasks[dependency]
+
+        with span(name) as stage_span:
+            try:
+                result = await stage["function"](**dependency_results)
+            except Exception as error:
+                logger.error(f"Pipeline stage '{name}' failed: {error}", exc_info=True)
+                stage_span.error = str(error)
+                result = stage["default"]
+
+        self.stage_timings[name] = {
+            "start_time": stage_span.start_time,
+            "end_time": stage_span.end_time,
+            "duration": stage_span.duration,
+        }
+        return result
+
+    async def run(self):
+        """
+        Run all the registered stages and return their results keyed by stage name.
+        """
+        tasks = {}
+        for name in self.stages:
+            tasks[name] = asyncio.ensure_future(self._run_stage(name, tasks))
+
+        results = await asyncio.gather(*tasks.values())
+        logger.info(
+            "Pipeline stage timings: "
+            + ", ".join(f"{name}={timing['duration']:.3f}s" for name, timing in self.stage_timings.items())
+        )
+        return dict(zip(tasks.keys(), results))
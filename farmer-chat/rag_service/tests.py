@@ -0,0 +1,345 @@
+import asyncio
+import inspect
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from django.test import SimpleTestCase
+from django_core.config import Config
+from openai.resources.chat.completions import AsyncCompletions
+from prometheus_client.values import MultiProcessValue
+
+from common.rate_limit import RedisTokenBucket
+from common.tracing import render_prometheus_metrics, span
+from rag_service.answer_cache import (
+    SemanticAnswerCache,
+    anonymise_answer,
+    get_profile_fingerprint,
+    personalise_answer,
+)
+from rag_service.execute_rag import a_execute_rag_pipeline
+from rag_service.llm_cache import LLMResponseCache
+from rag_service.openai_scheduler import OpenAIScheduler
+from rag_service.openai_service import stream_openai_request
+from rag_service.stage_scheduler import StageScheduler
+
+
+class StageSchedulerTests(SimpleTestCase):
+    async def test_stage_runs_after_its_dependencies_with_their_results(self):
+        order = []
+
+        async def first():
+            order.append("first")
+            return 1
+
+        async def second():
+            await asyncio.sleep(0.01)
+            order.append("second")
+            return 2
+
+        async def total(first, second):
+            order.append("total")
+            return first + second
+
+        scheduler = StageScheduler()
+        scheduler.add_stage("first", first)
+        scheduler.add_stage("second", second)
+        scheduler.add_stage("total", total, depends_on=("first", "second"))
+        results = await scheduler.run()
+
+        self.assertEqual(results, {"first": 1, "second": 2, "total": 3})
+        self.assertEqual(order, ["first", "second", "total"])
+        self.assertEqual(set(scheduler.stage_timings), {"first", "second", "total"})
+
+    async def test_independent_stages_run_concurrently(self):
+        first_started, second_started = asyncio.Event(), asyncio.Event()
+
+        async def first():
+            first_started.set()
+            await second_started.wait()
+
+        async def second():
+            second_started.set()
+            await first_started.wait()
+
+        scheduler = StageScheduler()
+        scheduler.add_stage("first", first)
+        scheduler.add_stage("second", second)
+        # each stage waits for the other to start, so running them one after the other never finishes
+        await asyncio.wait_for(scheduler.run(), timeout=1)
+
+    async def test_failing_stage_resolves_to_its_default(self):
+        async def translation():
+            raise RuntimeError("translation failed")
+
+        async def answer(translation):
+            return f"answer to {translation}"
+
+        scheduler = StageScheduler()
+        scheduler.add_stage("translation", translation, default="original query")
+        scheduler.add_stage("answer", answer, depends_on=("translation",))
+        results = await scheduler.run()
+
+        self.assertEqual(results["answer"], "answer to original query")
+
+    def test_unknown_dependency_is_rejected(self):
+        async def answer(translation):
+            return translation
+
+        with self.assertRaises(ValueError):
+            StageScheduler().add_stage("answer", answer, depends_on=("translation",))
+
+    async def test_cancelling_the_run_cancels_the_stages_in_flight(self):
+        started, cancelled, dependent_started = asyncio.Event(), asyncio.Event(), asyncio.Event()
+
+        async def slow():
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def dependent(slow):
+            dependent_started.set()
+
+        scheduler = StageScheduler()
+        scheduler.add_stage("slow", slow)
+        scheduler.add_stage("dependent", dependent, depends_on=("slow",))
+        run = asyncio.ensure_future(scheduler.run())
+        await started.wait()
+        run.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await run
+        self.assertTrue(cancelled.is_set())
+        self.assertFalse(dependent_started.is_set())
+
+
+@patch.object(Config, "SPECULATIVE_RETRIEVAL_ENABLED", True)
+@patch.object(Config, "SEMANTIC_CACHE_ENABLED", False)
+@patch.object(Config, "RERANK_ENABLED", False)
+class RagPipelineFanOutTests(SimpleTestCase):
+    """The retrieval stages of the RAG pipeline, with rephrasing, retrieval and generation replaced"""
+
+    def setUp(self):
+        self.retrieved_queries = []
+        self.speculative_cancelled = False
+        self.speculative_started = asyncio.Event()
+
+        async def a_retrieve_content(query, email_id, top_k=10):
+            self.retrieved_queries.append(query)
+            if query == "fever remedy":
+                # the speculative retrieval on the original query, slower than rephrasing
+                self.speculative_started.set()
+                try:
+                    await asyncio.sleep(0.2)
+                except asyncio.CancelledError:
+                    self.speculative_cancelled = True
+                    raise
+            return {"chunks": [{"text": f"chunk for {query}"}], "reference": [], "youtube_url": []}
+
+        patches = {
+            "a_retrieve_content": a_retrieve_content,
+            "rephrase_query": AsyncMock(side_effect=self.rephrase),
+            "generate_query_response": AsyncMock(return_value={"response": "Drink fluids."}),
+        }
+        self.mocks = {}
+        for name, mock in patches.items():
+            patcher = patch(f"rag_service.execute_rag.{name}", mock)
+            self.mocks[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+        self.rephrased_query = "home remedies for a fever"
+
+    async def rephrase(self, query, chat_history):
+        # retrieval on the original query is already running while the query is rephrased
+        await asyncio.wait_for(self.speculative_started.wait(), timeout=1)
+        return self.rephrased_query
+
+    async def test_retrieval_on_a_rephrased_query_cancels_the_speculative_retrieval(self):
+        response_map, message_data = await a_execute_rag_pipeline("fever remedy", "en", "asha@example.com")
+
+        self.assertEqual(self.retrieved_queries, ["fever remedy", "home remedies for a fever"])
+        self.assertTrue(self.speculative_cancelled)
+        self.assertEqual(response_map["generated_final_response"], "Drink fluids.")
+        self.assertEqual(message_data["rephrased_query"], "home remedies for a fever")
+        context_chunks = self.mocks["generate_query_response"].await_args.args[2]
+        self.assertEqual(context_chunks, "chunk for home remedies for a fever")
+
+    async def test_unchanged_query_reuses_the_speculative_retrieval(self):
+        self.rephrased_query = "Fever remedy?"
+
+        response_map, _ = await a_execute_rag_pipeline("fever remedy", "en", "asha@example.com")
+
+        self.assertEqual(self.retrieved_queries, ["fever remedy"])
+        self.assertFalse(self.speculative_cancelled)
+        self.assertEqual(response_map["retrieved_chunks"]["chunks"], [{"text": "chunk for fever remedy"}])
+        self.assertIsNotNone(response_map["retrieval_start"])
+
+    async def test_failed_rephrase_retrieves_on_the_original_query(self):
+        self.mocks["rephrase_query"].side_effect = RuntimeError("rephrase failed")
+
+        response_map, message_data = await a_execute_rag_pipeline("fever remedy", "en", "asha@example.com")
+
+        self.assertEqual(message_data["rephrased_query"], "fever remedy")
+        self.assertEqual(self.retrieved_queries, ["fever remedy"])
+        self.assertEqual(response_map["generated_final_response"], "Drink fluids.")
+
+
+class OpenAISchedulerTests(SimpleTestCase):
+    async def test_shared_buckets_are_called_off_the_event_loop(self):
+        script_threads = []
+
+        def run(mode, amount=0, reserve=0):
+            script_threads.append(threading.get_ident())
+            return 0.0, 100.0
+
+        scheduler = OpenAIScheduler(process_count=1)
+        scheduler.buckets["gpt-test"] = tuple(
+            RedisTokenBucket("redis://localhost:6379/0", f"rate_limit:openai:gpt-test:{name}", 60)
+            for name in ("rpm", "tpm")
+        )
+        with patch.object(RedisTokenBucket, "_run", side_effect=run):
+            await scheduler.acquire("gpt-test", 10)
+            await scheduler.a_record_usage("gpt-test", 10, 5)
+
+        self.assertEqual(len(script_threads), 3)
+        self.assertNotIn(threading.get_ident(), script_threads)
+
+
+class LLMResponseCacheTests(SimpleTestCase):
+    async def test_disk_tier_is_read_and_written_off_the_event_loop(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = LLMResponseCache(backend="disk", directory=directory.name, max_bytes=1024 * 1024)
+        disk_threads = []
+        disk_get, disk_set = cache.disk_cache.get, cache.disk_cache.set
+
+        def record_thread(method):
+            def call(*args, **kwargs):
+                disk_threads.append(threading.get_ident())
+                return method(*args, **kwargs)
+
+            return call
+
+        cache.disk_cache.get, cache.disk_cache.set = record_thread(disk_get), record_thread(disk_set)
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="fever"))], usage=SimpleNamespace(total_tokens=12)
+        )
+        await cache.a_store("gpt-test", 0, "rephrase: fever?", response)
+        cache.memory_cache.clear()
+        cached_response = await cache.a_lookup("gpt-test", 0, "rephrase: fever?")
+
+        self.assertEqual(cached_response.choices[0].message.content, "fever")
+        self.assertEqual(len(disk_threads), 2)
+        self.assertNotIn(threading.get_ident(), disk_threads)
+
+
+class StreamOpenAIRequestTests(SimpleTestCase):
+    def build_client(self, deltas):
+        async def create(**kwargs):
+            # the arguments must be accepted by the installed client
+            inspect.signature(AsyncCompletions.create).bind(None, **kwargs)
+
+            async def stream():
+                for delta in deltas:
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+            return stream()
+
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=AsyncMock(side_effect=create))))
+
+    @patch("rag_service.openai_service.openai_scheduler")
+    async def test_deltas_are_streamed_and_the_usage_estimated(self, openai_scheduler):
+        openai_scheduler.acquire = AsyncMock()
+        openai_scheduler.a_record_usage = AsyncMock()
+        client = self.build_client(["Drink ", "fluids."])
+        with patch("rag_service.openai_service.get_async_openai_client", return_value=client):
+            with span("generation") as generation_span:
+                deltas = [delta async for delta in stream_openai_request("x" * 400, model="gpt-test")]
+
+        self.assertEqual(deltas, ["Drink ", "fluids."])
+        self.assertEqual(generation_span.attributes["prompt_tokens"], 100)
+        self.assertEqual(generation_span.attributes["completion_tokens"], len("Drink fluids.") // 4)
+        model, _, used_tokens = openai_scheduler.a_record_usage.await_args.args
+        self.assertEqual((model, used_tokens), ("gpt-test", 100 + len("Drink fluids.") // 4))
+
+
+class PrometheusMultiprocessTests(SimpleTestCase):
+    def test_metrics_of_every_worker_process_are_exported(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # the value files another gunicorn worker writes in multiprocess mode
+        worker_value = MultiProcessValue(process_identifier=lambda: 4242)
+
+        with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory.name}):
+            stage_errors = worker_value(
+                "counter",
+                "farmer_chat_stage_errors",
+                "farmer_chat_stage_errors_total",
+                ("stage",),
+                ("generation",),
+                "Failed pipeline stages",
+            )
+            stage_errors.inc(2)
+            payload, _ = render_prometheus_metrics()
+
+        self.assertIn(b'farmer_chat_stage_errors_total{stage="generation"} 2.0', payload)
+
+
+class AnswerCacheProfileTests(SimpleTestCase):
+    def test_fingerprint_depends_only_on_the_health_profile(self):
+        profile = {"first_name": "Asha", "allergies": ["Peanuts", "dust"], "medical_conditions": ["asthma"]}
+        other_user = {"first_name": "Ravi", "allergies": ["Dust ", "peanuts"], "medical_conditions": ["Asthma"]}
+        self.assertEqual(get_profile_fingerprint(profile), get_profile_fingerprint(other_user))
+        self.assertNotEqual(get_profile_fingerprint(profile), get_profile_fingerprint({**profile, "allergies": []}))
+        self.assertEqual(get_profile_fingerprint(None), get_profile_fingerprint({"first_name": "Asha"}))
+
+    def test_cached_answer_is_personalised_for_the_user_served(self):
+        cached = anonymise_answer("Namaste Asha! Asha, drink fluids. Ashade is not a name.", "Asha")
+        self.assertNotIn("Asha ", cached)
+        self.assertEqual(personalise_answer(cached, "Ravi"), "Namaste Ravi! Ravi, drink fluids. Ashade is not a name.")
+        self.assertEqual(personalise_answer(cached, None), "Namaste User! User, drink fluids. Ashade is not a name.")
+        self.assertEqual(anonymise_answer("Drink fluids.", None), "Drink fluids.")
+
+
+@patch.object(Config, "SPECULATIVE_RETRIEVAL_ENABLED", False)
+@patch.object(Config, "SEMANTIC_CACHE_ENABLED", True)
+@patch.object(Config, "RERANK_ENABLED", False)
+class AnswerCachePipelineTests(SimpleTestCase):
+    def setUp(self):
+        patches = {
+            "answer_cache": SemanticAnswerCache(similarity_threshold=0.95),
+            "get_text_embedding": AsyncMock(return_value=[0.6, 0.8]),
+            "rephrase_query": AsyncMock(return_value="fever remedy"),
+            "a_retrieve_content": AsyncMock(return_value={"chunks": [{"text": "rest"}], "reference": []}),
+            "generate_query_response": AsyncMock(return_value={"response": "Asha, drink fluids."}),
+        }
+        self.mocks = {}
+        for name, mock in patches.items():
+            patcher = patch(f"rag_service.execute_rag.{name}", mock)
+            self.mocks[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def ask(self, user_name, allergies):
+        response_map, _ = await a_execute_rag_pipeline(
+            "fever remedy", "en", f"{user_name}@example.com", user_name=user_name, user_profile={"allergies": allergies}
+        )
+        return response_map
+
+    async def test_answer_is_reused_across_users_with_the_same_health_profile(self):
+        await self.ask("Asha", ["peanuts"])
+        response_map = await self.ask("Ravi", ["Peanuts"])
+
+        self.assertTrue(response_map["is_cached"])
+        self.assertEqual(response_map["generated_final_response"], "Ravi, drink fluids.")
+        self.mocks["generate_query_response"].assert_awaited_once()
+
+    async def test_answer_is_not_reused_for_a_different_health_profile(self):
+        await self.ask("Asha", ["peanuts"])
+        response_map = await self.ask("Ravi", ["penicillin"])
+
+        self.assertFalse(response_map["is_cached"])
+        self.assertEqual(self.mocks["generate_query_response"].await_count, 2)
@@ -1,3 +1,6 @@
+from database.db_operations import create_records_in_transaction
+from database.models import GenerationMetrics, RephraseMetrics, RerankMetrics, RetrievalMetrics
+from database.write_behind import get_current_write_batch
 from django_core.config import Config
 from generation.utils import insert_generation_data
 from rephrasing.utils import insert_rephrase_data
@@ -30,6 +33,87 @@ def post_process_rag_pipeline(
     return data_saved
 
 
+def get_span_llm_metrics(span):
+    """
+    Token, retry and exception columns shared by the LLM stage metrics tables.
+    """
+    return {
+        "completion_tokens": span.attributes.get("completion_tokens", 0),
+        "prompt_tokens": span.attributes.get("prompt_tokens", 0),
+        "total_tokens": span.attributes.get("total_tokens", 0),
+    }
+
+
+def build_trace_metrics_rows(trace, message_id):
+    """
+    Map the rephrase, retrieval, rerank and generation spans of a trace to rows of their metrics tables.
+    """
+    model_rows = []
+
+    rephrase_span = trace.get_span("rephrase")
+    if rephrase_span:
+        model_rows.append((RephraseMetrics, [{
+            "message": message_id,
+            "rephrase_start_time": rephrase_span.start_time,
+            "rephrase_end_time": rephrase_span.end_time,
+            **get_span_llm_metrics(rephrase_span),
+            "rephrase_exception": rephrase_span.attributes.get("exception") or rephrase_span.error,
+            "rephrase_retries": rephrase_span.attributes.get("retries", 0),
+            "is_cached": rephrase_span.attributes.get("is_cached", False),
+            "saved_tokens": rephrase_span.attributes.get("saved_tokens", 0),
+        }]))
+
+    retrieval_span = trace.get_span("retrieval")
+    if retrieval_span and not retrieval_span.attributes.get("skipped"):
+        model_rows.append((RetrievalMetrics, [{
+            "message": message_id,
+            "retrieval_start_time": retrieval_span.start_time,
+            "retrieval_end_time": retrieval_span.end_time,
+        }]))
+
+    rerank_span = trace.get_span("rerank")
+    if rerank_span and not rerank_span.attributes.get("skipped"):
+        model_rows.append((RerankMetrics, [{
+            "message": message_id,
+            "rerank_start_time": rerank_span.start_time,
+            "rerank_end_time": rerank_span.end_time,
+            **get_span_llm_metrics(rerank_span),
+            "rerank_exception": rerank_span.attributes.get("exception") or rerank_span.error,
+            "rerank_retries": rerank_span.attributes.get("retries", 0),
+        }]))
+
+    generation_span = trace.get_span("generation")
+    if generation_span:
+        model_rows.append((GenerationMetrics, [{
+            "message": message_id,
+            "generation_start_time": generation_span.start_time,
+            "generation_end_time": generation_span.end_time,
+            **get_span_llm_metrics(generation_span),
+            "response_gen_exception": generation_span.attributes.get("exception") or generation_span.error,
+            "response_gen_retries": generation_span.attributes.get("retries", 0),
+            "is_cached": generation_span.attributes.get("is_cached", False),
+            "saved_tokens": generation_span.attributes.get("saved_tokens", 0),
+        }]))
+
+    return model_rows
+
+
+def save_trace_metrics(trace, message_id, with_db_config=Config.WITH_DB_CONFIG):
+    """
+    Save the stage metrics of a query trace to DB in one batched write.
+    """
+    if not (with_db_config and trace and message_id):
+        return False
+
+    model_rows = build_trace_metrics_rows(trace, str(message_id))
+    write_batch = get_current_write_batch()
+    if write_batch is not None:
+        for model_class, rows in model_rows:
+            write_batch.insert(model_class, rows)
+        return True
+    return create_records_in_transaction(model_rows)
+
+
 def fetch_source_from_reranked_chunks(reranked_chunks):
     content_source = None
     highest_rank = -1
@@ -2,6 +2,7 @@ import datetime
 import asyncio
 
 from django_core.config import Config
+from rag_service.openai_scheduler import PRIORITY_REPHRASE
 from rag_service.openai_service import make_openai_request
 
 # Prefer Servvia medical-aware condense prompt; fall back to env prompt if not available
@@ -36,6 +37,8 @@ async def rephrase_query(original_query, chat_history=None):
     rephrase_total_tokens = 0
     rephrase_exception = None
     rephrase_retries = 0
+    is_cached = False
+    saved_tokens = 0
 
     rephrased_response.update(
         {
@@ -48,6 +51,8 @@ async def rephrase_query(original_query, chat_history=None):
             "total_tokens": rephrase_total_tokens,
             "rephrase_exception": rephrase_exception,
             "rephrase_retries": rephrase_retries,
+            "is_cached": is_cached,
+            "saved_tokens": saved_tokens,
         }
     )
 
@@ -55,9 +60,13 @@ async def rephrase_query(original_query, chat_history=None):
 
     if chat_history:
         condense_prompt = await condense_query_prompt(original_query, chat_history)
-        rephrased_question_response, rephrase_exception, rephrase_retries = await make_openai_request(condense_prompt)
+        rephrased_question_response, rephrase_exception, rephrase_retries = await make_openai_request(
+            condense_prompt, priority=PRIORITY_REPHRASE, use_cache=Config.LLM_CACHE_ENABLED
+        )
         if rephrased_question_response:
             rephrased_query = rephrased_question_response.choices[0].message.content
+            is_cached = getattr(rephrased_question_response, "is_cached", False)
+            saved_tokens = getattr(rephrased_question_response, "saved_tokens", 0)
             usage = getattr(rephrased_question_response, "usage", None)
             if usage:
                 rephrase_completion_tokens = getattr(usage, "completion_tokens", 0)
@@ -81,6 +90,8 @@ async def rephrase_query(original_query, chat_history=None):
             "total_tokens": rephrase_total_tokens,
             "rephrase_exception": rephrase_exception,
             "rephrase_retries": rephrase_retries,
+            "is_cached": is_cached,
+            "saved_tokens": saved_tokens,
         }
     )
 
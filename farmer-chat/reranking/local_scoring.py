@@ -0,0 +1,103 @@
+"""
+Local relevance scoring of retrieved chunks, used as a cheap first reranking stage
+"""
+import logging
+import math
+import re
+import threading
+from collections import Counter
+
+from django_core.config import Config
+
+try:
+    from sentence_transformers import CrossEncoder
+
+    CROSS_ENCODER_AVAILABLE = True
+except ImportError:
+    CROSS_ENCODER_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def bm25_scores(query, documents, k1=1.5, b=0.75):
+    """
+    Score each document against the query with Okapi BM25, using the documents themselves as the corpus.
+    """
+    tokenized_documents = [tokenize(document) for document in documents]
+    if not tokenized_documents:
+        return []
+
+    document_count = len(tokenized_documents)
+    average_length = sum(len(tokens) for tokens in tokenized_documents) / document_count or 1.0
+    document_frequencies = Counter(token for tokens in tokenized_documents for token in set(tokens))
+    query_tokens = set(tokenize(query))
+
+    scores = []
+    for tokens in tokenized_documents:
+        term_frequencies = Counter(tokens)
+        score = 0.0
+        for token in query_tokens:
+            frequency = term_frequencies.get(token, 0)
+            if not frequency:
+                continue
+            document_frequency = document_frequencies[token]
+            inverse_document_frequency = math.log(
+                1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5)
+            )
+            score += inverse_document_frequency * (
+                frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(tokens) / average_length))
+            )
+        scores.append(score)
+    return scores
+
+
+def get_cross_encoder():
+    """
+    Load the cross-encoder model once per process, returning None when it is unavailable.
+    """
+    global _cross_encoder
+    if not CROSS_ENCODER_AVAILABLE or not Config.RERANK_CROSS_ENCODER_MODEL:
+        return None
+    if _cross_encoder is None:
+        with _cross_encoder_lock:
+            if _cross_encoder is None:
+                try:
+                    _cross_encoder = CrossEncoder(Config.RERANK_CROSS_ENCODER_MODEL)
+                except Exception as error:
+                    logger.error(f"Could not load cross-encoder {Config.RERANK_CROSS_ENCODER_MODEL}: {error}")
+                    return None
+    return _cross_encoder
+
+
+def local_relevance_scores(query, documents):
+    """
+    Score the documents with the cross-encoder when it is installed, falling back to BM25.
+    """
+    cross_encoder = get_cross_encoder()
+    if cross_encoder is not None:
+        try:
+            return [float(score) for score in cross_encoder.predict([(query, document) for document in documents])]
+        except Exception as error:
+            logger.error(f"Cross-encoder scoring failed, using BM25: {error}", exc_info=True)
+    return bm25_scores(query, documents)
+
+
+def scale_to_relevance_scores(scores):
+    """
+    Min-max scale raw scores to the 1-10 relevance scale used by the LLM reranker.
+    """
+    if not scores:
+        return []
+    low, high = min(scores), max(scores)
+    if high == low:
+        return [5 for _ in scores]
+    return [round(1 + 9 * (score - low) / (high - low)) for score in scores]
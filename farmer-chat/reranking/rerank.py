@@ -1,15 +1,24 @@
 import asyncio
 import datetime
+import hashlib
 import json
 import logging
 import random
 import uuid
 
+from common.cache import MemoryCache
 from django_core.config import Config
+from django_core.servvia_prompts import RERANKING_PROMPT_LISTWISE_TEMPLATE
+from rag_service.openai_scheduler import PRIORITY_RERANK
 from rag_service.openai_service import make_openai_request
+from reranking.local_scoring import local_relevance_scores, scale_to_relevance_scores
 
 logger = logging.getLogger(__name__)
 
+# (query hash, chunk text hash) -> rerank result; keyed on the chunk text, as chunks without an id get
+# their position in the retrieval results
+rerank_score_cache = MemoryCache(max_entries=Config.RERANK_CACHE_MAX_ENTRIES, ttl=Config.RERANK_CACHE_TTL)
+
 
 def parse_single_rerank_json(json_string: str):
     """
@@ -22,10 +31,124 @@ def parse_single_rerank_json(json_string: str):
     return json.loads(json_content)
 
 
-async def rerank_query(original_query, rephrased_query, email_id, retrieval_results=[]):
+def parse_listwise_rerank_json(json_string: str):
+    """
+    Parse the list of reranked results of a listwise rerank prompt.
+    """
+    start_index = json_string.find("[")
+    end_index = json_string.rfind("]") + 1
+
+    json_content = json_string[start_index:end_index].strip()
+    return json.loads(json_content)
+
+
+def get_rerank_cache_key(rephrased_query, chunk_text):
+    query_hash = hashlib.sha256(" ".join(str(rephrased_query).lower().split()).encode("utf-8")).hexdigest()
+    chunk_hash = hashlib.sha256(str(chunk_text).encode("utf-8")).hexdigest()
+    return (query_hash, chunk_hash)
+
+
+def get_relevance_score(rerank_result):
+    try:
+        return int(float(rerank_result.get("relevance_score", 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    if not usage:
+        return 0, 0, 0
+    return usage.completion_tokens, usage.prompt_tokens, usage.total_tokens
+
+
+async def rerank_listwise(rephrased_query, docs_for_reranking):
     """
-    Rerank the retrieved content chunks with the rephrased query from OpenAI.
+    Score all the chunks with a single listwise prompt.
+    Returns the rerank results, the responses as (response, exception, retries) and whether the output parsed.
     """
+    chunks_text = "\n\n".join(
+        f"[id: {doc['id']}]\n{doc['text_chunk']}" for doc in docs_for_reranking
+    )
+    prompt = RERANKING_PROMPT_LISTWISE_TEMPLATE.format(question=rephrased_query, chunks=chunks_text)
+    response, exception, retries = await make_openai_request(prompt, model=Config.GPT_4_MODEL, priority=PRIORITY_RERANK)
+
+    rerank_results = []
+    is_parsed = False
+    if response:
+        try:
+            rerank_results = parse_listwise_rerank_json(response.choices[0].message.content)
+            is_parsed = True
+        except Exception as error:
+            logger.error(error, exc_info=True)
+    return rerank_results, [(response, exception, retries)], is_parsed
+
+
+async def rerank_pointwise(rephrased_query, docs_for_reranking):
+    """
+    Score each chunk with its own prompt, with at most RERANK_MAX_CONCURRENCY requests in flight.
+    """
+    semaphore = asyncio.Semaphore(Config.RERANK_MAX_CONCURRENCY)
+
+    async def rerank_single(rerank_doc):
+        prompt = Config.RERANKING_PROMPT_SINGLE_TEMPLATE.format(
+            json_example=Config.RERANK_SINGLE_JSON_EXAMPLE,
+            text=rerank_doc,
+            question=rephrased_query,
+        )
+        async with semaphore:
+            return await make_openai_request(prompt, model=Config.GPT_4_MODEL, priority=PRIORITY_RERANK)
+
+    reranking_results = await asyncio.gather(*(rerank_single(doc) for doc in docs_for_reranking))
+
+    rerank_results = []
+    is_parsed = True
+    for rerank_doc, (response, exception, retries) in zip(docs_for_reranking, reranking_results):
+        if not response:
+            is_parsed = False
+            continue
+        try:
+            rerank_result = parse_single_rerank_json(response.choices[0].message.content)
+        except Exception as error:
+            logger.error(error, exc_info=True)
+            is_parsed = False
+            continue
+        rerank_results.append({**rerank_result, "id": rerank_doc["id"]})
+    return rerank_results, reranking_results, is_parsed
+
+
+async def rerank_local(rephrased_query, docs_for_reranking):
+    """
+    Score the chunks locally with the cross-encoder or BM25, without any LLM request.
+    """
+    scores = await asyncio.to_thread(
+        local_relevance_scores, rephrased_query, [doc["text_chunk"] for doc in docs_for_reranking]
+    )
+    rerank_results = [
+        {"id": doc["id"], "classification": "YES", "relevance_score": relevance_score}
+        for doc, relevance_score in zip(docs_for_reranking, scale_to_relevance_scores(scores))
+    ]
+    return rerank_results, [], True
+
+
+RERANK_MODES = {
+    "listwise": rerank_listwise,
+    "pointwise": rerank_pointwise,
+    "local": rerank_local,
+}
+
+
+async def rerank_query(original_query, rephrased_query, email_id, retrieval_results=[], rerank_mode=None):
+    """
+    Rerank the retrieved content chunks with the rephrased query.
+
+    Modes (RERANK_MODE): "listwise" scores all chunks in one GPT-4 prompt, "pointwise" sends one prompt
+    per chunk with bounded concurrency and "local" uses the cross-encoder/BM25 scorer only.
+    Unless the mode is "local", the local scorer first prunes the chunks to RERANK_FIRST_STAGE_TOP_K.
+    Scores are cached per (query hash, chunk text hash), so only unscored chunks are sent to the LLM.
+    """
+    rerank_mode = rerank_mode or Config.RERANK_MODE
+    rerank_function = RERANK_MODES.get(rerank_mode, rerank_listwise)
     response_map = {}
     doc_map = None
     reranked_chunk_map = {}
@@ -69,9 +192,9 @@ async def rerank_query(original_query, rephrased_query, email_id, retrieval_resu
     if retrieval_results == []:
         return response_map
 
-    for data in retrieval_results:
+    for index, data in enumerate(retrieval_results):
         # chunk_id = random.randint(1, 1000)
-        chunk_id = data.get("id")
+        chunk_id = data.get("id") or str(index)
         doc_map.update(
             {
                 chunk_id: {
@@ -90,48 +213,59 @@ async def rerank_query(original_query, rephrased_query, email_id, retrieval_resu
             }
         )
 
-    sorted_reranked_list = []
-    rerank_prompt_list = [
-        Config.RERANKING_PROMPT_SINGLE_TEMPLATE.format(
-            json_example=Config.RERANK_SINGLE_JSON_EXAMPLE,
-            text=rerank_doc,
-            question=rephrased_query,
+    # cheap first stage: keep the chunks the local scorer ranks highest
+    if rerank_mode != "local" and len(docs_for_reranking) > Config.RERANK_FIRST_STAGE_TOP_K:
+        first_stage_scores = await asyncio.to_thread(
+            local_relevance_scores, rephrased_query, [doc["text_chunk"] for doc in docs_for_reranking]
         )
-        for rerank_doc in docs_for_reranking
-    ]
+        ranked_docs = sorted(zip(first_stage_scores, range(len(docs_for_reranking))), reverse=True)
+        docs_for_reranking = [
+            docs_for_reranking[doc_index] for _, doc_index in ranked_docs[: Config.RERANK_FIRST_STAGE_TOP_K]
+        ]
 
+    reranked_list = []
+    docs_to_score = []
+    for doc in docs_for_reranking:
+        cached_result = rerank_score_cache.get(get_rerank_cache_key(rephrased_query, doc["text_chunk"]))
+        if cached_result is not None:
+            reranked_list.append({**cached_result, "id": doc["id"]})
+        else:
+            docs_to_score.append(doc)
+    logger.info(f"Reranking {len(docs_to_score)} chunks ({rerank_mode}), {len(reranked_list)} scores cached")
+
+    is_rerank_response_parsed = True
     rerank_request_start_time = datetime.datetime.now()
-    reranking_results = await asyncio.gather(
-        *(
-            make_openai_request(prompt, model=Config.GPT_4_MODEL)
-            for prompt in rerank_prompt_list
+    if docs_to_score:
+        rerank_results, reranking_responses, is_rerank_response_parsed = await rerank_function(
+            rephrased_query, docs_to_score
         )
-    )
+    else:
+        rerank_results, reranking_responses = [], []
     rerank_request_end_time = datetime.datetime.now()
 
-    is_rerank_response_parsed = True
-    reranked_list = []
-    for response, exception, retries in reranking_results:
-        if response:
-            rerank_completion_tokens += response.usage.completion_tokens
-            rerank_prompt_tokens += response.usage.prompt_tokens
-            rerank_total_tokens += response.usage.total_tokens
-            try:
-                response_obj = parse_single_rerank_json(
-                    response.choices[0].message.content
-                )
-            except Exception as error:
-                logger.error(error, exc_info=True)
-                is_rerank_response_parsed = False
-                continue
-            if response_obj.get("classification") == "YES":
-                reranked_list.append(response_obj)
-        else:
-            is_rerank_response_parsed = False
+    for response, exception, retries in reranking_responses:
+        completion_tokens, prompt_tokens, total_tokens = usage_tokens(response)
+        rerank_completion_tokens += completion_tokens
+        rerank_prompt_tokens += prompt_tokens
+        rerank_total_tokens += total_tokens
         rerank_retries += retries
         rerank_exception += exception + "\n"
 
-    sorted_reranked_list = sorted(reranked_list, key=lambda x: x["relevance_score"])
+    scored_ids = {str(doc["id"]) for doc in docs_to_score}
+    for rerank_result in rerank_results:
+        chunk_id = rerank_result.get("id")
+        # the LLM may return ids as strings, map them back to the retrieved chunk ids
+        matched_ids = [doc_id for doc_id in doc_map if str(doc_id) == str(chunk_id)]
+        if not matched_ids or str(chunk_id) not in scored_ids:
+            continue
+        rerank_result = {**rerank_result, "id": matched_ids[0]}
+        rerank_score_cache.set(
+            get_rerank_cache_key(rephrased_query, doc_map[matched_ids[0]]["document"]), rerank_result
+        )
+        reranked_list.append(rerank_result)
+
+    reranked_list = [result for result in reranked_list if result.get("classification") == "YES"]
+    sorted_reranked_list = sorted(reranked_list, key=get_relevance_score, reverse=True)
 
     rerank_end_time = datetime.datetime.now()
 
@@ -144,7 +278,7 @@ async def rerank_query(original_query, rephrased_query, email_id, retrieval_resu
                 {
                     item.get("id"): {
                         "chunk": doc_map.get(item.get("id")),
-                        "rank": item.get("relevance_score"),
+                        "rank": get_relevance_score(item),
                     }
                 }
             )
@@ -161,7 +295,7 @@ async def rerank_query(original_query, rephrased_query, email_id, retrieval_resu
             "completion_tokens": rerank_completion_tokens,
             "prompt_tokens": rerank_prompt_tokens,
             "total_tokens": rerank_total_tokens,
-            "is_rerank_response_parsed": False,
+            "is_rerank_response_parsed": is_rerank_response_parsed,
             "rerank_exception": rerank_exception,
             "rerank_retries": rerank_retries,
             "context_chunks": context_chunks,
@@ -37,7 +37,7 @@ def content_retrieval(
             data={"email": email, "query": original_query},
             content_type="JSON",
             request_type="POST",
-            total_retry=3,
+            endpoint="retrieval",
         )
         # retrieved_content = response if len(response) >= 1 else None
         retrieved_content = (
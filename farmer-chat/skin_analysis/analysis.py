@@ -0,0 +1,74 @@
+from common.analysis_jobs import JOB_COMPLETED
+from .disease_detector import detect_skin_disease_gemini
+import logging
+
+logger = logging.getLogger(__name__)
+
+# commonly confused conditions, noted in the recommendations
+AMBIGUOUS_DISEASES = ["Heat Rash (Prickly Heat)", "Hives (Urticaria)"]
+
+
+def format_recommendations(disease, recommendations_list):
+    """Number the recommendations, with the ambiguity note of commonly confused conditions"""
+    # Format recommendations with proper line breaks and numbering
+    formatted_recommendations = ""
+    if recommendations_list:
+        for i, rec in enumerate(recommendations_list, 1):
+            formatted_recommendations += f"{i}. {rec}\n"
+
+    # Add ambiguity note for commonly confused conditions
+    ambiguity_note = ""
+    if disease in AMBIGUOUS_DISEASES:
+        ambiguity_note = (
+            "\n\n🔍 **Note:** Heat Rash and Hives look very similar in photos.\n\n"
+            "• Heat Rash: Usually after sweating/heat exposure, tiny uniform bumps\n\n"
+            "• Hives: Usually after allergic reaction, raised welts that come and go\n\n"
+            "Consider your recent activities to help determine which condition you have."
+        )
+
+    return formatted_recommendations + ambiguity_note
+
+
+def run_skin_analysis(analysis, image_source):
+    """
+    Analyse the image and, when the detection succeeds, save its result on the SkinAnalysis.
+    Returns the detection result.
+    """
+    result = detect_skin_disease_gemini(image_source)
+
+    # Check if detection was successful
+    if not result.get('success'):
+        logger.error(f"Detection failed: {result.get('error', 'Unable to analyze image')}")
+        return result
+
+    # Extract results
+    analysis.diagnosis = result.get('disease', 'Unknown')
+    analysis.confidence_score = result.get('confidence_score', 0.0)
+    analysis.recommendations = format_recommendations(analysis.diagnosis, result.get('recommendations', []))
+    analysis.result = result
+    analysis.status = JOB_COMPLETED
+    analysis.error = ''
+    analysis.save()
+
+    logger.info(f"✅ Analysis saved for {analysis.email_id}: {analysis.diagnosis} ({analysis.confidence_score*100:.1f}%)")
+    return result
+
+
+def build_skin_analysis_response(analysis, is_cached=False):
+    """Build the analysis response from a saved SkinAnalysis"""
+    result = analysis.result or {}
+    return {
+        'success': True,
+        'diagnosis': analysis.diagnosis,
+        'confidence': round((analysis.confidence_score or 0.0) * 100, 2),
+        'severity': result.get('severity', 'Unknown'),
+        'description': result.get('description', ''),
+        'recommendations': analysis.recommendations,
+        'urgency_note': result.get('urgency_note', ''),
+        'analysis_id': analysis.id,
+        'visual_analysis': result.get('visual_analysis', {}),
+        'distinguishing_features': result.get('distinguishing_features', ''),
+        'differential_diagnosis': result.get('differential_diagnosis', []),
+        'timestamp': result.get('timestamp', ''),
+        'is_cached': is_cached
+    }
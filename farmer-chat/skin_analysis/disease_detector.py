@@ -13,19 +13,18 @@ Model: Google Gemini 2.0 Flash
 Accuracy: 95%+ (enhanced with medical knowledge)
 Rate Limit: 15 requests/min, 1,500 requests/day (FREE)
 """
-import os
 import logging
-from PIL import Image
 import json
 
+from common.gemini_gateway import GEMINI_AVAILABLE, GeminiGatewayError, gateway_error_result, gemini_gateway
+from django_core.config import Config
+from skin_analysis.image_prescreen import prepare_image
+
 logger = logging.getLogger(__name__)
 
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
+if GEMINI_AVAILABLE:
     logger.info("✅ ServVia AI available")
-except ImportError:
-    GEMINI_AVAILABLE = False
+else:
     logger.error("❌ Gemini not available.  Install: pip install google-generativeai")
 
 
@@ -229,63 +228,18 @@ CONDITION_REMEDIES = {
 }
 
 
-def check_image_quality(image_path: str) -> dict:
+def check_image_quality(image_source) -> dict:
     """
     Check if image is suitable for skin disease detection
     
     Args:
-        image_path: Path to image file
+        image_source: Image bytes, path or PreparedImage
         
     Returns:
         dict with 'suitable', 'issues', 'suggestions'
     """
-    from PIL import Image, ImageStat
-    import numpy as np
-    
     try:
-        img = Image.open(image_path)
-        
-        # Convert to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Get image stats
-        stat = ImageStat.Stat(img)
-        
-        issues = []
-        suggestions = []
-        
-        # Check 1: Image brightness
-        avg_brightness = sum(stat.mean) / 3
-        if avg_brightness < 50:
-            issues.append("Image is too dark")
-            suggestions.append("Take photo in bright, natural light")
-        elif avg_brightness > 230:
-            issues.append("Image is overexposed")
-            suggestions.append("Avoid direct flash or harsh lighting")
-        
-        # Check 2: Image size (should be at least 300x300)
-        width, height = img.size
-        if width < 300 or height < 300:
-            issues. append(f"Image resolution too low ({width}x{height})")
-            suggestions.append("Take photo closer to affected area")
-        
-        # Check 3: Color variance (skin should have some variation)
-        color_variance = sum(stat.stddev) / 3
-        if color_variance < 10:
-            issues.append("Image has very little contrast")
-            suggestions.append("Ensure affected area is visible and in focus")
-        
-        suitable = len(issues) == 0
-        
-        return {
-            'suitable': suitable,
-            'issues': issues,
-            'suggestions': suggestions,
-            'brightness': avg_brightness,
-            'size': f"{width}x{height}",
-            'quality_score': 100 - (len(issues) * 20)
-        }
+        return prepare_image(image_source).quality
         
     except Exception as e:
         logger.warning(f"⚠️ Image quality check failed: {e}")
@@ -297,7 +251,7 @@ def check_image_quality(image_path: str) -> dict:
         }
 
 
-def measure_lesion_features(image_path: str) -> dict:
+def measure_lesion_features(image_source) -> dict:
     """
     Measure physical features of skin lesions from image
     
@@ -307,64 +261,13 @@ def measure_lesion_features(image_path: str) -> dict:
     - Lesion count
     
     Args:
-        image_path: Path to skin image
+        image_source: Image bytes, path or PreparedImage
         
     Returns:
         Dict with measured features
     """
     try:
-        from PIL import Image
-        import numpy as np
-        from scipy import ndimage
-        
-        img = Image.open(image_path)
-        img_array = np.array(img. convert('RGB'))
-        
-        # Get image dimensions for scale
-        height, width = img_array.shape[:2]
-        
-        # Detect red areas (potential lesions)
-        r, g, b = img_array[:,:,0], img_array[:,:,1], img_array[:,:,2]
-        red_mask = (r > 100) & (r > g + 20) & (r > b + 20)
-        
-        # Count lesions and estimate sizes
-        labeled, num_features = ndimage.label(red_mask)
-        
-        if num_features > 0:
-            sizes = ndimage.sum(red_mask, labeled, range(1, num_features + 1))
-            avg_size_pixels = np.mean(sizes)
-            size_std = np.std(sizes)
-            
-            # Estimate physical size (rough)
-            # Assume image is ~10cm across (typical phone photo)
-            pixels_per_mm = width / 100  # 100mm = 10cm
-            avg_size_mm = avg_size_pixels / (pixels_per_mm ** 2)
-            
-            uniformity = 1 - (size_std / avg_size_pixels if avg_size_pixels > 0 else 0)
-            
-            # Determine size category
-            if avg_size_mm < 2:
-                size_category = 'pinpoint'
-            elif avg_size_mm < 5:
-                size_category = 'small'
-            elif avg_size_mm < 15:
-                size_category = 'medium'
-            else:
-                size_category = 'large'
-            
-            return {
-                'num_lesions': int(num_features),
-                'avg_size_mm': float(avg_size_mm),
-                'size_uniformity': float(uniformity),
-                'size_category': size_category
-            }
-        else:
-            return {
-                'num_lesions': 0,
-                'avg_size_mm': 0,
-                'size_uniformity': 0,
-                'size_category': 'none'
-            }
+        return prepare_image(image_source).lesion_features
             
     except Exception as e:
         logger.warning(f"⚠️ Lesion measurement failed: {e}")
@@ -511,57 +414,20 @@ def apply_differential_diagnosis_rules(gemini_result: dict, measured_features: d
         'confidence': confidence
     }
 
-def validate_skin_image(image_path: str) -> dict:
+def validate_skin_image(image_source) -> dict:
     """
     Validate that the uploaded image is actually a skin photo, not a document/report
     
     SIMPLIFIED: Only reject obvious documents (white paper with text)
     
     Args:
-        image_path: Path to uploaded image
+        image_source: Image bytes, path or PreparedImage
         
     Returns:
         dict with 'is_skin_image', 'reason'
     """
     try:
-        from PIL import Image
-        import numpy as np
-        
-        img = Image.open(image_path)
-        img_array = np.array(img. convert('RGB'))
-        
-        height, width = img_array.shape[:2]
-        total_pixels = height * width
-        
-        # Get color channels
-        r, g, b = img_array[:,:,0], img_array[:,:,1], img_array[:,:,2]
-        
-        # ✅ ONLY CHECK: Is this mostly white background (like a document)?
-        # Pure white pixels (paper background)
-        white_pixels = np. sum((r > 240) & (g > 240) & (b > 240))
-        white_ratio = white_pixels / total_pixels
-        
-        # ✅ ONLY CHECK: Is this grayscale (like a scanned document)?
-        # Calculate how similar R, G, B channels are (grayscale has identical channels)
-        color_diff = np.mean(np.abs(r - g)) + np.mean(np.abs(g - b)) + np.mean(np.abs(r - b))
-        is_grayscale = color_diff < 10  # Very low color variation = grayscale
-        
-        # ✅ ONLY REJECT if BOTH conditions are true:
-        # 1. More than 65% white background (document paper)
-        # 2.  Mostly grayscale (black text on white paper)
-        if white_ratio > 0.65 and is_grayscale:
-            logger.info(f"🔍 Rejected: white_ratio={white_ratio:.2%}, grayscale={is_grayscale}")
-            return {
-                'is_skin_image': False,
-                'reason': 'This appears to be a document or text image.   Please upload a photograph of skin.'
-            }
-        
-        # ✅ Accept everything else (skin photos, even with hair, spots, etc.)
-        logger.info(f"✅ Image validation passed: white_ratio={white_ratio:.2%}, grayscale={is_grayscale}")
-        return {
-            'is_skin_image': True,
-            'reason': 'Image appears to be a valid skin photo'
-        }
+        return prepare_image(image_source).validation
         
     except Exception as e:
         logger.warning(f"⚠️ Image validation failed: {e}")
@@ -572,8 +438,10 @@ def validate_skin_image(image_path: str) -> dict:
         }
 
 
-def detect_skin_disease_gemini(image_path: str):
-    """.. ."""
+def detect_skin_disease_gemini(image_source):
+    """
+    Diagnose the skin image (bytes, path or PreparedImage), decoding it only once.
+    """
     if not GEMINI_AVAILABLE:
         return {
             'success': False,
@@ -581,43 +449,17 @@ def detect_skin_disease_gemini(image_path: str):
         }
     
     try:
-        # Configure Gemini - try multiple ways to get the API key
-        api_key = os.getenv('GEMINI_API_KEY')
-    
-        if not api_key:
-            api_key = os.environ.get('GEMINI_API_KEY')
-    
-        if not api_key:
-            # Try loading from Django settings
-            try:
-                from django.conf import settings
-                api_key = getattr(settings, 'GEMINI_API_KEY', None)
-            except:
-                pass
-    
-        if not api_key:
-            # Last resort: try loading . env file manually
-            try:
-                from dotenv import load_dotenv
-                load_dotenv()
-                api_key = os.getenv('GEMINI_API_KEY')
-            except:
-                pass
-    
-        logger.info(f"🔑 API Key status: {'Found' if api_key else 'NOT FOUND'} (length: {len(api_key) if api_key else 0})")
-    
-        if not api_key:
+        # ✅ NEW: Validate that this is actually a skin image
+        logger.info("🔍 Validating uploaded image...")
+        try:
+            prepared_image = prepare_image(image_source)
+        except Exception as e:
+            logger.error(f"Image processing error: {e}")
             return {
                 'success': False,
-                'error': 'GEMINI_API_KEY not found in environment variables.  Please check your .env file or settings. py'
+                'error': 'Invalid image file.  Please upload a valid JPG or PNG image.'
             }
-
-        
-        genai.configure(api_key=api_key)
-        
-        # ✅ NEW: Validate that this is actually a skin image
-        logger.info("🔍 Validating uploaded image...")
-        validation = validate_skin_image(image_path)
+        validation = prepared_image.validation
         
         if not validation['is_skin_image']:
             logger.warning(f"⚠️ Invalid image type: {validation['reason']}")
@@ -629,11 +471,8 @@ def detect_skin_disease_gemini(image_path: str):
         
         logger.info("✅ Image validation passed")
         
-        # Use stable Gemini model
-        model = genai.GenerativeModel('models/gemini-2.0-flash')
-        
-        # Load image
-        img = Image.open(image_path)
+        # the decoded, downsampled image is sent as it is
+        img = prepared_image.image
         
         # Create conditions list
         conditions_list = "\n".join([f"{i+1}. {condition}" for i, condition in enumerate(SERVVIA_SKIN_CONDITIONS)])
@@ -821,8 +660,8 @@ Analyze this image now - PAY SPECIAL ATTENTION TO LESION COUNT AND SIZE:"""
         logger.info(f"🔬 Stage 1: Analyzing with ServVia AI (AGGRESSIVE Heat Rash detection)...")
         
         # Generate response
-        response = model.generate_content([prompt, img])
-        response_text = response.text. strip()
+        # through the shared gateway, which holds the configured model and the client-side quota
+        response_text = gemini_gateway.generate_text(Config.GEMINI_SKIN_MODEL, [prompt, img])
         
         logger.info(f"📝 ServVia AI response received")
         
@@ -857,7 +696,7 @@ Analyze this image now - PAY SPECIAL ATTENTION TO LESION COUNT AND SIZE:"""
         
         # Stage 2: Measure physical features
         logger.info("🔬 Stage 2: Measuring lesion features...")
-        measured_features = measure_lesion_features(image_path)
+        measured_features = measure_lesion_features(prepared_image)
         
         logger.info(f"   Measured: {measured_features. get('num_lesions', 0)} lesions")
         logger. info(f"   Average size: {measured_features.get('avg_size_mm', 0):.1f}mm ({measured_features.get('size_category', 'unknown')})")
@@ -952,6 +791,10 @@ Analyze this image now - PAY SPECIAL ATTENTION TO LESION COUNT AND SIZE:"""
             'analyzed_by': 'servvia-enhanced-v2'
         }
         
+    except GeminiGatewayError as e:
+        logger.warning(f"⚠️ Detection not served: {e}")
+        return gateway_error_result(e)
+        
     except Exception as e:
         logger.error(f"❌ Detection error: {e}", exc_info=True)
         return {
@@ -960,12 +803,12 @@ Analyze this image now - PAY SPECIAL ATTENTION TO LESION COUNT AND SIZE:"""
         }
 
 
-def detect_skin_disease_multi(image_path: str, method: str = 'gemini'):
+def detect_skin_disease_multi(image_source, method: str = 'gemini'):
     """Multi-method skin disease detection"""
     logger.info(f"🔬 Starting detection with method: {method}")
     
     if method in ['gemini', 'auto']:
-        result = detect_skin_disease_gemini(image_path)
+        result = detect_skin_disease_gemini(image_source)
         
         if result. get('success'):
             logger. info(f"✅ Detection successful: {result.get('disease')}")
@@ -991,25 +834,7 @@ class SkinDiseaseDetector:
     def predict(self, image_file):
         """Predict from Django uploaded file"""
         try:
-            import tempfile
-            import io
-            
-            image_data = image_file.read()
-            image = Image.open(io.BytesIO(image_data))
-            
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-                image.save(tmp. name)
-                temp_path = tmp.name
-            
-            result = detect_skin_disease_gemini(temp_path)
-            
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+            result = detect_skin_disease_gemini(image_file.read())
             
             if result.get('success'):
                 disease = result.get('disease', 'Unknown')
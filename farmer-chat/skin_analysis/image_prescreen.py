@@ -0,0 +1,219 @@
+"""
+Single-pass pre-screening of uploaded skin images
+
+An upload is decoded once into a PreparedImage: the RGB image handed to the model, downsampled to
+SKIN_MODEL_IMAGE_MAX_SIDE, and a NumPy array at the smaller SKIN_WORKING_IMAGE_MAX_SIDE from which the
+document check and the quality statistics are computed in one vectorised pass. The lesion mask is
+computed at the full resolution of the upload, the one the diagnosis rules were tuned for, so a downsampled
+upload is decoded again at full size when its lesion features are first needed.
+"""
+import io
+import logging
+
+import numpy as np
+from django_core.config import Config
+from PIL import Image
+
+try:
+    from scipy import ndimage
+
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class PreparedImage:
+    """
+    A decoded upload with the statistics shared by the validation, quality and lesion checks.
+    """
+
+    def __init__(self, image, working_array, original_size, source=None):
+        self.image = image
+        self.working_array = working_array
+        self.original_size = original_size
+        self.source = source
+        self.stats = compute_image_statistics(working_array)
+        self._lesion_features = None
+
+    @property
+    def validation(self):
+        """
+        Reject only obvious documents: mostly white background and grayscale (black text on white paper).
+        """
+        white_ratio, is_grayscale = self.stats["white_ratio"], self.stats["is_grayscale"]
+        if white_ratio > 0.65 and is_grayscale:
+            logger.info(f"🔍 Rejected: white_ratio={white_ratio:.2%}, grayscale={is_grayscale}")
+            return {
+                'is_skin_image': False,
+                'reason': 'This appears to be a document or text image.   Please upload a photograph of skin.'
+            }
+
+        logger.info(f"✅ Image validation passed: white_ratio={white_ratio:.2%}, grayscale={is_grayscale}")
+        return {
+            'is_skin_image': True,
+            'reason': 'Image appears to be a valid skin photo'
+        }
+
+    @property
+    def quality(self):
+        """
+        Check that the image is bright, large and contrasted enough for detection.
+        """
+        issues, suggestions = [], []
+        avg_brightness = self.stats["brightness"]
+        if avg_brightness < 50:
+            issues.append("Image is too dark")
+            suggestions.append("Take photo in bright, natural light")
+        elif avg_brightness > 230:
+            issues.append("Image is overexposed")
+            suggestions.append("Avoid direct flash or harsh lighting")
+
+        width, height = self.original_size
+        if width < 300 or height < 300:
+            issues.append(f"Image resolution too low ({width}x{height})")
+            suggestions.append("Take photo closer to affected area")
+
+        if self.stats["contrast"] < 10:
+            issues.append("Image has very little contrast")
+            suggestions.append("Ensure affected area is visible and in focus")
+
+        return {
+            'suitable': len(issues) == 0,
+            'issues': issues,
+            'suggestions': suggestions,
+            'brightness': avg_brightness,
+            'size': f"{width}x{height}",
+            'quality_score': 100 - (len(issues) * 20)
+        }
+
+    @property
+    def lesion_features(self):
+        """
+        Count the red areas of the image and estimate their size, assuming the photo spans about 10cm.
+        Computed on first use, at the full resolution of the upload: the lesion count and size uniformity
+        of a downsampled mask differ from those the diagnosis rules were tuned on.
+        """
+        if self._lesion_features is None:
+            full_array = self.load_full_resolution_array()
+            self._lesion_features = measure_lesions(compute_red_mask(full_array), full_array.shape[1])
+        return self._lesion_features
+
+    def load_full_resolution_array(self):
+        """
+        Return the RGB array of the upload at its original size, decoding the source again if it was downsampled.
+        """
+        if self.image.size == self.original_size or self.source is None:
+            return np.asarray(self.image)
+
+        source = self.source
+        if not isinstance(source, Image.Image):
+            if hasattr(source, "seek"):
+                source.seek(0)
+            source = Image.open(source)
+        return np.asarray(source.convert("RGB"))
+
+
+def compute_image_statistics(image_array):
+    """
+    Compute the document and quality statistics of an RGB array in one pass over its channels.
+    Channel differences are taken in int16, as uint8 arithmetic wraps around.
+    """
+    channels = image_array.astype(np.int16)
+    r, g, b = channels[:, :, 0], channels[:, :, 1], channels[:, :, 2]
+    total_pixels = r.size
+
+    white_ratio = np.count_nonzero((r > 240) & (g > 240) & (b > 240)) / total_pixels
+    color_diff = (np.abs(r - g).mean() + np.abs(g - b).mean() + np.abs(r - b).mean())
+    channel_means = channels.reshape(-1, 3).mean(axis=0)
+    channel_stddevs = channels.reshape(-1, 3).std(axis=0)
+
+    return {
+        "white_ratio": float(white_ratio),
+        "color_diff": float(color_diff),
+        "is_grayscale": bool(color_diff < 10),
+        "brightness": float(channel_means.mean()),
+        "contrast": float(channel_stddevs.mean()),
+    }
+
+
+def compute_red_mask(image_array):
+    """
+    Mask the red pixels of an RGB array, the potential lesions.
+    """
+    channels = image_array.astype(np.int16)
+    r, g, b = channels[:, :, 0], channels[:, :, 1], channels[:, :, 2]
+    return (r > 100) & (r > g + 20) & (r > b + 20)
+
+
+def measure_lesions(red_mask, width):
+    """
+    Label the connected red areas of the mask and summarise their count, size and uniformity.
+    """
+    if not SCIPY_AVAILABLE:
+        return {'num_lesions': 0, 'avg_size_mm': 0, 'size_uniformity': 0, 'size_category': 'unknown'}
+
+    labeled, num_features = ndimage.label(red_mask)
+    if num_features == 0:
+        return {'num_lesions': 0, 'avg_size_mm': 0, 'size_uniformity': 0, 'size_category': 'none'}
+
+    sizes = np.bincount(labeled.ravel())[1:]
+    avg_size_pixels = sizes.mean()
+    pixels_per_mm = width / 100  # 100mm = 10cm
+    avg_size_mm = avg_size_pixels / (pixels_per_mm ** 2)
+    uniformity = 1 - (sizes.std() / avg_size_pixels if avg_size_pixels > 0 else 0)
+
+    if avg_size_mm < 2:
+        size_category = 'pinpoint'
+    elif avg_size_mm < 5:
+        size_category = 'small'
+    elif avg_size_mm < 15:
+        size_category = 'medium'
+    else:
+        size_category = 'large'
+
+    return {
+        'num_lesions': int(num_features),
+        'avg_size_mm': float(avg_size_mm),
+        'size_uniformity': float(uniformity),
+        'size_category': size_category
+    }
+
+
+def prepare_image(image_source, model_max_side=None, working_max_side=None):
+    """
+    Decode an upload (bytes, a file object, a path or a PIL image) once into a PreparedImage.
+    A PreparedImage is returned as it is.
+    """
+    if isinstance(image_source, PreparedImage):
+        return image_source
+
+    model_max_side = model_max_side or Config.SKIN_MODEL_IMAGE_MAX_SIDE
+    working_max_side = working_max_side or Config.SKIN_WORKING_IMAGE_MAX_SIDE
+
+    if isinstance(image_source, Image.Image):
+        image = image_source
+        original_size = image.size
+    else:
+        if isinstance(image_source, (bytes, bytearray, memoryview)):
+            image_source = io.BytesIO(image_source)
+        image = Image.open(image_source)
+        original_size = image.size
+        # JPEGs are decoded directly at a reduced scale when they are much larger than needed
+        image.draft("RGB", (model_max_side, model_max_side))
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > model_max_side:
+        # the source is kept intact for the full resolution lesion mask
+        if image is image_source:
+            image = image.copy()
+        image.thumbnail((model_max_side, model_max_side), Image.LANCZOS)
+
+    working_image = image
+    if max(image.size) > working_max_side:
+        working_image = image.copy()
+        working_image.thumbnail((working_max_side, working_max_side), Image.BILINEAR)
+
+    return PreparedImage(image, np.asarray(working_image), original_size, source=image_source)
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.4 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("skin_analysis", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="skinanalysis",
+            name="image_phash",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name="skinanalysis",
+            name="image_dhash",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name="skinanalysis",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="skinanalysis",
+            name="result",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
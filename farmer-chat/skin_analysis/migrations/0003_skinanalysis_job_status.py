@@ -0,0 +1,38 @@
+# Generated by Django 4.2.4 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("skin_analysis", "0002_skinanalysis_upload_hashes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="skinanalysis",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                db_index=True,
+                default="completed",
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="skinanalysis",
+            name="error",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="skinanalysis",
+            name="webhook_url",
+            field=models.URLField(blank=True, max_length=500),
+        ),
+    ]
@@ -1,11 +1,20 @@
 from django.db import models
 
+from common.analysis_jobs import JOB_COMPLETED, JOB_STATUS_CHOICES
+
 class SkinAnalysis(models. Model):
     email_id = models.EmailField()
     image = models.ImageField(upload_to='skin_images/')
     diagnosis = models.CharField(max_length=255, blank=True)
     confidence_score = models.FloatField(null=True, blank=True)
     recommendations = models.TextField(blank=True)
+    image_phash = models.CharField(max_length=16, blank=True)
+    image_dhash = models.CharField(max_length=16, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    result = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=JOB_STATUS_CHOICES, default=JOB_COMPLETED, db_index=True)
+    error = models.TextField(blank=True)
+    webhook_url = models.URLField(max_length=500, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
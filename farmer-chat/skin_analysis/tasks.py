@@ -0,0 +1,38 @@
+from celery import shared_task
+from common.analysis_jobs import TERMINAL_JOB_STATUSES, notify_webhook, retry_or_fail_job, start_job
+from django_core.config import Config
+from .analysis import build_skin_analysis_response, run_skin_analysis
+from .image_prescreen import prepare_image
+from .models import SkinAnalysis
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(
+    bind=True,
+    acks_late=True,
+    rate_limit=Config.ANALYSIS_JOB_RATE_LIMIT,
+    max_retries=Config.ANALYSIS_JOB_MAX_RETRIES,
+)
+def analyze_skin_image_task(self, analysis_id):
+    """Analyse the image of a submitted SkinAnalysis job"""
+    analysis = SkinAnalysis.objects.filter(id=analysis_id).first()
+    if analysis is None or analysis.status in TERMINAL_JOB_STATUSES:
+        return
+
+    start_job(analysis)
+    logger.info(f"🔬 Analysing skin image job {analysis.id} (attempt {self.request.retries + 1})")
+
+    try:
+        with analysis.image.open('rb') as image_file:
+            prepared_image = prepare_image(image_file.read())
+        result = run_skin_analysis(analysis, prepared_image)
+    except Exception as e:
+        logger.error(f"Skin analysis job error: {e}", exc_info=True)
+        result = {'success': False, 'error': f'An unexpected error occurred: {str(e)}'}
+
+    if not result.get('success'):
+        retry_or_fail_job(self, analysis, result.get('error', 'Unable to analyze image'), result.get('retry_after'))
+
+    notify_webhook(analysis, build_skin_analysis_response)
@@ -1,3 +1,100 @@
-from django.test import TestCase
+import io
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+import numpy as np
+
+from django.test import SimpleTestCase
+from django_core.config import Config
+from PIL import Image, ImageDraw
+from rest_framework.test import APIRequestFactory
+
+from common.upload_cache import compute_image_hashes, is_near_duplicate
+from skin_analysis.image_prescreen import SCIPY_AVAILABLE, compute_red_mask, measure_lesions, prepare_image
+from skin_analysis.views import submit_skin_analysis_job
+
+
+def make_photo(size=(256, 256)):
+    image = Image.new("RGB", size, (205, 160, 140))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((60, 70, 150, 170), fill=(150, 60, 50))
+    draw.rectangle((170, 30, 230, 220), fill=(90, 70, 60))
+    return image
+
+
+def reencode(image, size=None, quality=70):
+    if size:
+        image = image.resize(size)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return Image.open(io.BytesIO(buffer.getvalue()))
+
+
+class IsNearDuplicateTests(SimpleTestCase):
+    def test_identical_hashes_are_near_duplicates(self):
+        hashes = {"phash": "f0f0f0f0f0f0f0f0", "dhash": "0123456789abcdef"}
+        self.assertTrue(is_near_duplicate(hashes, dict(hashes), max_distance=0))
+
+    def test_both_hashes_must_be_within_the_distance(self):
+        hashes = {"phash": "0000000000000000", "dhash": "0000000000000000"}
+        # 3 bits apart on the pHash, 7 on the dHash
+        other_hashes = {"phash": "0000000000000007", "dhash": "000000000000007f"}
+        self.assertTrue(is_near_duplicate(hashes, other_hashes, max_distance=7))
+        self.assertFalse(is_near_duplicate(hashes, other_hashes, max_distance=6))
+
+    def test_missing_or_invalid_hashes_are_not_near_duplicates(self):
+        hashes = {"phash": "0000000000000000", "dhash": "0000000000000000"}
+        self.assertFalse(is_near_duplicate(hashes, {"phash": "0000000000000000"}))
+        self.assertFalse(is_near_duplicate(hashes, {"phash": "not hex", "dhash": "0000000000000000"}))
+        self.assertFalse(is_near_duplicate(hashes, None))
+
+    def test_reencoded_and_resized_photo_is_a_near_duplicate(self):
+        photo = make_photo()
+        copy = reencode(photo, size=(200, 200))
+        self.assertTrue(is_near_duplicate(compute_image_hashes(photo), compute_image_hashes(copy)))
+
+    def test_different_photo_is_not_a_near_duplicate(self):
+        photo = make_photo()
+        other_photo = make_photo().transpose(Image.FLIP_LEFT_RIGHT).rotate(90)
+        self.assertFalse(is_near_duplicate(compute_image_hashes(photo), compute_image_hashes(other_photo)))
+
+
+@skipUnless(SCIPY_AVAILABLE, "scipy is not installed")
+class LesionFeaturesTests(SimpleTestCase):
+    def make_spotted_photo(self, size=2000, spacing=40, radius=2):
+        image = Image.new("RGB", (size, size), (200, 185, 175))
+        draw = ImageDraw.Draw(image)
+        for x in range(spacing // 2, size, spacing):
+            for y in range(spacing // 2, size, spacing):
+                draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=(200, 40, 40))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return image, buffer.getvalue()
+
+    def test_lesions_are_measured_at_the_full_resolution_of_the_upload(self):
+        image, upload = self.make_spotted_photo()
+        prepared_image = prepare_image(upload, model_max_side=1024, working_max_side=768)
+        full_array = np.asarray(image)
+
+        self.assertLess(max(prepared_image.image.size), image.width)
+        self.assertEqual(prepared_image.lesion_features, measure_lesions(compute_red_mask(full_array), image.width))
+        self.assertEqual(prepared_image.lesion_features["num_lesions"], 50 * 50)
+
+    def test_a_pil_image_source_is_not_downsampled_in_place(self):
+        image, _ = self.make_spotted_photo()
+        prepared_image = prepare_image(image, model_max_side=1024, working_max_side=768)
+
+        self.assertEqual(image.size, (2000, 2000))
+        self.assertEqual(prepared_image.lesion_features["num_lesions"], 50 * 50)
+
+
+class SubmitSkinAnalysisJobTests(SimpleTestCase):
+    @patch.object(Config, "CELERY_BROKER_URL", None)
+    @patch("skin_analysis.views.analyze_skin_image_task")
+    def test_jobs_are_unavailable_without_a_broker(self, analyze_skin_image_task):
+        request = APIRequestFactory().post("/api/skin-analysis/analyze/async/", {"email_id": "asha@example.com"})
+        response = submit_skin_analysis_job(request)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data["error_type"], "jobs_unavailable")
+        analyze_skin_image_task.delay.assert_not_called()
@@ -3,5 +3,8 @@ from . import views
 
 urlpatterns = [
     path('analyze/', views.analyze_skin_image, name='analyze_skin'),
+    path('analyze/async/', views.submit_skin_analysis_job, name='submit_skin_analysis_job'),
+    path('jobs/<int:job_id>/', views.get_skin_analysis_job, name='skin_analysis_job'),
+    path('jobs/<int:job_id>/events/', views.stream_skin_analysis_job, name='skin_analysis_job_events'),
     path('history/', views. get_skin_analysis_history, name='skin_history'),
 ]
\ No newline at end of file
@@ -1,172 +1,254 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from rest_framework. decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from . models import SkinAnalysis
-from .disease_detector import SkinDiseaseDetector, detect_skin_disease_gemini, validate_skin_image
+from .analysis import build_skin_analysis_response, run_skin_analysis
+from .disease_detector import SkinDiseaseDetector
+from .image_prescreen import prepare_image
+from .tasks import analyze_skin_image_task
+from common.gemini_gateway import get_retry_after_headers
+from common.analysis_jobs import (
+    JOB_COMPLETED,
+    JOB_PENDING,
+    build_job_response,
+    clean_webhook_url,
+    find_active_job,
+    is_job_queue_configured,
+    stream_job_events,
+)
+from common.upload_cache import compute_content_hash, compute_image_hashes, find_cached_analysis, is_near_duplicate
 import logging
-import tempfile
-import os
-from PIL import Image
-import io
 
 logger = logging. getLogger(__name__)
 detector = SkinDiseaseDetector()
 
+def read_skin_upload(request):
+    """
+    Check, decode and validate the uploaded image, and hash it.
+    Returns (upload, None), or (None, error Response) when the upload is rejected.
+    """
+    email = request.data.get('email_id')
+    if not email: 
+        return None, Response({
+            'success': False,
+            'error':  'Email is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    image_file = request. FILES.get('image')
+    if not image_file:
+        return None, Response({
+            'success':  False,
+            'error': 'Image file is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Decode the image once; validation and analysis share the decoded image and its statistics
+    try:
+        image_data = image_file.read()
+        prepared_image = prepare_image(image_data)
+    except Exception as e:
+        logger.error(f"Image processing error: {e}")
+        return None, Response({
+            'success': False,
+            'error': 'Invalid image file.  Please upload a valid JPG or PNG image.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Validate that this is actually a skin image
+    logger.info("🔍 Validating uploaded image...")
+    validation = prepared_image.validation
+    
+    if not validation['is_skin_image']:
+        logger. warning(f"⚠️ Invalid image type: {validation['reason']}")
+        
+        return None, Response({
+            'success': False,
+            'error': validation['reason'],
+            'error_type':  'invalid_image_type',
+            'suggestion': 'Please upload a clear photograph of the affected skin area.  Documents, lab reports, screenshots, and text images are not supported.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    logger.info("✅ Image validation passed - proceeding with analysis")
+
+    # Reset file pointer for saving
+    image_file.seek(0)
+    return {
+        'email': email,
+        'image_file': image_file,
+        'prepared_image': prepared_image,
+        'content_hash': compute_content_hash(image_data),
+        'image_hashes': compute_image_hashes(prepared_image.image),
+    }, None
+
+
+def find_cached_skin_analysis(upload):
+    """A re-upload of the same photo by the user reuses its analysis instead of calling the model again"""
+    image_hashes = upload['image_hashes']
+    return find_cached_analysis(
+        SkinAnalysis,
+        upload['email'],
+        upload['content_hash'],
+        lambda analysis: is_near_duplicate(image_hashes, {'phash': analysis.image_phash, 'dhash': analysis.image_dhash}),
+    )
+
+
+def build_skin_analysis(upload, **fields):
+    return SkinAnalysis(
+        email_id=upload['email'],
+        image=upload['image_file'],
+        image_phash=upload['image_hashes']['phash'],
+        image_dhash=upload['image_hashes']['dhash'],
+        content_hash=upload['content_hash'],
+        **fields
+    )
+
+
+def build_skin_job_response(analysis):
+    response = build_job_response(analysis, build_skin_analysis_response)
+    response['status_url'] = reverse('skin_analysis_job', args=[analysis.id])
+    response['events_url'] = reverse('skin_analysis_job_events', args=[analysis.id])
+    return response
+
+
 @api_view(['POST'])
 def analyze_skin_image(request):
     """Endpoint to upload and analyze skin images"""
-    temp_path = None
-    
     try:
-        email = request.data.get('email_id')
-        if not email: 
+        upload, error_response = read_skin_upload(request)
+        if error_response:
+            return error_response
+
+        cached_analysis = find_cached_skin_analysis(upload)
+        if cached_analysis:
+            return Response(build_skin_analysis_response(cached_analysis, is_cached=True))
+
+        # Save analysis to database once the detection succeeds
+        analysis = build_skin_analysis(upload)
+        result = run_skin_analysis(analysis, upload['prepared_image'])
+
+        if not result.get('success'):
             return Response({
                 'success': False,
-                'error':  'Email is required'
-            }, status=status.HTTP_400_BAD_REQUEST)
+                'error': result.get('error', 'Unable to analyze image'),
+                'error_type': result.get('error_type', 'analysis_failed')
+            }, status=result.get('status_code', status.HTTP_500_INTERNAL_SERVER_ERROR), headers=get_retry_after_headers(result))
+
+        return Response(build_skin_analysis_response(analysis))
         
-        image_file = request. FILES.get('image')
-        if not image_file:
-            return Response({
-                'success':  False,
-                'error': 'Image file is required'
-            }, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Skin analysis error: {e}", exc_info=True)
         
-        # Save image to temp file for validation
+        return Response({
+            'success': False,
+            'error': f'An unexpected error occurred: {str(e)}'
+        }, status=status. HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+def submit_skin_analysis_job(request):
+    """
+    Endpoint to upload a skin image for background analysis.
+    Returns a job to poll (jobs/<id>/) or follow as server-sent events (jobs/<id>/events/);
+    with webhook_url, the final job status is also posted there.
+    Answers 503 when no job broker is configured.
+    """
+    if not is_job_queue_configured():
+        return Response({
+            'success': False,
+            'error': 'Background analysis is not available, use analyze/ instead',
+            'error_type': 'jobs_unavailable'
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    try:
         try:
-            image_data = image_file. read()
-            image = Image. open(io.BytesIO(image_data))
-            
-            # Convert to RGB if needed
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Save to temp file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-                image.save(tmp. name)
-                temp_path = tmp.name
-        except Exception as e:
-            logger.error(f"Image processing error: {e}")
-            return Response({
-                'success': False,
-                'error': 'Invalid image file.  Please upload a valid JPG or PNG image.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Validate that this is actually a skin image
-        logger.info("🔍 Validating uploaded image...")
-        validation = validate_skin_image(temp_path)
-        
-        if not validation['is_skin_image']:
-            logger. warning(f"⚠️ Invalid image type: {validation['reason']}")
-            
-            # Clean up temp file
-            try: 
-                os.unlink(temp_path)
-            except: 
-                pass
-            
+            webhook_url = clean_webhook_url(request.data.get('webhook_url'))
+        except ValidationError:
             return Response({
                 'success': False,
-                'error': validation['reason'],
-                'error_type':  'invalid_image_type',
-                'suggestion': 'Please upload a clear photograph of the affected skin area.  Documents, lab reports, screenshots, and text images are not supported.'
+                'error': 'Invalid webhook URL'
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        logger.info("✅ Image validation passed - proceeding with analysis")
 
-        # Use detect_skin_disease_gemini directly with temp_path
-        result = detect_skin_disease_gemini(temp_path)
+        upload, error_response = read_skin_upload(request)
+        if error_response:
+            return error_response
 
-        # Clean up temp file
-        try: 
-            os.unlink(temp_path)
-        except:
-            pass
+        cached_analysis = find_cached_skin_analysis(upload)
+        if cached_analysis:
+            response = build_skin_job_response(cached_analysis)
+            response['result']['is_cached'] = True
+            return Response(response)
 
-        # Check if detection was successful
-        if not result. get('success'):
-            error_message = result.get('error', 'Unable to analyze image')
-            logger.error(f"Detection failed: {error_message}")
-    
-            return Response({
-                'success': False,
-                'error': error_message
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        analysis = find_active_job(SkinAnalysis, upload['email'], upload['content_hash'])
+        if analysis:
+            logger.info(f"♻️ Following skin analysis job {analysis.id} for {upload['email']}")
+            return Response(build_skin_job_response(analysis), status=status.HTTP_202_ACCEPTED)
 
-        # Extract results
-        disease = result.get('disease', 'Unknown')
-        confidence_score = result.get('confidence_score', 0.0)
-        recommendations_list = result.get('recommendations', [])
-        
-        # Add additional metadata
-        severity = result.get('severity', 'Unknown')
-        urgency_note = result.get('urgency_note', '')
-        description = result. get('description', '')
-
-        # Format recommendations with proper line breaks and numbering
-        formatted_recommendations = ""
-        if recommendations_list: 
-            for i, rec in enumerate(recommendations_list, 1):
-                formatted_recommendations += f"{i}. {rec}\n"
-
-        # Add ambiguity note for commonly confused conditions
-        ambiguity_note = ""
-        if disease in ["Heat Rash (Prickly Heat)", "Hives (Urticaria)"]:
-            ambiguity_note = (
-                "\n\n🔍 **Note:** Heat Rash and Hives look very similar in photos.\n\n"
-                "• Heat Rash: Usually after sweating/heat exposure, tiny uniform bumps\n\n"
-                "• Hives: Usually after allergic reaction, raised welts that come and go\n\n"
-                "Consider your recent activities to help determine which condition you have."
-            )
-
-        # Build final recommendations with ambiguity note
-        recommendations = formatted_recommendations + ambiguity_note
-
-        # Save analysis to database
-        # Reset file pointer for saving
-        image_file.seek(0)
-
-        analysis = SkinAnalysis. objects.create(
-            email_id=email,
-            image=image_file,
-            diagnosis=disease,
-            confidence_score=confidence_score,
-            recommendations=recommendations
-        )
-
-        logger.info(f"✅ Analysis saved for {email}: {disease} ({confidence_score*100:.1f}%)")
+        analysis = build_skin_analysis(upload, status=JOB_PENDING, webhook_url=webhook_url)
+        analysis.save()
+        analyze_skin_image_task.delay(analysis.id)
+        logger.info(f"📥 Skin analysis job {analysis.id} submitted for {upload['email']}")
+
+        analysis.refresh_from_db()
+        return Response(build_skin_job_response(analysis), status=status.HTTP_202_ACCEPTED)
 
-        return Response({
-            'success': True,
-            'diagnosis': disease,
-            'confidence': round(confidence_score * 100, 2),
-            'severity': severity,
-            'description': description,
-            'recommendations': recommendations,
-            'urgency_note': urgency_note,
-            'analysis_id': analysis.id,
-            'visual_analysis': result.get('visual_analysis', {}),
-            'distinguishing_features': result. get('distinguishing_features', ''),
-            'differential_diagnosis':  result.get('differential_diagnosis', []),
-            'timestamp': result.get('timestamp', '')
-        })
-        
     except Exception as e:
-        logger.error(f"Skin analysis error: {e}", exc_info=True)
-        
-        # Clean up temp file if it exists
-        if temp_path:
-            try: 
-                os.unlink(temp_path)
-            except:
-                pass
-        
+        logger.error(f"Skin analysis job submission error: {e}", exc_info=True)
         return Response({
             'success': False,
             'error': f'An unexpected error occurred: {str(e)}'
         }, status=status. HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def get_user_skin_analysis(job_id, email):
+    return SkinAnalysis.objects.filter(id=job_id, email_id=email).first()
+
+
+@api_view(['GET'])
+def get_skin_analysis_job(request, job_id):
+    """Get the status, and once completed the result, of a skin analysis job"""
+    email = request.query_params.get('email_id')
+    if not email:
+        return Response({
+            'success': False,
+            'error': 'Email is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    analysis = get_user_skin_analysis(job_id, email)
+    if analysis is None:
+        return Response({
+            'success': False,
+            'error': 'Job not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(build_skin_job_response(analysis))
+
+
+async def stream_skin_analysis_job(request, job_id):
+    """
+    Follow a skin analysis job as server-sent events.
+    Events: status (on every change), then result and done, error and done, or timeout.
+    """
+    email = request.GET.get('email_id')
+    if not email:
+        return JsonResponse({'success': False, 'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    analysis = await sync_to_async(get_user_skin_analysis, thread_sensitive=False)(job_id, email)
+    if analysis is None:
+        return JsonResponse({'success': False, 'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    def load_job_response():
+        analysis.refresh_from_db()
+        return build_skin_job_response(analysis)
+
+    response = StreamingHttpResponse(stream_job_events(load_job_response), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 @api_view(['GET'])
 def get_skin_analysis_history(request):
     """Get user's skin analysis history"""
@@ -179,7 +261,7 @@ def get_skin_analysis_history(request):
                 'error': 'Email is required'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        analyses = SkinAnalysis.objects.filter(email_id=email).order_by('-created_at')[:10]
+        analyses = SkinAnalysis.objects.filter(email_id=email, status=JOB_COMPLETED).order_by('-created_at')[:10]
         
         results = [{
             'id': a.id,